@@ -0,0 +1,193 @@
+"""Benchmark of getting data and metadata through cinfdata
+
+The benchmark runs against a local sqlite3 stand in for the database (see
+sqlite_backend.py), filled with synthetic measurements of the given lengths, in groups
+of the given sizes. For each combination it reports throughput, latency percentiles and
+the peak memory allocated by the calls, for data coming from the database (cold), from
+the disk cache (warm) and from the memory cache. The peak memory is measured in a
+separate pass from the timed calls:
+
+    python bench_cinfdata.py
+    python bench_cinfdata.py --lengths 1000,100000 --group-sizes 1,10,100 --repeat 50
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from timeit import default_timer
+
+import numpy as np
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'cinf_database'))
+from cinfdata import Cinfdata, Cache, ConnectionPool  # noqa: E402
+from sqlite_backend import make_database, connection_factory  # noqa: E402
+
+
+SETUP_NAME = 'bench'
+ROW = '{:<42} {:>6} {:>8} {:>6} {:>10} {:>9} {:>9} {:>9} {:>9} {:>9}'
+
+
+def result_nbytes(result):
+    """Return the number of bytes of data in the result of a call"""
+    if isinstance(result, np.ndarray):
+        return result.nbytes
+    if isinstance(result, dict):
+        return sum(result_nbytes(value) for value in result.values())
+    return 0
+
+
+def measure(function, arguments, repeat):
+    """Call function repeat times, cycling through arguments
+
+    The calls are timed without tracemalloc running, since tracing slows down every
+    allocation. The peak memory is measured in a separate pass, of one call per
+    argument, after the timed calls.
+
+    Returns:
+        dict: The number of calls, the total time, the number of bytes returned, the
+            latencies in seconds and the peak allocated memory in bytes (or None)
+    """
+    latencies = []
+    nbytes = 0
+    for call_number in range(repeat):
+        argument = arguments[call_number % len(arguments)]
+        start = default_timer()
+        result = function(argument)
+        latencies.append(default_timer() - start)
+        nbytes += result_nbytes(result)
+    return {'calls': repeat, 'total_time': sum(latencies), 'nbytes': nbytes,
+            'latencies': np.array(latencies),
+            'peak': peak_memory(function, arguments[:repeat])}
+
+
+def peak_memory(function, arguments):
+    """Return the peak memory allocated while calling function once per argument
+
+    Returns:
+        int: The peak in bytes, or None if tracemalloc is not available
+    """
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        for argument in arguments:
+            function(argument)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def print_result(name, group_size, length, result):
+    """Print a row of the results table"""
+    percentiles = np.percentile(result['latencies'], [50, 90, 99]) * 1e3
+    megabytes_per_second = result['nbytes'] / 1e6 / result['total_time']
+    peak = '-' if result['peak'] is None else '{:.1f}'.format(result['peak'] / 1e6)
+    print(ROW.format(
+        name, group_size, length, result['calls'],
+        '{:.1f}'.format(result['calls'] / result['total_time']),
+        '{:.1f}'.format(megabytes_per_second) if result['nbytes'] else '-',
+        '{:.3f}'.format(percentiles[0]), '{:.3f}'.format(percentiles[1]),
+        '{:.3f}'.format(percentiles[2]), peak,
+    ))
+
+
+def benchmark_setup(work_dir, length, group_size, number_of_groups, repeat):
+    """Benchmark get_data and get_data_group for one array length and group size"""
+    name = 'bench_{}_{}'.format(length, group_size)
+    database_file = os.path.join(work_dir, name + '.sqlite')
+    times = make_database(database_file, SETUP_NAME, group_size * number_of_groups,
+                          length, group_size=group_size)
+    ids = list(range(1, group_size * number_of_groups + 1))
+    factory = connection_factory(database_file)
+    cache_dir = os.path.join(work_dir, name + '_cache')
+
+    paths = [
+        ('database', {}),
+        ('disk cache', {'use_caching': True, 'cache_dir': cache_dir}),
+        ('memory cache', {'memory_cache_entries': len(ids)}),
+    ]
+    for path_name, kwargs in paths:
+        cinfdata = Cinfdata(SETUP_NAME, grouping_column='time', log_level='DISABLE',
+                            connection_factory=factory, **kwargs)
+        if path_name != 'database':
+            # Warm up the cache
+            for group_time in times:
+                cinfdata.get_data_group(group_time)
+
+        if group_size == 1:
+            result = measure(cinfdata.get_data, ids, repeat)
+            print_result('get_data ({})'.format(path_name), group_size, length, result)
+        else:
+            result = measure(cinfdata.get_data_group, times, repeat)
+            print_result('get_data_group ({})'.format(path_name), group_size, length,
+                         result)
+        cinfdata.close()
+
+    # Loading data directly from the cache
+    cache = Cache(cache_dir, SETUP_NAME)
+    result = measure(cache.load_data, ids, repeat)
+    print_result('Cache.load_data', group_size, length, result)
+
+
+def benchmark_save_infoitem(work_dir, repeat):
+    """Benchmark Cache.save_infoitem with the pickle and sqlite infoitem backends"""
+    metadata = {'id': 1, 'time': '2017-01-01 00:00:00', 'comment': 'Measurement',
+                'mass_label': 'M1', 'sem_voltage': 1800.0, 'type': 4}
+    for backend in ('pickle', 'sqlite'):
+        for write_behind in (False, True):
+            cache_dir = os.path.join(work_dir, 'infoitem_{}_{}'.format(backend,
+                                                                       write_behind))
+            cache = Cache(cache_dir, SETUP_NAME, infoitem_backend=backend,
+                          write_behind=write_behind)
+            result = measure(lambda key: cache.save_infoitem('metadata', key, metadata),
+                             list(range(repeat)), repeat)
+            cache.flush()
+            name = 'Cache.save_infoitem ({}{})'.format(
+                backend, ', write behind' if write_behind else '')
+            print_result(name, '-', '-', result)
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--lengths', default='1000,20000',
+                        help='Comma separated measurement lengths (default 1000,20000)')
+    parser.add_argument('--group-sizes', default='1,10,50',
+                        help='Comma separated group sizes (default 1,10,50)')
+    parser.add_argument('--groups', type=int, default=3,
+                        help='The number of groups per database (default 3)')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='The number of calls per benchmark (default 20)')
+    parser.add_argument('--work-dir', help='Folder for the databases and caches. '
+                        'Default is a temporary folder, which is removed afterwards')
+    args = parser.parse_args()
+
+    # Do not remember the stand in database as the good host in the users home dir
+    ConnectionPool.host_memory_file = None
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='bench_cinfdata_')
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    try:
+        print(ROW.format('Benchmark', 'Group', 'Length', 'Calls', 'Calls/s', 'MB/s',
+                         'p50 ms', 'p90 ms', 'p99 ms', 'Peak MB'))
+        for length in [int(value) for value in args.lengths.split(',')]:
+            for group_size in [int(value) for value in args.group_sizes.split(',')]:
+                benchmark_setup(work_dir, length, group_size, args.groups, args.repeat)
+        benchmark_save_infoitem(work_dir, args.repeat)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Benchmark of the compression options for the data cache
+
+Reports the compressed size and the encode (save) and decode (load) throughput for
+each compression specification, either on synthetic logger like data or on the .npy
+files in an existing cache data folder:
+
+    python bench_compression.py
+    python bench_compression.py --data-dir ../cinf_database/cache/sniffer/data
+"""
+
+from __future__ import print_function
+
+import argparse
+import io
+import os
+import sys
+from time import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'cinf_database'))
+from cinfdata import COMPRESSORS, encode_array, decode_array  # noqa: E402
+
+
+SPECIFICATIONS = [
+    'zlib1', 'zlib', 'shuffle+zlib', 'delta+zlib', 'delta+shuffle+zlib',
+    'delta+shuffle+zlib1', 'bz2', 'delta+shuffle+bz2', 'lzma', 'delta+shuffle+lzma',
+]
+
+
+def synthetic_datasets(number, length):
+    """Return a list of synthetic dateplot like datasets
+
+    The x values are unix times with a little jitter and the y values are a slowly
+    varying signal with noise, rounded to the precision of a typical instrument
+    """
+    random = np.random.RandomState(42)
+    datasets = []
+    for _ in range(number):
+        x = 1.5e9 + np.cumsum(1.0 + 0.01 * random.randn(length))
+        y = 1e-9 * (2 + np.sin(np.linspace(0, 20, length)) + 0.01 * random.randn(length))
+        y = np.round(y, 14)
+        datasets.append(np.column_stack([x, y]))
+    return datasets
+
+
+def load_datasets(data_dir, max_number):
+    """Load up to max_number .npy datasets from data_dir"""
+    filenames = sorted(name for name in os.listdir(data_dir) if name.endswith('.npy'))
+    return [np.load(os.path.join(data_dir, name)) for name in filenames[:max_number]]
+
+
+def benchmark_npy(datasets):
+    """Return (size, save time, load time) for plain .npy serialization"""
+    size = save_time = load_time = 0
+    for data in datasets:
+        start = time()
+        file_ = io.BytesIO()
+        np.save(file_, data)
+        save_time += time() - start
+        size += file_.tell()
+        file_.seek(0)
+        start = time()
+        np.load(file_)
+        load_time += time() - start
+    return size, save_time, load_time
+
+
+def benchmark_specification(datasets, specification):
+    """Return (size, encode time, decode time) for a compression specification"""
+    size = encode_time = decode_time = 0
+    for data in datasets:
+        start = time()
+        encoded = encode_array(data, specification)
+        encode_time += time() - start
+        size += len(encoded)
+        start = time()
+        decoded = decode_array(encoded)
+        decode_time += time() - start
+        assert np.array_equal(decoded, data)
+    return size, encode_time, decode_time
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--data-dir', help='Benchmark on the .npy files in this folder')
+    parser.add_argument('--number', type=int, default=20,
+                        help='The number of datasets to use (default 20)')
+    parser.add_argument('--length', type=int, default=100000,
+                        help='The length of the synthetic datasets (default 100000)')
+    args = parser.parse_args()
+
+    if args.data_dir:
+        datasets = load_datasets(args.data_dir, args.number)
+    else:
+        datasets = synthetic_datasets(args.number, args.length)
+    total_bytes = float(sum(data.nbytes for data in datasets))
+    print('Benchmarking on {} datasets with {:.1f} MB of data\n'.format(
+        len(datasets), total_bytes / 1e6))
+
+    row = '{:<22} {:>8} {:>12} {:>12}'
+    print(row.format('Format', 'Ratio', 'Save MB/s', 'Load MB/s'))
+    results = [('npy',) + benchmark_npy(datasets)]
+    for specification in SPECIFICATIONS:
+        if specification.split('+')[-1] in COMPRESSORS:
+            results.append((specification,) +
+                           benchmark_specification(datasets, specification))
+    for name, size, save_time, load_time in results:
+        print(row.format(
+            name, '{:.3f}'.format(size / total_bytes),
+            '{:.1f}'.format(total_bytes / 1e6 / save_time),
+            '{:.1f}'.format(total_bytes / 1e6 / load_time),
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""A stand in for the cinfdata MySQL database, backed by a local sqlite3 file
+
+The backend understands the subset of MySQL that cinfdata uses (%s placeholders,
+UNIX_TIMESTAMP and the information_schema column query), so a :class:`cinfdata.Cinfdata`
+can be pointed at it with the connection_factory argument::
+
+    make_database('bench.sqlite', 'bench', number_of_measurements=100,
+                  number_of_points=10000)
+    db = Cinfdata('bench', connection_factory=connection_factory('bench.sqlite'))
+"""
+
+from __future__ import print_function
+
+import calendar
+import re
+import sqlite3
+from datetime import datetime, timedelta
+from functools import partial
+
+import numpy as np
+
+
+SCHEMA_QUERY_PATTERN = re.compile(r'information_schema\.COLUMNS', re.IGNORECASE)
+
+
+def unix_timestamp(value):
+    """sqlite implementation of the MySQL UNIX_TIMESTAMP function"""
+    if value is None:
+        return None
+    time_ = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    return calendar.timegm(time_.timetuple())
+
+
+class Cursor(object):
+    """DB-API cursor that translates the MySQL queries of cinfdata to sqlite"""
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._cursor = connection.cursor()
+        self._rows = None
+
+    def execute(self, query, args=None):
+        """Execute a query with %s placeholders"""
+        args = tuple(args) if args is not None else ()
+        if SCHEMA_QUERY_PATTERN.search(query):
+            self._rows = self._schema_rows(args[1:])
+            return
+        self._rows = None
+        self._cursor.execute(query.replace('%s', '?'), args)
+
+    def _schema_rows(self, table_names):
+        """Return the rows of the information_schema query for table_names"""
+        rows = []
+        for table_name in sorted(table_names):
+            pragma = 'PRAGMA table_info({})'.format(table_name)
+            for column in self._connection.execute(pragma).fetchall():
+                rows.append((table_name, column[1], column[2].lower()))
+        return rows
+
+    def fetchall(self):
+        """Return all remaining rows"""
+        if self._rows is not None:
+            rows, self._rows = self._rows, []
+            return tuple(rows)
+        return tuple(self._cursor.fetchall())
+
+    def fetchmany(self, size=1):
+        """Return up to size rows"""
+        if self._rows is not None:
+            rows, self._rows = self._rows[:size], self._rows[size:]
+            return tuple(rows)
+        return tuple(self._cursor.fetchmany(size))
+
+    def close(self):
+        """Close the cursor"""
+        self._cursor.close()
+
+
+class Connection(object):
+    """DB-API connection to a sqlite3 file, with MySQL flavoured cursors"""
+
+    def __init__(self, database_file):
+        self._connection = sqlite3.connect(database_file, check_same_thread=False)
+        self._connection.create_function('UNIX_TIMESTAMP', 1, unix_timestamp)
+
+    def cursor(self, cursor_class=None):  # pylint: disable=unused-argument
+        """Return a new cursor"""
+        return Cursor(self._connection)
+
+    def ping(self):
+        """Raise an error if the connection is closed, like MySQLdb"""
+        self._connection.execute('SELECT 1')
+
+    def close(self):
+        """Close the connection"""
+        self._connection.close()
+
+
+def connect(database_file, **kwargs):  # pylint: disable=unused-argument
+    """Connect to database_file, ignoring the MySQL connection arguments"""
+    return Connection(database_file)
+
+
+def connection_factory(database_file):
+    """Return a connection_factory for :class:`cinfdata.Cinfdata` for database_file"""
+    return partial(connect, database_file)
+
+
+def make_database(database_file, setup_name, number_of_measurements, number_of_points,
+                  group_size=1, has_id=True, seed=42):
+    """Create a database of synthetic measurements for setup_name
+
+    The measurements are made in groups of group_size, that share the same time (like
+    the measurements of a single mass spectrometer run), so a group can be fetched
+    with ``grouping_column='time'``. The mass_label is 'M<number in group>'.
+
+    Args:
+        database_file (str): The path of the sqlite file to create, or to add the
+            tables of setup_name to
+        setup_name (str): The setup name to use in the table names
+        number_of_measurements (int): The number of measurements to create
+        number_of_points (int): The number of x, y points per measurement
+        group_size (int): The number of measurements per group
+        has_id (bool): Whether the xy_values table has an id column
+        seed (int): The seed for the random data
+
+    Returns:
+        list: The times of the groups
+    """
+    random = np.random.RandomState(seed)
+    connection = sqlite3.connect(database_file)
+    connection.execute(
+        'CREATE TABLE measurements_{} (id INTEGER PRIMARY KEY, time TEXT, comment TEXT, '
+        'mass_label TEXT, sem_voltage DOUBLE, type INTEGER)'.format(setup_name)
+    )
+    id_column = 'id INTEGER PRIMARY KEY, ' if has_id else ''
+    connection.execute(
+        'CREATE TABLE xy_values_{} ({}measurement INTEGER, x DOUBLE, y DOUBLE)'
+        .format(setup_name, id_column)
+    )
+    connection.execute('CREATE INDEX measurement_index_{0} ON xy_values_{0} (measurement)'
+                       .format(setup_name))
+
+    start_time = datetime(2017, 1, 1)
+    times = []
+    for measurement_id in range(1, number_of_measurements + 1):
+        group_number, number_in_group = divmod(measurement_id - 1, group_size)
+        time_ = (start_time + timedelta(hours=group_number)).strftime('%Y-%m-%d %H:%M:%S')
+        if number_in_group == 0:
+            times.append(time_)
+        connection.execute(
+            'INSERT INTO measurements_{} VALUES (?, ?, ?, ?, ?, ?)'.format(setup_name),
+            (measurement_id, time_, 'Measurement {}'.format(measurement_id),
+             'M{}'.format(number_in_group + 1), 1800.0 + random.rand(), 4)
+        )
+        x = np.arange(number_of_points, dtype=float)
+        y = np.cumsum(random.randn(number_of_points))
+        connection.executemany(
+            'INSERT INTO xy_values_{} (measurement, x, y) VALUES (?, ?, ?)'
+            .format(setup_name),
+            zip([measurement_id] * number_of_points, x.tolist(), y.tolist())
+        )
+    connection.commit()
+    connection.close()
+    return times
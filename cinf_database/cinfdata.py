@@ -8,15 +8,64 @@ from __future__ import unicode_literals, print_function
 from os import path
 import os
 import sys
+import atexit
+import weakref
+import threading
+from contextlib import contextmanager
+from functools import partial, wraps
 from time import time
 from operator import itemgetter
+from ast import literal_eval
 # Py 2/3 compatible import of pickle
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 import logging
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+import numbers
+import stat
+import struct
+import tempfile
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+import zlib
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+try:
+    import bz2
+except ImportError:
+    bz2 = None
+try:
+    import lzma
+except ImportError:
+    lzma = None
+try:
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+except ImportError:
+    # Python 2 without the futures backport
+    ThreadPoolExecutor = None
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+try:
+    import pandas
+except ImportError:
+    pandas = None
 
 import numpy as np
 
@@ -44,6 +93,8 @@ except ImportError:
     except ImportError:
         # if that fails, just set it to None to indicate that we have no db module
         MySQLdb = None  # pylint: disable=invalid-name
+        # There are no connection errors to catch without a database module
+        CONNECT_EXCEPTION = ()
         LOG.info('Using cinfdata without database')
 
 
@@ -51,8 +102,367 @@ class CinfdataError(Exception):
     """Generic Cinfdata exception"""
 
 
+# The parameters for a pooled database connection. candidates is a tuple of (host, port)
+# pairs to try to connect to, connect_timeout is in seconds (or None for the default) and
+# connection_factory is used instead of MySQLdb.connect if it is not None
+ConnectionParameters = namedtuple(
+    'ConnectionParameters',
+    'candidates database user password connect_timeout connection_factory'
+)
+
+
+class ConnectionPool(object):
+    """Thread safe, process wide pool of database connections
+
+    Idle connections are kept per set of :data:`ConnectionParameters` and handed out by
+    :meth:`checkout`, so that several threads and :class:`Cinfdata` instances can share
+    connections without reconnecting.
+
+    New connections are first tried on the last known good candidate host, which is
+    remembered both in memory and on disk in host_memory_file. If there is none, or it
+    fails, the remaining candidates are probed in parallel and the first one to
+    connect is used, so an unreachable host does not stall for its full timeout.
+    """
+
+    # The file used to remember the last known good host across processes. Set to None
+    # to disable.
+    host_memory_file = path.join(path.expanduser('~'), '.cinfdata_hosts')
+    # Connections that have been idle for longer than this number of seconds are
+    # pinged before they are handed out, since the server may have closed them (e.g.
+    # after wait_timeout). Set to 0 to always ping.
+    ping_after = 10.0
+
+    def __init__(self, max_idle=8):
+        """Initialize local variables
+
+        Args:
+            max_idle (int): The maximum number of idle connections to keep per set of
+                connection parameters
+        """
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}
+        # Raised limits of idle connections for some connection parameters
+        self._max_idle_for = {}
+        self._preferred = None
+
+    def preferred_candidate(self, parameters):
+        """Return the last known good (host, port) for parameters or None"""
+        with self._lock:
+            if self._preferred is None:
+                self._preferred = self._read_host_memory()
+            return self._preferred.get(parameters.candidates)
+
+    def _read_host_memory(self):
+        """Return the remembered mapping of candidates to good hosts from disk"""
+        if self.host_memory_file is None or not path.exists(self.host_memory_file):
+            return {}
+        try:
+            with open(self.host_memory_file) as file_:
+                return dict(literal_eval(file_.read()))
+        except (IOError, OSError, ValueError, SyntaxError):
+            LOG.debug('Unable to read the host memory file %s', self.host_memory_file)
+            return {}
+
+    def _remember_candidate(self, parameters, candidate):
+        """Remember candidate as the good host for parameters, in memory and on disk"""
+        with self._lock:
+            if self._preferred.get(parameters.candidates) == candidate:
+                return
+            self._preferred[parameters.candidates] = candidate
+            preferred = dict(self._preferred)
+        if self.host_memory_file is None:
+            return
+        try:
+            with atomic_write(self.host_memory_file, 'w') as file_:
+                file_.write(repr(preferred))
+        except (IOError, OSError):
+            LOG.debug('Unable to write the host memory file %s', self.host_memory_file)
+
+    @staticmethod
+    def _connect_to(parameters, candidate):
+        """Connect to a single (host, port) candidate"""
+        host, port = candidate
+        kwargs = {}
+        if parameters.connect_timeout is not None:
+            kwargs['connect_timeout'] = parameters.connect_timeout
+        connect = parameters.connection_factory or MySQLdb.connect
+        return connect(host=host, port=port, user=parameters.user,
+                       passwd=parameters.password, db=parameters.database, **kwargs)
+
+    def _connect(self, parameters):
+        """Connect to the preferred candidate, or else the first available candidate
+
+        Raises:
+            CONNECT_EXCEPTION: If none of the candidates could be connected to
+        """
+        candidates = list(parameters.candidates)
+        preferred = self.preferred_candidate(parameters)
+        if preferred in candidates:
+            try:
+                return self._connect_to(parameters, preferred)
+            except CONNECT_EXCEPTION:
+                LOG.debug('Unable to connect to last known good host %s:%s', *preferred)
+                candidates.remove(preferred)
+                if not candidates:
+                    raise
+
+        candidate, connection = self._probe(parameters, candidates)
+        self._remember_candidate(parameters, candidate)
+        return connection
+
+    def _probe(self, parameters, candidates):
+        """Try to connect to all candidates in parallel and return the first success
+
+        Connections to candidates that succeed after the first one are closed.
+
+        Returns:
+            tuple: (candidate, connection)
+
+        Raises:
+            Exception: The exception of the last candidate to fail, usually
+                CONNECT_EXCEPTION, if none of the candidates could be connected to
+        """
+        if len(candidates) == 1:
+            return candidates[0], self._connect_to(parameters, candidates[0])
+
+        results = Queue()
+        winner_lock = threading.Lock()
+        state = {'has_winner': False}
+
+        def probe(candidate):
+            """Connect to candidate and report the result"""
+            try:
+                connection = self._connect_to(parameters, candidate)
+            except Exception as exception:  # pylint: disable=broad-except
+                # Any failure must be reported, or the caller would wait forever
+                LOG.debug('Unable to connect to %s:%s', *candidate)
+                results.put((candidate, None, exception))
+                return
+            with winner_lock:
+                is_winner = not state['has_winner']
+                state['has_winner'] = True
+            if is_winner:
+                results.put((candidate, connection, None))
+            else:
+                connection.close()
+
+        for candidate in candidates:
+            thread = threading.Thread(target=probe, args=(candidate,))
+            thread.daemon = True
+            thread.start()
+
+        last_exception = None
+        for _ in candidates:
+            candidate, connection, exception = results.get()
+            if connection is not None:
+                return candidate, connection
+            last_exception = exception
+        raise last_exception
+
+    def acquire(self, parameters):
+        """Return an idle connection for parameters, or a new one if there are none
+
+        Idle connections are checked with ping, if they have been idle for more than
+        ping_after seconds, and closed if they do not respond.
+
+        Raises:
+            CONNECT_EXCEPTION: If a new connection was needed, but could not be formed
+        """
+        while True:
+            with self._lock:
+                idle = self._idle.get(parameters)
+                if not idle:
+                    break
+                connection, released_at = idle.pop()
+            if time() - released_at <= self.ping_after or self._is_alive(connection):
+                return connection
+            LOG.debug('Discarding an idle connection that did not respond to ping')
+            try:
+                connection.close()
+            except Exception:  # pylint: disable=broad-except
+                pass
+        return self._connect(parameters)
+
+    @staticmethod
+    def _is_alive(connection):
+        """Return whether a connection responds to ping (or cannot be pinged)"""
+        ping = getattr(connection, 'ping', None)
+        if ping is None:
+            return True
+        try:
+            ping()
+        except Exception:  # pylint: disable=broad-except
+            return False
+        return True
+
+    def reserve_idle(self, parameters, max_idle):
+        """Keep at least max_idle idle connections for parameters
+
+        The limit for other connection parameters is unchanged.
+        """
+        with self._lock:
+            self._max_idle_for[parameters] = max(
+                self._max_idle_for.get(parameters, self.max_idle), max_idle
+            )
+
+    def release(self, parameters, connection):
+        """Return a connection to the pool, or close it if there are enough idle ones"""
+        with self._lock:
+            idle = self._idle.setdefault(parameters, [])
+            if len(idle) < self._max_idle_for.get(parameters, self.max_idle):
+                idle.append((connection, time()))
+                return
+        connection.close()
+
+    @contextmanager
+    def checkout(self, parameters):
+        """Context manager that acquires a connection and releases it afterwards
+
+        If an exception is raised in the block, the state of the connection is unknown,
+        so it is closed instead of returned to the pool.
+        """
+        connection = self.acquire(parameters)
+        try:
+            yield connection
+        except Exception:
+            try:
+                connection.close()
+            except Exception:  # pylint: disable=broad-except
+                pass
+            raise
+        self.release(parameters, connection)
+
+    def close_all(self):
+        """Close all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection, _ in connections:
+                connection.close()
+
+
+CONNECTION_POOL = ConnectionPool()
+
+
+# Process wide registry of table schemas, shared by all Cinfdata instances. It maps
+# (database name, setup name) to a dict that maps 'measurements' and 'xy_values' to a
+# list of (column name, column type) tuples in table order
+SCHEMAS = {}
+SCHEMAS_LOCK = threading.Lock()
+SCHEMA_QUERY = ('SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE FROM information_schema.COLUMNS '
+                'WHERE TABLE_SCHEMA=%s AND TABLE_NAME IN ({}) '
+                'ORDER BY TABLE_NAME, ORDINAL_POSITION')
+
+
+class Stats(object):
+    """Thread safe counters and timing histograms
+
+    Counters are incremented with :meth:`count` and durations are recorded with
+    :meth:`time` (or the :meth:`timer` context manager), in a histogram with a bucket per
+    decade of seconds. Hooks added with :meth:`add_hook` are called as
+    ``hook(kind, name, value)``, with kind either 'count' or 'time', on every update, e.g.
+    to forward the numbers to a monitoring system.
+    """
+
+    # The upper bounds, in seconds, of the buckets of the timing histograms. The last
+    # bucket is for longer durations
+    histogram_bounds = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, 10.0)
+
+    def __init__(self):
+        """Initialize local variables"""
+        self._lock = threading.Lock()
+        self._hooks = []
+        self._counters = {}
+        self._timings = {}
+
+    def add_hook(self, hook):
+        """Add a hook, that is called as hook(kind, name, value) on every update"""
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """Remove a hook"""
+        self._hooks.remove(hook)
+
+    def count(self, name, value=1):
+        """Add value to the counter name"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+        for hook in self._hooks:
+            hook('count', name, value)
+
+    def time(self, name, seconds):
+        """Record a duration in seconds in the timing histogram name"""
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = {
+                    'count': 0, 'total': 0.0, 'min': seconds, 'max': seconds,
+                    'histogram': [0] * (len(self.histogram_bounds) + 1),
+                }
+            timing['count'] += 1
+            timing['total'] += seconds
+            timing['min'] = min(timing['min'], seconds)
+            timing['max'] = max(timing['max'], seconds)
+            bucket = 0
+            while bucket < len(self.histogram_bounds) and \
+                    seconds > self.histogram_bounds[bucket]:
+                bucket += 1
+            timing['histogram'][bucket] += 1
+        for hook in self._hooks:
+            hook('time', name, seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """Context manager that records the time spent in the block under name"""
+        start = time()
+        try:
+            yield
+        finally:
+            self.time(name, time() - start)
+
+    def snapshot(self):
+        """Return a copy of the statistics
+
+        Returns:
+            dict: With 'counters', a dict of names to values, and 'timings', a dict of
+                names to dicts with count, total, min and max (in seconds) and histogram,
+                a list of (upper bound in seconds, count) pairs
+        """
+        bounds = self.histogram_bounds + (float('inf'),)
+        with self._lock:
+            timings = {}
+            for name, timing in self._timings.items():
+                histogram = list(zip(bounds, timing['histogram']))
+                timings[name] = dict(timing, histogram=histogram)
+            return {'counters': dict(self._counters), 'timings': timings}
+
+    def reset(self):
+        """Reset all counters and timings"""
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+
+
+def _timed(name):
+    """Decorator that records the duration of each call of a Cinfdata method"""
+    def decorator(method):
+        """Decorate method"""
+        @wraps(method)
+        def timed_method(self, *args, **kwargs):
+            """Call method and record the duration"""
+            with self._stats.timer(name):  # pylint: disable=protected-access
+                return method(self, *args, **kwargs)
+        return timed_method
+    return decorator
+
+
 class Cinfdata(object):
-    """Class that provides easy access to the cinfdata database with optional local caching"""
+    """Class that provides easy access to the cinfdata database with optional local caching
+
+    Database queries are made on connections checked out of a process wide
+    :class:`ConnectionPool`, so a single instance can be used from several threads.
+    """
 
     database_name = 'cinfdata'
     main_host = 'servcinf-sql.fysik.dtu.dk'
@@ -61,12 +471,25 @@ class Cinfdata(object):
     descriptions_table = 'dateplots_description'
     username = 'cinf_reader'
     password = 'cinf_reader'
+    # The maximum number of ids to put in the IN (...) clause of a batched query
+    max_ids_per_query = 1000
+    # The number of rows to read at a time when streaming data
+    stream_chunk_size = 65536
+    # The pyramid of a dataset (see get_data_for_view) is made of levels down to the
+    # first one with no more than this number of rows
+    pyramid_min_rows = 1024
 
     def __init__(self, setup_name, local_forward_port=9999, use_caching=False,
                  grouping_column=None, label_column=None,
                  allow_wildcards=False,
                  cache_dir=None, cache_only=False, log_level='INFO',
-                 metadata_as_named_tuple=False):
+                 metadata_as_named_tuple=False, streaming=False,
+                 infoitem_backend='pickle', cache_write_behind=False,
+                 cache_flush_every=None, cache_flush_interval=None, mmap_mode=None,
+                 cache_data_layout='npy', cache_compression=None,
+                 memory_cache_entries=None, memory_cache_bytes=None,
+                 validate_cache=False, cache_ttl=None, connect_timeout=None,
+                 lazy_connect=True, cache_pyramid=False, connection_factory=None):
         """Initialize local variables
         Args:
             setup_name (str): The setup name used as a table name prefix in the database.
@@ -85,14 +508,68 @@ class Cinfdata(object):
             cache_only (bool): If set to True, no connection will be formed to the database
             log_level (str): A string that indicates the log level, either 'INFO' (default)
                 or 'DEBUG' for more output or 'DISABLE' to disable any further output
+            streaming (bool): If set to True, data is fetched from the database with an
+                unbuffered server side cursor and read in chunks of stream_chunk_size rows
+                directly into a numpy array. This keeps the peak memory use close to the
+                size of the final array, which matters for very large datasets
+            infoitem_backend (str): The storage used for cached metadata etc., either
+                'pickle' (default) or 'sqlite'. See :class:`Cache` for details
+            cache_write_behind (bool): If True, cached metadata etc. is only written to
+                disk on :meth:`flush`, when leaving a ``with`` block, when the instance is
+                garbage collected, at interpreter exit or when cache_flush_every or
+                cache_flush_interval is exceeded
+            cache_flush_every (int): In write behind mode, flush the cache after this
+                many unflushed items
+            cache_flush_interval (float): In write behind mode, flush the cache when
+                this many seconds has passed since the last flush
+            mmap_mode (str): If set to 'r', data loaded from the cache is returned as read
+                only memory maps (see :func:`numpy.load`), so only the parts of the data
+                that are used are read from disk. Scaling such data returns a scaled copy.
+            cache_data_layout (str): Either 'npy' (default) to cache each dataset in its
+                own .npy file or 'chunked' to pack many datasets into large chunk files.
+                See :class:`Cache` for details
+            cache_compression (str): If not None, cache datasets compressed according to
+                this compression specification, e.g. 'zlib' or 'delta+shuffle+zlib'. See
+                :func:`parse_compression` for details
+            memory_cache_entries (int): If this or memory_cache_bytes is given, data and
+                metadata is kept in an in-memory least recently used cache (see
+                :class:`MemoryCache`) in front of the cache and the database, holding at
+                most this number of entries. NOTE data arrays are returned read only when
+                the memory cache is used
+            memory_cache_bytes (int): The maximum total number of bytes of the arrays
+                in the memory cache
+            validate_cache (bool): If True, data from the cache (and memory cache) is
+                validated against the database by comparing the number of rows and the
+                highest id (or x) of the measurement, and fetched again if it has changed.
+                Validation is done in a single query for all the datasets in a group.
+            cache_ttl (float): With validate_cache, only validate each dataset if more
+                than this number of seconds has passed since it was last validated.
+                Default is None, which means validate on every access
+            connect_timeout (int): The timeout in seconds for connecting to each of the
+                database hosts. Default is None, which means the default of the database
+                module
+            lazy_connect (bool): If True (default), the database connection is only
+                formed when the first query that needs the database is made, so sessions
+                that only use the cache do not connect at all
+            cache_pyramid (bool): If True, a min/max/mean pyramid is saved along with each
+                dataset when it is cached, for fast reads with :meth:`get_data_for_view`
+            connection_factory (callable): If given, this is used instead of
+                MySQLdb.connect to form database connections. It is called with the
+                keyword arguments host, port, user, passwd, db (and connect_timeout) and
+                must return a DB-API connection that accepts MySQL queries. This is
+                intended for testing and benchmarking against a stand in database, see
+                benchmarks/sqlite_backend.py. With streaming, the default cursor of the
+                connection is used
 
-        .. warning:: Be careful with caching. It will keep returning the version of the
-            data from the first time it was retrieved. If data is later added to the
-            dataset or it is altered, the data that this module returns, when using
-            caching, will not reflect it.
+        .. warning:: Be careful with caching. Unless validate_cache is used, it will keep
+            returning the version of the data from the first time it was retrieved. If
+            data is later added to the dataset or it is altered, the data that this module
+            returns, when using caching, will not reflect it. Cached metadata is never
+            validated.
 
         """
         start = time()
+        self._stats = Stats()
 
         # Setup logging
         if log_level == 'DEBUG':
@@ -100,52 +577,68 @@ class Cinfdata(object):
         elif log_level == 'DISABLE':
             LOG.setLevel(logging.CRITICAL)
 
-        # Init database connection
-        self.connection = None
-        self.cursor = None
-        if MySQLdb is not None and not cache_only:
-            self._init_database_connection(local_forward_port)
+        # Init database connection. _database_available is None until the connection
+        # has been tried
+        self._connection_parameters = ConnectionParameters(
+            candidates=((self.main_host, int(self.main_port)),
+                        (self.secondary_host, int(local_forward_port))),
+            database=self.database_name, user=self.username, password=self.password,
+            connect_timeout=connect_timeout, connection_factory=connection_factory,
+        )
+        self._database_available = None
+        self._connect_lock = threading.Lock()
+        self._thread_local = threading.local()
+        if (MySQLdb is None and connection_factory is None) or cache_only:
+            self._database_available = False
+        elif not lazy_connect:
+            self._init_database_connection()
 
         # Init cache
         self.cache = None
         if use_caching:
-            self.cache = Cache(cache_dir, setup_name)
+            self.cache = Cache(cache_dir, setup_name, infoitem_backend=infoitem_backend,
+                               write_behind=cache_write_behind,
+                               flush_every=cache_flush_every,
+                               flush_interval=cache_flush_interval,
+                               mmap_mode=mmap_mode, data_layout=cache_data_layout,
+                               compression=cache_compression)
+
+        # Init memory cache
+        self.memory_cache = None
+        if memory_cache_entries is not None or memory_cache_bytes is not None:
+            self.memory_cache = MemoryCache(max_entries=memory_cache_entries,
+                                            max_bytes=memory_cache_bytes)
 
         # Init local variables
         self.grouping_column = grouping_column
         self.label_column = label_column
         self.setup_name = setup_name
         self._column_names = None
+        self.streaming = streaming
+        self.validate_cache = validate_cache
+        self.cache_ttl = cache_ttl
+        self.cache_pyramid = cache_pyramid
+        # Data signatures used for validation, if there is no cache to keep them in
+        self._signatures = {}
+        # Whether x is ascending in datasets, keyed by (measurement id, number of rows)
+        self._x_ascending = {}
 
-        # Init the metadata named tuple (we need database for this)
+        # The metadata named tuple, the column information and whether the xy_values
+        # table has an id are all loaded lazily, see _get_schema
         self._metadata_as_named_tuple = metadata_as_named_tuple
-        if metadata_as_named_tuple:
-            self._metadata_named_tuple = namedtuple('Metadata', self.column_names)
-
-        # Figure out whether the xy_values table has an id
-        if self.cache and self.cache.has_infoitem('general', 'xy_values_table_has_id'):
-            self._xy_values_table_has_id = \
-                self.cache.load_infoitem('general', 'xy_values_table_has_id')
-        else:
-            if self.cursor is not None:
-                self.cursor.execute('DESCRIBE xy_values_{}'.format(setup_name))
-                column_names = [item[0] for item in self.cursor.fetchall()]
-                self._xy_values_table_has_id = 'id' in column_names
-                if self.cache:
-                    self.cache.save_infoitem('general', 'xy_values_table_has_id',
-                                             self._xy_values_table_has_id)
-            else:
-                CinfdataError('Could not determine if xy_values_table has id')
+        self._metadata_named_tuple_class = None
+        self._column_types = None
+        self._has_id = None
 
         # Init queries
-        if self._xy_values_table_has_id:
-            self.data_query = 'SELECT x, y FROM xy_values_{} WHERE measurement=%s '\
-                              'ORDER BY id'.format(setup_name)
-        else:
-            self.data_query = 'SELECT x, y FROM xy_values_{} WHERE measurement=%s '\
-                              'ORDER BY x'.format(setup_name)
         self.metadata_query = ('SELECT *, UNIX_TIMESTAMP(time) FROM measurements_{} '
                                'WHERE id=%s'.format(setup_name))
+        self.batch_metadata_query = ('SELECT *, UNIX_TIMESTAMP(time) FROM measurements_{} '
+                                     'WHERE id IN ({{}})'.format(setup_name))
+        self.new_ids_query = ('SELECT id FROM measurements_{} WHERE id > %s '
+                              'ORDER BY id'.format(setup_name))
+        self.metadata_table_query = ('SELECT *, UNIX_TIMESTAMP(time) FROM measurements_{} '
+                                     'WHERE {{}} ORDER BY id'.format(setup_name))
         if allow_wildcards:
             self.group_query = 'SELECT `id` FROM measurements_{} WHERE `{{}}` LIKE %s order by '\
                                'id'.format(setup_name)
@@ -153,33 +646,117 @@ class Cinfdata(object):
             self.group_query = 'SELECT `id` FROM measurements_{} WHERE `{{}}` = %s order by '\
                                'id'.format(setup_name)
 
-        LOG.debug('Completed init in %s s', time() - start)
+        self.init_time = time() - start
+        LOG.debug('Completed init in %0.4e s', self.init_time)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def flush(self):
+        """Write all unflushed cache items to disk (only relevant with write behind)"""
+        if self.cache:
+            self.cache.flush()
+
+    def close(self):
+        """Flush the cache and return the connection of the calling thread to the pool"""
+        self.flush()
+        connection = getattr(self._thread_local, 'connection', None)
+        if connection is not None:
+            self._thread_local.cursor.close()
+            CONNECTION_POOL.release(self._connection_parameters, connection)
+            self._thread_local.connection = None
+            self._thread_local.cursor = None
+
+    def _init_database_connection(self):
+        """Initialize the database connection
 
-    def _init_database_connection(self, local_forward_port):
-        """Initialize the database connection"""
+        A connection is checked out from the process wide connection pool, to make sure
+        that one of the hosts can be reached. This is quick when the pool already has
+        an idle connection for the same parameters.
+        """
+        start = time()
         LOG.debug('Initialize database connection')
         try:
-            self.connection = MySQLdb.connect(
-                host=self.main_host, user=self.username, passwd=self.password,
-                db=self.database_name,
-            )
-            LOG.info('Using direct db connection: cinfdata:3306')
+            with CONNECTION_POOL.checkout(self._connection_parameters):
+                pass
         except CONNECT_EXCEPTION:
+            self._database_available = False
+            LOG.info('No database connection')
+            return
+
+        self._database_available = True
+        LOG.debug('Connected to database in %0.4e s', time() - start)
+        host, port = CONNECTION_POOL.preferred_candidate(self._connection_parameters)
+        if host == self.main_host:
+            LOG.info('Using direct db connection: cinfdata:3306')
+        else:
+            LOG.info('Using port forward db connection: %s:%s', host, port)
+
+    @property
+    def _has_database(self):
+        """Whether there is a database connection, connecting on first use if lazy"""
+        if self._database_available is None:
+            with self._connect_lock:
+                if self._database_available is None:
+                    self._init_database_connection()
+        return self._database_available
+
+    @property
+    def connection(self):
+        """A database connection dedicated to the calling thread, for direct queries
+
+        The connection is checked out of the connection pool on first use and returned
+        by :meth:`close`. It is None if there is no database connection.
+        """
+        if not self._has_database:
+            return None
+        connection = getattr(self._thread_local, 'connection', None)
+        if connection is None:
+            connection = CONNECTION_POOL.acquire(self._connection_parameters)
+            self._thread_local.connection = connection
+            self._thread_local.cursor = connection.cursor()
+        return connection
+
+    @property
+    def cursor(self):
+        """A cursor on :attr:`connection`, or None if there is no database connection"""
+        if self.connection is None:
+            return None
+        return self._thread_local.cursor
+
+    @contextmanager
+    def _checkout_cursor(self, cursor_class=None):
+        """Check out a connection from the pool and yield a cursor on it
+
+        Args:
+            cursor_class (class): The cursor class to use or None for the default
+        """
+        with CONNECTION_POOL.checkout(self._connection_parameters) as connection:
+            if cursor_class is None:
+                cursor = connection.cursor()
+            else:
+                cursor = connection.cursor(cursor_class)
             try:
-                self.connection = MySQLdb.connect(
-                    host=self.secondary_host, port=local_forward_port,
-                    user=self.username, passwd=self.password, db=self.database_name
-                )
-                LOG.info('Using port forward db connection: %s:%s', self.secondary_host,
-                         local_forward_port)
-            except CONNECT_EXCEPTION:
-                self.connection = None
-                LOG.info('No database connection')
+                yield cursor
+            finally:
+                cursor.close()
 
-        if self.connection is not None:
-            self.cursor = self.connection.cursor()
+    def _query(self, query, args=None):
+        """Execute a query on a pooled connection and return all the rows"""
+        with self._stats.timer('database.query'):
+            with self._checkout_cursor() as cursor:
+                cursor.execute(query, args)
+                rows = cursor.fetchall()
+        self._stats.count('database.queries')
+        self._stats.count('database.rows', len(rows))
+        return rows
 
-    def get_data(self, measurement_id, scaling_factors=None):
+    @_timed('get_data')
+    def get_data(self, measurement_id, scaling_factors=None, max_points=None,
+                 method='minmax', x_min=None, x_max=None, incremental=False):
         """Get data for measurement_id
 
         Args:
@@ -187,332 +764,3157 @@ class Cinfdata(object):
             scaling_factors (sequence): A sequence of scaling factors for the
                 columns. If a value of None is supplied for any of the columns,
                 that column will not be scaled. Examples values could be (10*6, None)
+            max_points (int): If given, return the data downsampled to at most this
+                number of points with method. Each downsampled version is cached
+                separately, so only the first request for it scans the full data
+            method (str): The downsampling method, see :func:`downsample`
+            x_min (float): If given, only return the rows with x >= x_min
+            x_max (float): If given, only return the rows with x <= x_max. If the full
+                dataset is cached, the rows in the x range are found by binary search in
+                the cached array (which requires x to be ascending), otherwise only those
+                rows are fetched from the database. Data fetched for an x range is not
+                cached and is not downsampled via the cache
+            incremental (bool): If True, only the rows that were added to the
+                measurement since it was last fetched are fetched and appended to the
+                cached data. Use this for measurements that are still being recorded. The
+                last row is remembered by id (or by x, if the xy_values table has no id)
 
         Returns:
             numpy.array: The measurement as a numpy array
         """
-        # Check if this dataset is in the cache and if so return
+        if incremental:
+            data = self._get_tail_data(measurement_id)
+            if x_min is not None or x_max is not None:
+                data = self._select_x_range(measurement_id, data, x_min, x_max)
+            if max_points is not None:
+                data = downsample(data, max_points, method)
+        elif x_min is not None or x_max is not None:
+            data = self._get_data_in_range(measurement_id, x_min, x_max)
+            if max_points is not None:
+                data = downsample(data, max_points, method)
+        elif max_points is None:
+            data = self._get_full_data(measurement_id)
+        else:
+            data = self._get_downsampled_data(measurement_id, max_points, method)
+
+        # Apply scaling factors
+        if scaling_factors is not None:
+            data = self._scale(data, scaling_factors)
+
+        return data
+
+    def _get_full_data(self, measurement_id):
+        """Get the full data for measurement_id from the caches or the database
+
+        Raises:
+            CinfdataError: If there is no data for measurement_id
+        """
+        # Check if this dataset is in the memory cache or the cache and if so return
         data = None
-        if self.cache:
+        if self.memory_cache is not None:
+            data = self.memory_cache.get(('data', measurement_id))
+        if data is None and self.cache:
             data = self.cache.load_data(measurement_id)
+            if data is not None:
+                self._memorize_data(measurement_id, data)
+
+        # Discard the cached data if it has changed in the database
+        stale_signatures = {}
+        if data is not None and self._stale_ids({measurement_id: data}, stale_signatures):
+            data = None
 
         # Try and get the dataset from the database
-        if data is None and self.cursor is not None:
+        if data is None and self._has_database:
             start = time()
-            self.cursor.execute(self.data_query, (measurement_id,))
-            data = np.array(self.cursor.fetchall())
+            if self.validate_cache:
+                signatures = stale_signatures or \
+                    self._fetch_signatures([measurement_id])
+            data = self._fetch_array(self.data_query, (measurement_id,))
             LOG.debug('Fetched data for id %s from database in %0.4e s', measurement_id,
                       time() - start)
 
             # If there was data in the db, possibly save to cache and return
             if data.size > 0:
-                if self.cache:
-                    self.cache.save_data(measurement_id, data)
+                self._cache_data(measurement_id, data)
+                self._memorize_data(measurement_id, data)
+                if self.validate_cache:
+                    self._save_signatures(signatures, start)
 
         if data is None:
             error = 'No data found for id {}'.format(measurement_id)
             raise CinfdataError(error)
 
-        # Apply scaling factors
-        if scaling_factors is not None:
-            for column_number, scaling_factor in enumerate(scaling_factors):
-                if scaling_factor is not None:
-                    data[:, column_number] *= scaling_factor
+        return data
+
+    def _get_tail_data(self, measurement_id):
+        """Get data for measurement_id, fetching only the rows added since the last fetch
+
+        The number of rows and the id (or x) of the last row are kept as the signature
+        of the data (see :meth:`_stale_ids`). If the cached data matches the signature,
+        only the rows after the last one are fetched and appended to the data in the
+        memory cache and the cache, otherwise the whole dataset is fetched.
+
+        Raises:
+            CinfdataError: If there is no database and no cached data
+        """
+        cached_data = None
+        if self.memory_cache is not None:
+            cached_data = self.memory_cache.get(('data', measurement_id))
+        if cached_data is None and self.cache:
+            cached_data = self.cache.load_data(measurement_id)
+        if not self._has_database:
+            if cached_data is None:
+                raise CinfdataError('No data found for id {}'.format(measurement_id))
+            return cached_data
+
+        start = time()
+        signature = self._load_signature(measurement_id)
+        append = cached_data is not None and signature is not None and \
+            signature[0] == len(cached_data)
+        if append:
+            query, args = self.tail_data_query.format(' AND {} > %s'.format(
+                self._order_column)), (measurement_id, signature[1])
+        else:
+            query, args = self.tail_data_query.format(''), (measurement_id,)
+        rows = self._fetch_array(query, args, n_columns=3)
+        LOG.debug('Fetched %s %s rows for id %s from database in %0.4e s', len(rows),
+                  'new' if append else 'all', measurement_id, time() - start)
+
+        if append and len(rows) == 0:
+            return cached_data
+        new_rows = np.ascontiguousarray(rows[:, 1:])
+        if append:
+            data = np.concatenate((cached_data, new_rows))
+            if self.cache:
+                self.cache.append_data(measurement_id, new_rows, data)
+            # The downsampled versions are checked against the signature when used
+            self._update_cached_pyramid(measurement_id, data,
+                                        number_of_old_rows=len(cached_data))
+        else:
+            data = new_rows
+            if len(data) > 0:
+                self._cache_data(measurement_id, data)
+        if len(data) > 0:
+            self._memorize_data(measurement_id, data)
+            last = rows[-1, 0]
+            if self._xy_values_table_has_id:
+                last = int(last)
+            self._save_signatures({measurement_id: (len(data), last)}, start)
+        return data
+
+    def _get_data_in_range(self, measurement_id, x_min, x_max):
+        """Get the rows of measurement_id with x in the range from x_min to x_max
+
+        Raises:
+            CinfdataError: If there is no database and the data is not cached
+        """
+        cached = self._load_cached_data([measurement_id])
+        if measurement_id in cached:
+            return self._select_x_range(measurement_id, cached[measurement_id], x_min,
+                                        x_max)
+
+        if not self._has_database:
+            raise CinfdataError('No data found for id {}'.format(measurement_id))
+        start = time()
+        query, args = self._restrict_to_x_range(self.data_query, (measurement_id,),
+                                                x_min, x_max)
+        data = self._fetch_array(query, args)
+        LOG.debug('Fetched data for id %s in x range %s to %s from database in %0.4e s',
+                  measurement_id, x_min, x_max, time() - start)
+        return data
+
+    def _x_is_ascending(self, measurement_id, data):
+        """Return whether x is ascending in the cached data of measurement_id
+
+        If the rows of a dataset are ordered by x, this is always the case. If they are
+        ordered by id, x may go up and down (e.g. in a TPD or CV ramp), so x is checked
+        and the result remembered for the dataset with this number of rows.
+        """
+        try:
+            if self._order_column == 'x':
+                return True
+        except CinfdataError:
+            # The order is unknown without a database or a cached schema
+            pass
+        key = (measurement_id, len(data))
+        if key not in self._x_ascending:
+            self._x_ascending[key] = bool(np.all(np.diff(data[:, 0]) >= 0))
+        return self._x_ascending[key]
+
+    def _select_x_range(self, measurement_id, data, x_min, x_max):
+        """Return the rows of the cached data of measurement_id with x from x_min to
+        x_max, in the order they have in the database
+        """
+        x_ascending = self._x_is_ascending(measurement_id, data)
+        return _slice_x_range(data, x_min, x_max, x_ascending=x_ascending)
+
+    @staticmethod
+    def _restrict_to_x_range(query, args, x_min, x_max):
+        """Add conditions on x to a data query
+
+        Args:
+            query (str): A query ending in an ORDER BY clause
+            args (tuple): The arguments of query
+            x_min (float): The lowest x to select or None
+            x_max (float): The highest x to select or None
+
+        Returns:
+            tuple: The restricted query and its arguments
+        """
+        conditions = ''
+        args = tuple(args)
+        if x_min is not None:
+            conditions += ' AND x >= %s'
+            args += (float(x_min),)
+        if x_max is not None:
+            conditions += ' AND x <= %s'
+            args += (float(x_max),)
+        selection, order = query.rsplit(' ORDER BY ', 1)
+        return '{}{} ORDER BY {}'.format(selection, conditions, order), args
+
+    def _cache_data(self, measurement_id, data):
+        """Save data fetched from the database to the cache, and update its pyramid"""
+        if self.cache:
+            self.cache.save_data(measurement_id, data)
+        self._update_cached_pyramid(measurement_id, data)
+
+    def _update_cached_pyramid(self, measurement_id, data, number_of_old_rows=None):
+        """Update the cached pyramid of changed data, if cache_pyramid is set or a
+        pyramid was built when it was first needed
+
+        Args:
+            measurement_id (int): The id of the measurement
+            data (numpy.array): The changed data
+            number_of_old_rows (int): If rows were appended to the data, the number of
+                rows before. Then only the buckets that the new rows complete are added
+                to the levels (see :meth:`_append_to_pyramid`), instead of rebuilding
+                the pyramid.
+        """
+        if not self.cache and self.memory_cache is None:
+            return
+        pyramid_key = '{}_pyr1'.format(measurement_id)
+        has_pyramid = self.cache_pyramid or \
+            (self.memory_cache is not None and ('data', pyramid_key) in self.memory_cache) or \
+            (self.cache and self.cache.has_data(pyramid_key))
+        if not has_pyramid:
+            return
+        if number_of_old_rows is None or \
+                not self._append_to_pyramid(measurement_id, data, number_of_old_rows):
+            self._cache_pyramid(measurement_id, build_pyramid(data, self.pyramid_min_rows),
+                                len(data))
+
+    def _append_to_pyramid(self, measurement_id, data, number_of_old_rows):
+        """Add the buckets that rows appended to data complete, to its cached pyramid
+
+        The cached level k holds the complete buckets of 2**k rows. The new ones are made
+        by merging pairs of rows of level k - 1, so only the rows after the last complete
+        bucket of each level are read, and the new rows are appended to the levels.
+
+        Returns:
+            bool: False if the cached levels do not match the old data or the pyramid
+                has grown a level, in which case it must be rebuilt
+        """
+        depth = pyramid_depth(len(data), self.pyramid_min_rows)
+        if depth > pyramid_depth(number_of_old_rows, self.pyramid_min_rows):
+            return False
+
+        # The rows of the level below, from row number below_start on, as x, minimum y,
+        # maximum y and mean y
+        below_start = 2 * (number_of_old_rows >> 1)
+        below = data[below_start:]
+        below = np.column_stack((below[:, 0], below[:, 1], below[:, 1], below[:, 1]))
+        updates = []
+        for level_number in range(1, depth + 1):
+            level = self._load_pyramid_level(measurement_id, level_number)
+            if level is None or len(level) != number_of_old_rows >> level_number:
+                return False
+            new_length = len(data) >> level_number
+            pairs = below[2 * len(level) - below_start: 2 * new_length - below_start]
+            new_rows = _merge_bucket_pairs(pairs)
+            updates.append((level_number, level, new_rows))
+            below_start = 2 * (number_of_old_rows >> (level_number + 1))
+            below = np.concatenate((level[below_start:], new_rows))
+
+        start = time()
+        for level_number, level, new_rows in updates:
+            if len(new_rows) == 0:
+                continue
+            key = '{}_pyr{}'.format(measurement_id, level_number)
+            level = np.concatenate((level, new_rows))
+            if self.cache:
+                self.cache.append_data(key, new_rows, level)
+            self._memorize_data(key, level)
+        LOG.debug('Appended to %s pyramid levels for id %s in %0.4e s', len(updates),
+                  measurement_id, time() - start)
+        return True
+
+    def _cache_pyramid(self, measurement_id, levels, number_of_rows):
+        """Save the complete buckets of the levels of a pyramid of data with
+        number_of_rows rows, to the cache and the memory cache
+        """
+        start = time()
+        for level_number, level in enumerate(levels, start=1):
+            key = '{}_pyr{}'.format(measurement_id, level_number)
+            level = level[:number_of_rows >> level_number]
+            if self.cache:
+                self.cache.save_data(key, level)
+            self._memorize_data(key, level)
+        LOG.debug('Saved %s pyramid levels for id %s to cache in %0.4e s', len(levels),
+                  measurement_id, time() - start)
+
+    def _load_pyramid_level(self, measurement_id, level_number):
+        """Load a pyramid level from the memory cache or the cache, or return None"""
+        key = '{}_pyr{}'.format(measurement_id, level_number)
+        level = None
+        if self.memory_cache is not None:
+            level = self.memory_cache.get(('data', key))
+        if level is None and self.cache:
+            level = self.cache.load_data(key)
+            if level is not None:
+                self._memorize_data(key, level)
+        return level
+
+    @_timed('get_data_for_view')
+    def get_data_for_view(self, measurement_id, x_min=None, x_max=None, pixel_width=1000):
+        """Get data for plotting the x range from x_min to x_max, pixel_width pixels wide
+
+        The data is read from the level of the min/max/mean pyramid of the dataset,
+        that has at least one row per pixel in the x range. Level k of the pyramid
+        reduces each bucket of 2**k consecutive rows of the dataset to one row of: the
+        first x, the minimum y, the maximum y and the mean y. The levels are saved in the
+        cache when the dataset is first cached with cache_pyramid set, or when they are
+        first needed, and are kept in the memory cache. Together with mmap_mode='r', the
+        time and memory it takes to get data for a view is proportional to pixel_width,
+        not to the size of the dataset.
+        If x goes up and down (e.g. in a TPD or CV ramp), the rows in the x range are
+        selected from the full dataset and reduced in the same way, without the pyramid.
+
+        Args:
+            measurement_id (int): The id of the measurement
+            x_min (float): The lowest x of the view or None for no limit
+            x_max (float): The highest x of the view or None for no limit
+            pixel_width (int): The width of the view in pixels
+
+        Returns:
+            numpy.array: Array with the columns x, minimum y, maximum y and mean y. If the
+                x range contains pixel_width rows of the dataset or less, these rows are
+                returned with y in all three y columns.
+
+        Raises:
+            CinfdataError: If neither caching nor a memory cache is used. The pyramid
+                would then have to be built from the full dataset for every view.
+        """
+        if not self.cache and self.memory_cache is None:
+            raise CinfdataError('get_data_for_view requires caching or a memory cache')
+        data = self._get_full_data(measurement_id)
+        x_ascending = self._x_is_ascending(measurement_id, data)
+        window = _slice_x_range(data, x_min, x_max, x_ascending=x_ascending)
+        number_of_rows = len(window)
+        depth = pyramid_depth(len(data) if x_ascending else number_of_rows,
+                              self.pyramid_min_rows)
+        level_number = 0
+        while level_number < depth and number_of_rows >> (level_number + 1) >= pixel_width:
+            level_number += 1
+
+        if level_number == 0:
+            return np.column_stack((window[:, 0], window[:, 1], window[:, 1], window[:, 1]))
+        if not x_ascending:
+            # The rows in the x range are not consecutive in the dataset, so they are not
+            # consecutive rows of the pyramid levels either. Reduce them directly.
+            return build_pyramid(window, self.pyramid_min_rows)[level_number - 1]
+
+        # The cached levels hold the complete buckets. A level that was built from data
+        # with another number of rows is stale.
+        number_of_buckets = len(data) >> level_number
+        level = self._load_pyramid_level(measurement_id, level_number)
+        if level is None or len(level) != number_of_buckets:
+            start = time()
+            levels = build_pyramid(data, self.pyramid_min_rows)
+            LOG.debug('Built pyramid for id %s in %0.4e s', measurement_id, time() - start)
+            self._cache_pyramid(measurement_id, levels, len(data))
+            level = levels[level_number - 1][:number_of_buckets]
+        # The last bucket is incomplete, if the number of rows is not a multiple of its
+        # size, and is reduced from the rows of the dataset
+        tail = data[number_of_buckets << level_number:]
+        last_bucket = _reduce_bucket(tail) if len(tail) > 0 else None
+
+        # Include the bucket that x_min falls in
+        start = 0
+        if x_min is not None:
+            if last_bucket is not None and last_bucket[0, 0] <= x_min:
+                start = len(level)
+            else:
+                start = max(np.searchsorted(level[:, 0], x_min, side='right') - 1, 0)
+        view = _slice_x_range(level[start:], None, x_max)
+        if last_bucket is not None and (x_max is None or last_bucket[0, 0] <= x_max):
+            view = np.concatenate((view, last_bucket))
+        return view
+
+    def _get_downsampled_data(self, measurement_id, max_points, method):
+        """Get the data for measurement_id downsampled to at most max_points points
+
+        The downsampled data is kept in the memory cache and the cache under the key
+        "<id>_<method><max_points>". The number of rows of the full data it was made from
+        is saved as the signature of that key. If it does not match the row count in the
+        signature of the full data (see :meth:`_stale_ids`), e.g. because rows have been
+        appended to it, the data is downsampled again and the key overwritten. When
+        validate_cache is set, the full data is validated and its length used instead.
+        """
+        if method not in DOWNSAMPLING_METHODS:
+            msg = 'The method \'{}\' is invalid. Only {} are allowed.'
+            raise CinfdataError(msg.format(method, DOWNSAMPLING_METHODS))
+
+        key = '{}_{}{}'.format(measurement_id, method, max_points)
+        full_data = None
+        if self.validate_cache and self._has_database:
+            full_data = self._get_full_data(measurement_id)
+            source_length = len(full_data)
+        else:
+            signature = self._load_signature(measurement_id)
+            source_length = None if signature is None else signature[0]
+
+        # Check if the downsampled data is in the memory cache or the cache, and was made
+        # from the full data as it is now
+        downsampled_from = self._load_signature(key)
+        if downsampled_from is not None and source_length in (None, downsampled_from[0]):
+            data = None
+            if self.memory_cache is not None:
+                data = self.memory_cache.get(('data', key))
+            if data is None and self.cache:
+                data = self.cache.load_data(key)
+                if data is not None:
+                    self._memorize_data(key, data)
+            if data is not None:
+                return data
+
+        if full_data is None:
+            full_data = self._get_full_data(measurement_id)
+        if len(full_data) <= max_points:
+            return full_data
+        start = time()
+        data = downsample(full_data, max_points, method)
+        LOG.debug('Downsampled data for id %s from %s to %s points with %s in %0.4e s',
+                  measurement_id, len(full_data), len(data), method, time() - start)
+        if self.cache:
+            self.cache.save_data(key, data)
+        self._save_signatures({key: (len(full_data), None)}, start)
+        return self._memorize_data(key, data)
+
+    def _get_data_for_ids(self, measurement_ids, x_min=None, x_max=None):
+        """Get data for several measurement ids, fetching all cache misses in batches
+
+        Args:
+            measurement_ids (sequence): The ids of the measurements to get
+            x_min (float): If given, only get the rows with x >= x_min
+            x_max (float): If given, only get the rows with x <= x_max. Cached data is
+                sliced and only the rows in the x range of the misses are fetched (and
+                not cached)
+
+        Returns:
+            dict: Mapping of ids to data, in the order of measurement_ids. Ids with no
+                rows in the database (in the x range) get an empty array
+
+        Raises:
+            CinfdataError: If there is no database and the data for an id is not cached
+        """
+        x_range = x_min is not None or x_max is not None
+        stale_signatures = {}
+        cached = self._load_cached_data(measurement_ids, stale_signatures)
+        group_of_data = {}
+        misses = []
+        for id_ in measurement_ids:
+            group_of_data[id_] = cached.get(id_)
+            if id_ not in cached:
+                misses.append(id_)
+            elif x_range:
+                group_of_data[id_] = self._select_x_range(id_, cached[id_], x_min, x_max)
+
+        # Fetch all the misses from the database, max_ids_per_query at a time
+        if misses and self._has_database:
+            for start in range(0, len(misses), self.max_ids_per_query):
+                batch_ids = misses[start: start + self.max_ids_per_query]
+                if x_range:
+                    batch = self._fetch_data_batch(batch_ids, x_min, x_max)
+                else:
+                    batch = self._fetch_and_cache_data(batch_ids, stale_signatures)
+                # Measurements without rows, e.g. aborted ones, get an empty array
+                for id_ in batch_ids:
+                    batch.setdefault(id_, np.empty((0, 2)))
+                group_of_data.update(batch)
+
+        for id_, data in group_of_data.items():
+            if data is None:
+                raise CinfdataError('No data found for id {}'.format(id_))
+
+        return group_of_data
+
+    def _load_cached_data(self, measurement_ids, stale_signatures=None):
+        """Load data from the memory cache and the cache, leaving out stale data
+
+        Args:
+            measurement_ids (sequence): The ids of the measurements to load
+            stale_signatures (dict): See :meth:`_stale_ids`
+
+        Returns:
+            dict: Mapping of ids to data, for the ids that were cached
+        """
+        cached = {}
+        if self.memory_cache is not None:
+            for id_ in measurement_ids:
+                data = self.memory_cache.get(('data', id_))
+                if data is not None:
+                    cached[id_] = data
+        if self.cache:
+            not_in_memory = [id_ for id_ in measurement_ids if id_ not in cached]
+            for id_, data in self.cache.load_data_many(not_in_memory).items():
+                cached[id_] = self._memorize_data(id_, data)
+        # Discard the cached data that has changed in the database
+        for id_ in self._stale_ids(cached, stale_signatures):
+            del cached[id_]
+        return cached
+
+    def _fetch_and_cache_data(self, measurement_ids, known_signatures=None):
+        """Fetch data for measurement_ids in a single query and save it in the caches
+
+        Args:
+            measurement_ids (sequence): The ids of the measurements to fetch
+            known_signatures (dict): Signatures that have just been fetched, e.g. by
+                :meth:`_stale_ids`. Only the signatures of the other ids are fetched, if
+                validate_cache is set
+
+        Returns:
+            dict: Mapping of ids to data. Ids that has no data in the database are left
+                out.
+        """
+        fetch_time = time()
+        if self.validate_cache:
+            known_signatures = known_signatures or {}
+            signatures = {id_: known_signatures[id_] for id_ in measurement_ids
+                          if id_ in known_signatures}
+            unknown_ids = [id_ for id_ in measurement_ids if id_ not in signatures]
+            if unknown_ids:
+                signatures.update(self._fetch_signatures(unknown_ids))
+        batch = self._fetch_data_batch(measurement_ids)
+        for id_, data in batch.items():
+            self._cache_data(id_, data)
+            self._memorize_data(id_, data)
+        if self.validate_cache:
+            self._save_signatures(signatures, fetch_time)
+        return batch
+
+    def get_data_many(self, measurement_ids, workers=4, batch_size=None,
+                      scaling_factors=None):
+        """Get data for many measurement ids, fetching cache misses in parallel
+
+        Cached datasets are yielded first. The cache misses are split into batches,
+        which are fetched with a single query each, on up to workers pooled connections
+        in parallel. Each batch is saved to the cache in the worker thread that fetched
+        it, so saving overlaps with the fetching of other batches. The datasets are
+        yielded as their batch completes, so the order is not that of measurement_ids.
+
+        Args:
+            measurement_ids (sequence): The ids of the measurements to get
+            workers (int): The number of batches to fetch in parallel
+            batch_size (int): The number of ids to fetch per query. The default is to
+                split the misses into about 4 batches per worker, but at most
+                max_ids_per_query ids per batch
+            scaling_factors (sequence): Scaling factors for the columns, as for
+                :meth:`get_data`
+
+        Yields:
+            tuple: (measurement id, data) pairs. Ids that has no rows in the database
+                get an empty array
+
+        Raises:
+            CinfdataError: If there is no database and one of the ids is not cached
+        """
+        measurement_ids = list(measurement_ids)
+        cached = self._load_cached_data(measurement_ids)
+        for id_, data in cached.items():
+            yield id_, self._scale(data, scaling_factors) if scaling_factors else data
+
+        misses = [id_ for id_ in measurement_ids if id_ not in cached]
+        if not misses:
+            return
+        if not self._has_database:
+            raise CinfdataError('No data found for id {}'.format(misses[0]))
+
+        if batch_size is None:
+            batch_size = min(self.max_ids_per_query, max(1, len(misses) // (workers * 4)))
+        batches = [misses[start: start + batch_size]
+                   for start in range(0, len(misses), batch_size)]
+
+        if ThreadPoolExecutor is None or workers <= 1:
+            completed = (self._fetch_and_cache_data(batch_ids) for batch_ids in batches)
+            for batch_ids, batch in zip(batches, completed):
+                for item in self._checked_batch_items(batch_ids, batch, scaling_factors):
+                    yield item
+            return
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = {}
+        try:
+            futures = {executor.submit(self._fetch_and_cache_data, batch_ids): batch_ids
+                       for batch_ids in batches}
+            for future in as_completed(futures):
+                for item in self._checked_batch_items(futures[future], future.result(),
+                                                      scaling_factors):
+                    yield item
+        finally:
+            # Don't start new batches if the generator is abandoned or fails
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def _checked_batch_items(self, batch_ids, batch, scaling_factors):
+        """Return the (id, data) items of a fetched batch, scaled if requested
+
+        Ids that has no rows in the database get an empty array.
+        """
+        for id_ in batch_ids:
+            batch.setdefault(id_, np.empty((0, 2)))
+        if scaling_factors is None:
+            return [(id_, batch[id_]) for id_ in batch_ids]
+        return [(id_, self._scale(batch[id_], scaling_factors)) for id_ in batch_ids]
+
+    @_timed('prefetch')
+    def prefetch(self, measurement_ids, workers=4, batch_size=None):
+        """Fetch data for many measurement ids into the cache, in parallel
+
+        See :meth:`get_data_many` for a description of the arguments.
+
+        Returns:
+            int: The number of datasets that are now in the cache (or memory cache)
+        """
+        if not self.cache and self.memory_cache is None:
+            raise CinfdataError('Prefetching requires caching or a memory cache')
+        start = time()
+        number_of_datasets = 0
+        for _, data in self.get_data_many(measurement_ids, workers=workers,
+                                          batch_size=batch_size):
+            # Empty datasets are not cached
+            if len(data) > 0:
+                number_of_datasets += 1
+        LOG.debug('Prefetched %s datasets in %0.4e s', number_of_datasets, time() - start)
+        return number_of_datasets
+
+    def _stale_ids(self, cached_data, stale_signatures=None):
+        """Return the ids of cached data that has changed in the database
+
+        This is only checked if validate_cache is set and there is a database
+        connection. Each dataset is validated by comparing its signature (the number of
+        rows and the highest id or x) with the one from the database, at most once per
+        cache_ttl seconds. The signatures for all the datasets that needs to be validated
+        are fetched in a single query.
+
+        Args:
+            cached_data (dict): Mapping of ids to data from the memory cache or the cache
+            stale_signatures (dict): If given, the signatures fetched for the stale
+                datasets are added to it, so that they can be saved with the data when it
+                is fetched again, without fetching them a second time
+
+        Returns:
+            set: The ids of the stale datasets
+        """
+        if not self.validate_cache or not self._has_database or not cached_data:
+            return set()
+
+        now = time()
+        saved_signatures = {}
+        for id_ in cached_data:
+            signature = self._load_signature(id_)
+            if signature is None or self.cache_ttl is None or \
+                    now - signature[2] >= self.cache_ttl:
+                saved_signatures[id_] = signature
+        if not saved_signatures:
+            return set()
+
+        signatures = self._fetch_signatures(list(saved_signatures.keys()))
+        stale_ids = set()
+        for id_, saved_signature in saved_signatures.items():
+            if id_ not in signatures:
+                stale_ids.add(id_)
+            elif saved_signature is None:
+                # Data cached without a signature is trusted if the row count matches
+                if signatures[id_][0] != len(cached_data[id_]):
+                    stale_ids.add(id_)
+            elif tuple(saved_signature[:2]) != signatures[id_]:
+                stale_ids.add(id_)
+        if stale_ids:
+            LOG.debug('Cached data for ids %s is stale', sorted(stale_ids))
+            if stale_signatures is not None:
+                stale_signatures.update((id_, signatures[id_]) for id_ in stale_ids
+                                        if id_ in signatures)
+
+        # Mark the signatures of the fresh datasets as checked now
+        self._save_signatures({id_: signature for id_, signature in signatures.items()
+                               if id_ not in stale_ids}, now)
+        return stale_ids
+
+    def _fetch_signatures(self, measurement_ids):
+        """Fetch the signatures (row count and highest id or x) of several measurements
+
+        Returns:
+            dict: Mapping of ids to (row count, highest id or x). Ids that has no data
+                in the database are left out.
+        """
+        start = time()
+        ids_by_number = {int(id_): id_ for id_ in measurement_ids}
+        signatures = {}
+        for batch_start in range(0, len(measurement_ids), self.max_ids_per_query):
+            batch = measurement_ids[batch_start: batch_start + self.max_ids_per_query]
+            placeholders = ', '.join(['%s'] * len(batch))
+            rows = self._query(self.signature_query.format(placeholders), tuple(batch))
+            for measurement, count, last in rows:
+                signatures[ids_by_number[int(measurement)]] = (count, last)
+        LOG.debug('Fetched signatures for %s ids from database in %0.4e s',
+                  len(measurement_ids), time() - start)
+        return signatures
+
+    def _load_signature(self, measurement_id):
+        """Return the saved signature (row count, highest id or x, checked at) or None"""
+        if self.cache:
+            if self.cache.has_infoitem('signatures', measurement_id):
+                return self.cache.load_infoitem('signatures', measurement_id)
+            return None
+        return self._signatures.get(measurement_id)
+
+    def _save_signatures(self, signatures, checked_at):
+        """Save signatures, marked as checked at checked_at, in the cache or in memory"""
+        if not signatures:
+            return
+        signatures = {id_: tuple(signature) + (checked_at,)
+                      for id_, signature in signatures.items()}
+        if self.cache:
+            self.cache.save_infoitems('signatures', signatures)
+        else:
+            self._signatures.update(signatures)
+
+    def _fetch_data_batch(self, measurement_ids, x_min=None, x_max=None):
+        """Fetch data for several measurements from the database in a single query
+
+        The rows for all the measurements are fetched in one round trip, ordered by
+        measurement, and split into one array per measurement with a single vectorized
+        pass over the measurement column.
+
+        Args:
+            measurement_ids (sequence): The ids of the measurements to fetch
+            x_min (float): If given, only fetch the rows with x >= x_min
+            x_max (float): If given, only fetch the rows with x <= x_max
+
+        Returns:
+            dict: Mapping of ids to data. The data arrays are views into one contiguous
+                array. Ids that has no data in the database are left out.
+        """
+        start = time()
+        ids_by_number = {int(id_): id_ for id_ in measurement_ids}
+        placeholders = ', '.join(['%s'] * len(measurement_ids))
+        query, args = self._restrict_to_x_range(self.batch_data_query.format(placeholders),
+                                                measurement_ids, x_min, x_max)
+        rows = self._fetch_array(query, args, n_columns=3)
+        LOG.debug('Fetched data for %s ids from database in %0.4e s', len(measurement_ids),
+                  time() - start)
+        if rows.size == 0:
+            return {}
+
+        # Find the row numbers where the measurement id changes and split there
+        boundaries = np.flatnonzero(np.diff(rows[:, 0])) + 1
+        starts = np.concatenate(([0], boundaries))
+        values = np.ascontiguousarray(rows[:, 1:])
+        batch = {}
+        for row_number, data in zip(starts, np.split(values, boundaries)):
+            batch[ids_by_number[int(rows[row_number, 0])]] = data
+        return batch
+
+    def _fetch_array(self, query, args, n_columns=2):
+        """Execute a data query and return the result as a numpy array
+
+        If streaming is enabled, the rows are read from a server side cursor in chunks
+        and written into a growable float64 buffer, otherwise they are fetched all at once
+
+        Args:
+            query (str): The query to execute
+            args (tuple): The arguments for the query
+            n_columns (int): The number of columns the query returns
+
+        Returns:
+            numpy.array: The result of the query
+        """
+        if not self.streaming:
+            # Reshape, so that an empty result also has n_columns columns
+            data = np.array(self._query(query, args)).reshape(-1, n_columns)
+            self._stats.count('database.bytes', data.nbytes)
+            return data
+
+        start = time()
+
+        cursor_class = None
+        if self._connection_parameters.connection_factory is None:
+            cursor_class = MySQLdb.cursors.SSCursor
+        with self._checkout_cursor(cursor_class) as cursor:
+            cursor.execute(query, args)
+            data = np.empty((self.stream_chunk_size, n_columns))
+            n_rows = 0
+            while True:
+                rows = cursor.fetchmany(self.stream_chunk_size)
+                if not rows:
+                    break
+                # Grow the buffer in place by 50% when it runs full
+                if n_rows + len(rows) > data.shape[0]:
+                    new_size = max(n_rows + len(rows), data.shape[0] * 3 // 2)
+                    data.resize((new_size, n_columns), refcheck=False)
+                data[n_rows: n_rows + len(rows)] = rows
+                n_rows += len(rows)
+
+        # Trim off the unused part of the buffer
+        data.resize((n_rows, n_columns), refcheck=False)
+        self._stats.time('database.query', time() - start)
+        self._stats.count('database.queries')
+        self._stats.count('database.rows', n_rows)
+        self._stats.count('database.bytes', data.nbytes)
+        return data
+
+    @_timed('get_metadata')
+    def get_metadata(self, measurement_id):
+        """Get metadata for measurement_id"""
+        # Check if the metadata is in the memory cache or the cache
+        metadata = None
+        if self.memory_cache is not None:
+            metadata = self._recall_metadata(measurement_id)
+        if metadata is None and self.cache:
+            if self.cache.has_infoitem('metadata', measurement_id):
+                metadata = self.cache.load_infoitem('metadata', measurement_id)
+                self._memorize_metadata(measurement_id, metadata)
+
+        # Try and get the metadata from the database
+        if metadata is None and self._has_database:
+            # Get the data
+            start = time()
+            metadata_raw = self._query(self.metadata_query, (measurement_id,))
+            LOG.debug('Fetched metadata for id %s from database in %0.4e s',
+                      measurement_id, time() - start)
+
+            # Raise error if there was not exactly 1 line
+            if len(metadata_raw) != 1:
+                raise CinfdataError('There was not exactly 1 row of metadata returned '
+                                    'for id {}'.format(measurement_id))
+
+            # Convert metadata to dict
+            metadata = dict(zip(self.column_names, metadata_raw[0]))
+
+            # Save in cache if present
+            if self.cache:
+                self.cache.save_infoitem('metadata', measurement_id, metadata)
+            self._memorize_metadata(measurement_id, metadata)
+
+        # Raise error if we could not find any metadata
+        if metadata is None:
+            raise CinfdataError('No metadata found for id {}'.format(measurement_id))
+
+        # Convert to namedtuple if requested
+        if self._metadata_as_named_tuple:
+            metadata = self._metadata_named_tuple(**metadata)
+
+        return metadata
+
+    def _get_metadata_for_ids(self, measurement_ids):
+        """Get metadata for several measurement ids, fetching all cache misses in batches
+
+        Args:
+            measurement_ids (sequence): The ids of the measurements to get metadata for
+
+        Returns:
+            dict: Mapping of ids to metadata dicts (never namedtuples, so that columns
+                can be looked up by name), in the order of measurement_ids
+        """
+        # Use the memory cache and the cache where possible and note the misses
+        group_of_metadata = {}
+        misses = []
+        for id_ in measurement_ids:
+            metadata = None
+            if self.memory_cache is not None:
+                metadata = self._recall_metadata(id_)
+            if metadata is None and self.cache and self.cache.has_infoitem('metadata', id_):
+                metadata = self.cache.load_infoitem('metadata', id_)
+                self._memorize_metadata(id_, metadata)
+            group_of_metadata[id_] = metadata
+            if metadata is None:
+                misses.append(id_)
+
+        # Fetch all the misses from the database, max_ids_per_query at a time
+        if misses and self._has_database:
+            for start in range(0, len(misses), self.max_ids_per_query):
+                batch = self._fetch_metadata_batch(
+                    misses[start: start + self.max_ids_per_query]
+                )
+                group_of_metadata.update(batch)
+                # Save the entire batch in the cache with a single write
+                if self.cache:
+                    self.cache.save_infoitems('metadata', batch)
+                for id_, metadata in batch.items():
+                    self._memorize_metadata(id_, metadata)
+
+        for id_, metadata in group_of_metadata.items():
+            if metadata is None:
+                raise CinfdataError('No metadata found for id {}'.format(id_))
+
+        return group_of_metadata
+
+    def _fetch_metadata_batch(self, measurement_ids):
+        """Fetch metadata for several measurements from the database in a single query
+
+        Args:
+            measurement_ids (sequence): The ids of the measurements to fetch metadata for
+
+        Returns:
+            dict: Mapping of ids to metadata dicts. Ids that has no metadata in the
+                database are left out.
+        """
+        start = time()
+        ids_by_number = {int(id_): id_ for id_ in measurement_ids}
+        placeholders = ', '.join(['%s'] * len(measurement_ids))
+        metadata_raw = self._query(self.batch_metadata_query.format(placeholders),
+                                   tuple(measurement_ids))
+        LOG.debug('Fetched metadata for %s ids from database in %0.4e s',
+                  len(measurement_ids), time() - start)
+
+        column_names = self.column_names
+        get_id = itemgetter(column_names.index('id'))
+        return {ids_by_number[int(get_id(row))]: dict(zip(column_names, row))
+                for row in metadata_raw}
+
+    @_timed('get_data_group')
+    def get_data_group(self, group_id, grouping_column=None, label_column=None,
+                       scaling_factors=None, x_min=None, x_max=None):
+        """Get a data group
+
+        Args:
+            group_id (object): The group id in the grouping column (can have
+                different types depending on the type of the grouping column)
+            grouping_column (str): The name of the column used for grouping
+                column (if different from __init__ value)
+            label_column (str): The name of the column that is used for the
+                label (if different from __init__ value)
+            scaling_factors (dict or sequence): If a sequence is given, it is assumed to
+                be a pair of x and y scaling factiors. Where each of the components can
+                be left out by giving a value of None. E.g: `(1E6, 1E-3)`, `(1E6, None)`
+                or `(None, 1e-3)`. If a dict if given, it is assumed to be mapping of
+                label values to scaling pairs as described above.
+            x_min (float): If given, only get the rows with x >= x_min
+            x_max (float): If given, only get the rows with x <= x_max. See
+                :meth:`get_data` for details
+
+        Returns:
+            dict: Mapping of ids to data
+
+        """
+        ids = self._get_group_ids(group_id, grouping_column, 'data')
+        group_of_data = self._get_data_for_ids(ids, x_min=x_min, x_max=x_max)
+
+        if scaling_factors is not None:
+            if isinstance(scaling_factors, dict):
+                # Make sure we have label_column
+                label_column = label_column if label_column is not None else self.label_column
+                if label_column is None:
+                    msg = ('A grouping_column must be given either in __init__ or in '
+                           'this method, in order to be able to scale based on label value')
+                    raise CinfdataError(msg)
+
+                # Scale
+                group_of_metadata = self._get_metadata_for_ids(ids)
+                for id_, data in group_of_data.items():
+                    label = group_of_metadata[id_][label_column]
+                    if label in scaling_factors:
+                        group_of_data[id_] = self._scale(data, scaling_factors[label])
+
+            else:
+                for id_, data in group_of_data.items():
+                    group_of_data[id_] = self._scale(data, scaling_factors)
+
+        return group_of_data
+
+    @_timed('get_data_group_array')
+    def get_data_group_array(self, group_id, grouping_column=None, label_column=None,
+                             scaling_factors=None, x_min=None, x_max=None):
+        """Get a data group as a :class:`GroupData`
+
+        Unlike :meth:`get_data_group`, which returns a dict of arrays, the data of all
+        the members is kept in one contiguous array.
+
+        Args:
+            group_id (object): The group id in the grouping column
+            grouping_column (str): The name of the column used for grouping
+                column (if different from __init__ value)
+            label_column (str): The name of the column that is used for the labels of the
+                members (if different from __init__ value). If there is no label column,
+                the group has no labels
+            scaling_factors (dict or sequence): As for :meth:`get_data_group`, but the
+                scaling is done with one vectorized operation for the whole group
+            x_min (float): If given, only get the rows with x >= x_min
+            x_max (float): If given, only get the rows with x <= x_max
+
+        Returns:
+            GroupData: The data of the group
+        """
+        ids = self._get_group_ids(group_id, grouping_column, 'data')
+        group_of_data = self._get_data_for_ids(ids, x_min=x_min, x_max=x_max)
+
+        labels = None
+        label_column = label_column if label_column is not None else self.label_column
+        if label_column is not None:
+            group_of_metadata = self._get_metadata_for_ids(ids)
+            labels = {id_: group_of_metadata[id_][label_column] for id_ in ids}
+
+        group_data = GroupData.from_dict(group_of_data, labels=labels)
+        if scaling_factors is not None:
+            group_data.scale(scaling_factors)
+        return group_data
+
+    def _get_group_ids(self, group_id, grouping_column, kind):
+        """Get the ids of the measurements in a group, from the cache or the database
+
+        Args:
+            group_id (object): The group id in the grouping column
+            grouping_column (str): The name of the column used for grouping or None to
+                use the __init__ value
+            kind (str): What the group is for, 'data' or 'metadata', used in messages
+
+        Returns:
+            list: The ids in the group
+        """
+        grouping_column = grouping_column if grouping_column is not None\
+                          else self.grouping_column
+        if grouping_column is None:
+            msg = ('A grouping_column must be given either in __init__ or in '
+                   'this method, in order to be able to get a group of {}'.format(kind))
+            raise CinfdataError(msg)
+
+        group_key = (grouping_column, group_id)
+        try:
+            hash(group_key)
+        except TypeError:
+            raise CinfdataError('group_id must be a immuteable type, not {}'.format(type(group_id)))
+
+        # See if the group lookup is in the cache
+        ids = None
+        if self.cache and self.cache.has_infoitem('groups', group_key):
+            ids = self.cache.load_infoitem('groups', group_key)
+
+        # If not known already, try and get the group from the database
+        if ids is None and self._has_database:
+            if grouping_column not in self.column_names:
+                raise CinfdataError(
+                    'Grouping column "{}" is not among the metadata column names {}'\
+                    .format(grouping_column, self.column_names)
+                )
+            rows = self._query(self.group_query.format(grouping_column), (group_id,))
+            ids = [row[0] for row in rows]
+            if self.cache:
+                self.cache.save_infoitem('groups', group_key, ids)
+
+        # We need ids to proceed, so complain if they are not there
+        if ids is None:
+            raise CinfdataError('Unable to get ids for group, either from cache, '
+                                'database or both')
+        return ids
+
+    @_timed('get_metadata_table')
+    def get_metadata_table(self, where=None, args=None, as_dataframe=False):
+        """Get the metadata of many measurements as a table
+
+        The table is a numpy structured array with a field per column (see
+        :attr:`column_names`), which allows for vectorized selection, e.g.::
+
+          table = db.get_metadata_table()
+          ids = table['id'][(table['type'] == 4) & (table['sem_voltage'] > 1800)]
+
+        Integer columns become int64 fields (or float64 if they contain NULL values),
+        other numeric columns become float64, date and time columns datetime64[s] and
+        all other columns unicode strings. NULL values are NaN, NaT or ''.
+
+        The table of all measurements is saved in the cache, and on later calls only
+        the measurements with a higher id than the ones in the cache are fetched.
+
+        Args:
+            where (str): If given, only fetch the measurements that fulfill this SQL
+                condition, e.g. 'type = %s'. Such tables are not cached
+            args (sequence): The arguments for the placeholders in where
+            as_dataframe (bool): If True, return the table as a pandas DataFrame
+
+        Returns:
+            numpy.array or pandas.DataFrame: The metadata table
+        """
+        if as_dataframe and pandas is None:
+            raise CinfdataError('as_dataframe requires pandas to be installed')
+
+        if where is not None:
+            if not self._has_database:
+                raise CinfdataError('A filtered metadata table requires the database')
+            table = self._fetch_metadata_table(where, args)
+        else:
+            table = self.cache.load_metadata_table() if self.cache else None
+            if table is not None and table.dtype.names != tuple(self.column_names):
+                LOG.info('The columns of the cached metadata table have changed, refetch')
+                table = None
+            if self._has_database:
+                if table is None:
+                    new_rows = table = self._fetch_metadata_table('1 = 1')
+                else:
+                    last_id = table['id'].max() if len(table) > 0 else -1
+                    new_rows = self._fetch_metadata_table('id > %s', (int(last_id),))
+                    table = _concatenate_tables(table, new_rows)
+                if self.cache and len(new_rows) > 0:
+                    self.cache.save_metadata_table(table)
+            if table is None:
+                raise CinfdataError('No metadata table found in cache and no database')
+
+        if as_dataframe:
+            return pandas.DataFrame(table)
+        return table
+
+    def _fetch_metadata_table(self, where, args=None):
+        """Fetch the metadata rows that fulfill where and convert them to a table"""
+        start = time()
+        rows = self._query(self.metadata_table_query.format(where), args)
+        columns = list(zip(*rows)) if rows else [()] * len(self.column_names)
+        table = np.empty(len(rows), dtype=[
+            (name, _column_dtype(self.column_types.get(name), column))
+            for name, column in zip(self.column_names, columns)
+        ])
+        for name, column in zip(self.column_names, columns):
+            table[name] = _column_values(table.dtype[name], column)
+        LOG.debug('Fetched metadata table of %s rows in %0.4e s', len(table), time() - start)
+        return table
+
+    @_timed('sync')
+    def sync(self, since_id=None, batch_size=None):
+        """Mirror all the measurements newer than since_id into the cache
+
+        The ids of the new measurements are found with a single query and their
+        metadata and data are fetched in batches of batch_size measurements, with one
+        query each for metadata and data. Everything is saved to the cache in one
+        transaction (see :meth:`Cache.transaction`), after which the highest synced id
+        is recorded as the high water mark for the next sync.
+
+        Args:
+            since_id (int): Sync the measurements with ids higher than this. Default is
+                None, which means the high water mark from the last sync or, if the
+                setup was never synced, the highest id of the data in the cache
+            batch_size (int): The number of measurements to fetch per query. Default
+                is None, which means max_ids_per_query
+
+        Returns:
+            list: The ids of the synced measurements
+        """
+        if not self.cache:
+            raise CinfdataError('Sync requires caching to be enabled')
+        if not self._has_database:
+            raise CinfdataError('Sync requires the database')
+
+        start = time()
+        if since_id is None:
+            if self.cache.has_infoitem('general', 'sync_high_water_mark'):
+                since_id = self.cache.load_infoitem('general', 'sync_high_water_mark')
+            else:
+                since_id = max(self.cache.data_ids() or [0])
+        ids = [row[0] for row in self._query(self.new_ids_query, (since_id,))]
+        batch_size = batch_size or self.max_ids_per_query
+
+        with self.cache.transaction():
+            for batch_start in range(0, len(ids), batch_size):
+                batch_ids = ids[batch_start: batch_start + batch_size]
+                batch = self._fetch_metadata_batch(batch_ids)
+                self.cache.save_infoitems('metadata', batch)
+                self._fetch_and_cache_data(batch_ids)
+            if ids:
+                self.cache.save_infoitem('general', 'sync_high_water_mark', ids[-1])
+        LOG.info('Synced %s measurements newer than id %s in %0.4e s', len(ids), since_id,
+                 time() - start)
+        return ids
+
+    @_timed('get_metadata_group')
+    def get_metadata_group(self, group_id, grouping_column=None):
+        """Get a metadata group
+
+        Args:
+            group_id (object): The group id in the grouping column (can have
+                different types depending on the type of the grouping column)
+            grouping_column (str): The name of the column used for grouping
+                column (if different from __init__ value)
+
+        Returns:
+            dict: Mapping of ids to metadata
+
+        """
+        ids = self._get_group_ids(group_id, grouping_column, 'metadata')
+        group_of_metadata = self._get_metadata_for_ids(ids)
+
+        # Convert to namedtuples if requested
+        if self._metadata_as_named_tuple:
+            group_of_metadata = {id_: self._metadata_named_tuple(**metadata)
+                                 for id_, metadata in group_of_metadata.items()}
+
+        return group_of_metadata
+
+
+    def _memorize_data(self, measurement_id, data):
+        """Make data read only and put it in the memory cache, if it is enabled
+
+        The data is made read only, so that the copy in the memory cache cannot be
+        altered through the array returned to the user (scaling will return a copy)
+
+        Returns:
+            numpy.array: The data
+        """
+        if self.memory_cache is not None:
+            data.flags.writeable = False
+            self.memory_cache.put(('data', measurement_id), data, data.nbytes)
+        return data
+
+    def _memorize_metadata(self, measurement_id, metadata):
+        """Put a copy of metadata in the memory cache, if it is enabled"""
+        if self.memory_cache is not None:
+            self.memory_cache.put(('metadata', measurement_id), dict(metadata),
+                                  sys.getsizeof(metadata))
+
+    def _recall_metadata(self, measurement_id):
+        """Return a copy of metadata from the memory cache or None"""
+        metadata = self.memory_cache.get(('metadata', measurement_id))
+        return None if metadata is None else dict(metadata)
+
+    def _scale(self, data, scaling_factors):
+        """Scale columns in a data set with scaling factors
+
+        Args:
+            data (numpy.array): The data to scale
+            scaling_factors (sequence): Sequence of scaling factors e.g: (1E6, 1E-3). If
+                None is passed in an as a value, that column is not scaled e.g: (1E6, None)
+
+        Return:
+            numpy.array: Same array as data, but scaled. NOTE it is the same array, not a
+                copy, unless data is read only or memory mapped from the cache, in which
+                case a scaled copy is returned
+        """
+        if not data.flags.writeable or isinstance(data, np.memmap):
+            data = np.array(data)
+        for column_number, scaling_factor in enumerate(scaling_factors):
+            if scaling_factor is not None:
+                data[:, column_number] *= scaling_factor
+        return data
+
+
+    def stats(self):
+        """Return statistics about the calls, queries and caches of this instance
+
+        The counters include 'database.queries', 'database.rows' and 'database.bytes'
+        (the size of the data arrays fetched), the hits and misses of the memory cache
+        ('memory_cache.hits' and 'memory_cache.misses') and those of the cache (see
+        :class:`Cache`). The timings include each of the get methods, 'database.query'
+        and the serialization and deserialization in the cache.
+
+        Returns:
+            dict: See :meth:`Stats.snapshot`
+        """
+        stats = self._stats.snapshot()
+        if self.memory_cache is not None:
+            stats['counters']['memory_cache.hits'] = self.memory_cache.hits
+            stats['counters']['memory_cache.misses'] = self.memory_cache.misses
+        if self.cache:
+            cache_stats = self.cache.stats.snapshot()
+            stats['counters'].update(cache_stats['counters'])
+            stats['timings'].update(cache_stats['timings'])
+        return stats
+
+    def reset_stats(self):
+        """Reset the statistics returned by :meth:`stats`"""
+        self._stats.reset()
+        if self.memory_cache is not None:
+            self.memory_cache.reset_counters()
+        if self.cache:
+            self.cache.stats.reset()
+
+    def add_stats_hook(self, hook):
+        """Add a hook to the statistics of this instance and its cache
+
+        The hook is called as hook(kind, name, value) on every update, see
+        :class:`Stats`
+        """
+        self._stats.add_hook(hook)
+        if self.cache:
+            self.cache.stats.add_hook(hook)
+
+    def load_schemas(self, setup_names=None):
+        """Load the table schemas of several setups with a single query
+
+        The schemas are kept in a process wide registry shared by all instances, so
+        loading the schemas of all the setups that are going to be used up front, saves
+        a schema query per setup.
+
+        Args:
+            setup_names (sequence): The setup names to load the schemas for. Default is
+                None, which means only the setup of this instance
+
+        Returns:
+            list: The setup names whose schema was found
+        """
+        if setup_names is None:
+            setup_names = [self.setup_name]
+        if not self._has_database:
+            raise CinfdataError('Schemas cannot be loaded without the database')
+
+        start = time()
+        tables = {}
+        for setup_name in setup_names:
+            for table in ('measurements', 'xy_values'):
+                tables['{}_{}'.format(table, setup_name)] = (setup_name, table)
+        query = SCHEMA_QUERY.format(', '.join(['%s'] * len(tables)))
+        rows = self._query(query, [self.database_name] + sorted(tables))
+
+        schemas = {}
+        for table_name, column_name, column_type in rows:
+            setup_name, table = tables[table_name]
+            schema = schemas.setdefault(setup_name, {'measurements': [], 'xy_values': []})
+            schema[table].append((column_name, column_type))
+        with SCHEMAS_LOCK:
+            for setup_name, schema in schemas.items():
+                SCHEMAS[(self.database_name, setup_name)] = schema
+        LOG.debug('Loaded schemas for %s setups in %0.4e s', len(schemas), time() - start)
+        return list(schemas)
+
+    def _get_schema(self, load=True):
+        """Return the schema of this setup from the registry, or None if unavailable
+
+        Args:
+            load (bool): Whether to load the schema from the database if it is not
+                already in the registry
+        """
+        key = (self.database_name, self.setup_name)
+        if key not in SCHEMAS and load and self._has_database:
+            self.load_schemas()
+        return SCHEMAS.get(key)
+
+    def _lazy_general_infoitem(self, attribute, key, from_schema):
+        """Return a schema derived value from the instance, the cache or the schema
+
+        The value is looked up in the instance attribute, then in the general infoitems
+        of the cache, then in the schema registry and finally in the database.
+
+        Args:
+            attribute (str): The name of the instance attribute to memorize the value in
+            key (str): The key of the value in the general infoitems of the cache
+            from_schema (callable): Function that calculates the value from the schema
+
+        Returns:
+            The value or None if it could not be found
+        """
+        value = getattr(self, attribute)
+        if value is not None:
+            return value
+
+        schema = self._get_schema(load=False)
+        if schema is None and self.cache and self.cache.has_infoitem('general', key):
+            value = self.cache.load_infoitem('general', key)
+        else:
+            schema = schema or self._get_schema()
+            if schema is None:
+                return None
+            value = from_schema(schema)
+            if self.cache and not self.cache.has_infoitem('general', key):
+                self.cache.save_infoitem('general', key, value)
+
+        setattr(self, attribute, value)
+        return value
+
+    @property
+    def column_names(self):
+        """Return the columns names from the measurements table"""
+        # Add an fictitious column, which will contain time converted to unixtime
+        column_names = self._lazy_general_infoitem(
+            '_column_names', 'column_names',
+            lambda schema: [name for name, _ in schema['measurements']] + ['unixtime'],
+        )
+        if column_names is None:
+            raise CinfdataError('Column names not found')
+        return column_names
+
+    @property
+    def column_types(self):
+        """Return a dict of the column types of the measurements table"""
+        column_types = self._lazy_general_infoitem(
+            '_column_types', 'column_types',
+            lambda schema: dict(schema['measurements'], unixtime='double'),
+        )
+        if column_types is None:
+            raise CinfdataError('Column types not found')
+        return column_types
+
+    @property
+    def _xy_values_table_has_id(self):
+        """Return whether the xy_values table has an id column"""
+        has_id = self._lazy_general_infoitem(
+            '_has_id', 'xy_values_table_has_id',
+            lambda schema: 'id' in [name for name, _ in schema['xy_values']],
+        )
+        if has_id is None:
+            raise CinfdataError('Could not determine if xy_values_table has id')
+        return has_id
+
+    @property
+    def _metadata_named_tuple(self):
+        """Return the named tuple class used for metadata"""
+        if self._metadata_named_tuple_class is None:
+            self._metadata_named_tuple_class = namedtuple('Metadata', self.column_names)
+        return self._metadata_named_tuple_class
+
+    @property
+    def _order_column(self):
+        """Return the column that orders the rows of a dataset in the xy_values table"""
+        return 'id' if self._xy_values_table_has_id else 'x'
+
+    @property
+    def data_query(self):
+        """Return the query for the data of a single measurement"""
+        return 'SELECT x, y FROM xy_values_{} WHERE measurement=%s ORDER BY {}'\
+            .format(self.setup_name, self._order_column)
+
+    @property
+    def batch_data_query(self):
+        """Return the query template for the data of several measurements"""
+        return 'SELECT measurement, x, y FROM xy_values_{} WHERE measurement IN ({{}}) '\
+            'ORDER BY measurement, {}'.format(self.setup_name, self._order_column)
+
+    @property
+    def tail_data_query(self):
+        """Return the query template for data with the order column, see _get_tail_data"""
+        return 'SELECT {0}, x, y FROM xy_values_{1} WHERE measurement=%s{{}} '\
+            'ORDER BY {0}'.format(self._order_column, self.setup_name)
+
+    @property
+    def signature_query(self):
+        """Return the query template for the signatures of several measurements"""
+        return 'SELECT measurement, COUNT(*), MAX({1}) FROM xy_values_{0} WHERE '\
+            'measurement IN ({{}}) GROUP BY measurement'\
+            .format(self.setup_name, self._order_column)
+
+
+class AsyncCinfdata(object):
+    """asyncio interface to the cinfdata database
+
+    This class has the same methods as :class:`Cinfdata`, but they return awaitables
+    instead of the results. The calls are run on a thread pool of max_concurrency
+    threads, each using its own pooled database connection, so they do not block the
+    event loop and up to max_concurrency requests are served in parallel. The
+    underlying :class:`Cinfdata` instance, including its cache, is available as the
+    cinfdata attribute.
+
+    Example::
+
+        db = AsyncCinfdata('sniffer', use_caching=True)
+        data, metadata = await asyncio.gather(db.get_data(5421), db.get_metadata(5421))
+    """
+
+    def __init__(self, setup_name, max_concurrency=8, **kwargs):
+        """Initialize the Cinfdata instance and the thread pool
+
+        Args:
+            setup_name (str): The setup name, see :class:`Cinfdata`
+            max_concurrency (int): The maximum number of calls to run in parallel. The
+                shared connection pool keeps up to this many idle connections for the
+                setup (see :meth:`ConnectionPool.reserve_idle`)
+            kwargs: The remaining keyword arguments are passed on to :class:`Cinfdata`
+        """
+        if asyncio is None or ThreadPoolExecutor is None:
+            raise CinfdataError('AsyncCinfdata requires the asyncio and '
+                                'concurrent.futures modules')
+        self.cinfdata = Cinfdata(setup_name, **kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        # Keep enough idle connections around for all the threads. This only raises
+        # the limit of the shared pool for the connection parameters of this setup.
+        CONNECTION_POOL.reserve_idle(self.cinfdata._connection_parameters,
+                                     max_concurrency)
+
+    def _run(self, function, *args, **kwargs):
+        """Run function in the thread pool and return an awaitable for the result
+
+        This must be called from a coroutine, so the awaitable belongs to the running
+        event loop.
+        """
+        if hasattr(asyncio, 'get_running_loop'):
+            loop = asyncio.get_running_loop()
+        else:
+            # Python < 3.7
+            loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self._executor, partial(function, *args, **kwargs))
+
+    def get_data(self, measurement_id, **kwargs):
+        """Awaitable version of :meth:`Cinfdata.get_data`"""
+        return self._run(self.cinfdata.get_data, measurement_id, **kwargs)
+
+    def get_data_for_view(self, measurement_id, **kwargs):
+        """Awaitable version of :meth:`Cinfdata.get_data_for_view`"""
+        return self._run(self.cinfdata.get_data_for_view, measurement_id, **kwargs)
+
+    def get_metadata(self, measurement_id):
+        """Awaitable version of :meth:`Cinfdata.get_metadata`"""
+        return self._run(self.cinfdata.get_metadata, measurement_id)
+
+    def get_data_group(self, group_id, **kwargs):
+        """Awaitable version of :meth:`Cinfdata.get_data_group`"""
+        return self._run(self.cinfdata.get_data_group, group_id, **kwargs)
+
+    def get_data_group_array(self, group_id, **kwargs):
+        """Awaitable version of :meth:`Cinfdata.get_data_group_array`"""
+        return self._run(self.cinfdata.get_data_group_array, group_id, **kwargs)
+
+    def get_metadata_group(self, group_id, **kwargs):
+        """Awaitable version of :meth:`Cinfdata.get_metadata_group`"""
+        return self._run(self.cinfdata.get_metadata_group, group_id, **kwargs)
+
+    @property
+    def column_names(self):
+        """Awaitable version of :attr:`Cinfdata.column_names`"""
+        return self._run(lambda: self.cinfdata.column_names)
+
+    def close(self):
+        """Wait for running calls to finish, then close the Cinfdata instance"""
+        self._executor.shutdown(wait=True)
+        self.cinfdata.close()
+
+
+class MemoryCache(object):
+    """Bounded in-memory least recently used cache
+
+    The cache is limited both by the number of entries and by the total number of bytes
+    of the entries, as given to :meth:`put`. Lookups are counted in the hits and misses
+    attributes. The cache is thread safe.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        """Initialize local variables
+
+        Args:
+            max_entries (int): The maximum number of entries or None for no limit
+            max_bytes (int): The maximum total number of bytes or None for no limit
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        """Return whether key is in the cache, without counting it as a lookup"""
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key):
+        """Return the value for key, or None if it is not in the cache"""
+        with self._lock:
+            try:
+                value, nbytes = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            # Re-insert to mark as most recently used
+            self._entries[key] = (value, nbytes)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, nbytes=0):
+        """Put a value in the cache and evict the least recently used entries if needed
+
+        Values larger than max_bytes are not cached.
+        """
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            if self.max_bytes is not None and nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while (self.max_entries is not None and
+                   len(self._entries) > self.max_entries) or \
+                    (self.max_bytes is not None and self.nbytes > self.max_bytes):
+                self.nbytes -= self._entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        """Remove all entries and reset the hit and miss counters"""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+        self.reset_counters()
+
+    def reset_counters(self):
+        """Reset the hit and miss counters"""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+INTEGER_COLUMN_TYPES = ('tinyint', 'smallint', 'mediumint', 'int', 'integer', 'bigint')
+FLOAT_COLUMN_TYPES = ('float', 'double', 'real', 'decimal', 'numeric')
+TIME_COLUMN_TYPES = ('datetime', 'timestamp', 'date')
+
+
+def _column_dtype(column_type, values):
+    """Return the numpy dtype for a metadata table column
+
+    Args:
+        column_type (str): The type of the column in the database, e.g. 'int'
+        values (sequence): The values of the column
+    """
+    column_type = (column_type or '').lower()
+    if column_type in INTEGER_COLUMN_TYPES:
+        return np.float64 if None in values else np.int64
+    if column_type in FLOAT_COLUMN_TYPES:
+        return np.float64
+    if column_type in TIME_COLUMN_TYPES:
+        return 'datetime64[s]'
+    width = max([len(_to_text(value)) for value in values] or [0])
+    return 'U{}'.format(max(width, 1))
+
+
+def _to_text(value):
+    """Return value as text, with None as the empty string"""
+    if value is None:
+        return ''
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return '{}'.format(value)
+
+
+def _column_values(dtype, values):
+    """Return the values of a metadata table column, with NULL values substituted"""
+    if dtype.kind == 'f':
+        return [np.nan if value is None else value for value in values]
+    if dtype.kind == 'M':
+        return [np.datetime64('NaT') if value is None else np.datetime64(value, 's')
+                for value in values]
+    if dtype.kind == 'U':
+        return [_to_text(value) for value in values]
+    return values
+
+
+def _concatenate_tables(first, second):
+    """Concatenate two metadata tables, promoting the dtypes of the fields as needed"""
+    dtype = [(name, np.promote_types(first.dtype[name], second.dtype[name]))
+             for name in first.dtype.names]
+    table = np.empty(len(first) + len(second), dtype=dtype)
+    for name in first.dtype.names:
+        table[name][:len(first)] = first[name]
+        table[name][len(first):] = second[name]
+    return table
+
+
+class GroupData(object):
+    """A group of datasets stored in one contiguous array
+
+    The rows of all the datasets (members) are stored after each other in values and the
+    rows of member number i are ``values[offsets[i]:offsets[i + 1]]``. This makes it
+    possible to scale, reduce and resample all the members of a group with a few
+    vectorized operations, instead of a loop over the members.
+
+    Attributes:
+        ids (list): The ids of the members
+        values (numpy.array): The x, y rows of all the members
+        offsets (numpy.array): The row number where each member starts, followed by the
+            total number of rows
+        labels (list): The labels of the members or None
+    """
+
+    reduce_methods = ('sum', 'mean', 'min', 'max', 'integral')
+
+    def __init__(self, ids, values, offsets, labels=None):
+        """Initialize local variables
+
+        Args:
+            ids (sequence): The ids of the members
+            values (numpy.array): The x, y rows of all the members
+            offsets (sequence): The row number where each member starts, followed by the
+                total number of rows
+            labels (sequence): The labels of the members or None
+        """
+        self.ids = list(ids)
+        self.values = values
+        self.offsets = np.asarray(offsets, dtype=np.intp)
+        self.labels = None if labels is None else list(labels)
+        self._index = {id_: number for number, id_ in enumerate(self.ids)}
+
+    @classmethod
+    def from_dict(cls, group_of_data, labels=None):
+        """Create a GroupData from a dict of ids to data, as from get_data_group
+
+        Args:
+            group_of_data (dict): Mapping of ids to data
+            labels (dict): Mapping of ids to labels or None
+        """
+        ids = list(group_of_data)
+        arrays = [group_of_data[id_] for id_ in ids]
+        offsets = np.concatenate(([0], np.cumsum([len(data) for data in arrays])))
+        values = np.concatenate(arrays) if arrays else np.empty((0, 2))
+        if labels is not None:
+            labels = [labels[id_] for id_ in ids]
+        return cls(ids, values, offsets, labels=labels)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __contains__(self, measurement_id):
+        return measurement_id in self._index
+
+    def __getitem__(self, measurement_id):
+        """Return the data of a member as a view into values"""
+        number = self._index[measurement_id]
+        return self.values[self.offsets[number]: self.offsets[number + 1]]
+
+    @property
+    def lengths(self):
+        """Return the number of rows of each member"""
+        return np.diff(self.offsets)
+
+    @property
+    def member_numbers(self):
+        """Return the member number of each row in values"""
+        return np.repeat(np.arange(len(self.ids)), self.lengths)
+
+    def to_dict(self, use_labels=False):
+        """Return a dict of ids (or labels) to views of the data of the members"""
+        if use_labels:
+            if self.labels is None:
+                raise CinfdataError('The group has no labels')
+            if len(self.labels) != len(set(self.labels)):
+                msg = "Cannot change keys to labels because the labels are not unique"
+                raise CinfdataError(msg)
+            keys = self.labels
+        else:
+            keys = self.ids
+        return {key: self[id_] for key, id_ in zip(keys, self.ids)}
+
+    def scale(self, scaling_factors):
+        """Scale the values of the members in place
+
+        Args:
+            scaling_factors (dict or sequence): Either a pair of x and y scaling factors,
+                where a value of None means no scaling, e.g. ``(1E6, None)``, or a dict of
+                labels to such pairs. Members with labels not in the dict are not scaled
+
+        Returns:
+            GroupData: The group itself
+        """
+        if not self.values.flags.writeable:
+            self.values = np.array(self.values)
+        if not isinstance(scaling_factors, dict):
+            for column_number, scaling_factor in enumerate(scaling_factors):
+                if scaling_factor is not None:
+                    self.values[:, column_number] *= scaling_factor
+            return self
+
+        if self.labels is None:
+            raise CinfdataError('Scaling by label requires a group with labels')
+        factors = np.ones((len(self.ids), self.values.shape[1]))
+        for number, label in enumerate(self.labels):
+            for column_number, scaling_factor in enumerate(scaling_factors.get(label, ())):
+                if scaling_factor is not None:
+                    factors[number, column_number] = scaling_factor
+        self.values *= np.repeat(factors, self.lengths, axis=0)
+        return self
+
+    def reduce(self, method='sum', column=1):
+        """Reduce each member to a single number
+
+        Args:
+            method (str): One of 'sum', 'mean', 'min', 'max' (of the column) or
+                'integral' (trapezoidal integral of y over x)
+            column (int): The column to reduce, has no effect for 'integral'
+
+        Returns:
+            numpy.array: The result for each member, NaN for members with no rows
+        """
+        if method not in self.reduce_methods:
+            msg = 'The method \'{}\' is invalid. Only {} are allowed.'
+            raise CinfdataError(msg.format(method, self.reduce_methods))
+        result = np.full(len(self.ids), np.nan)
+        lengths = self.lengths
+        non_empty = lengths > 0
+        if not non_empty.any():
+            return result
+
+        if method == 'integral':
+            x, y = self.values[:, 0], self.values[:, 1]
+            areas = np.diff(x) * (y[1:] + y[:-1]) / 2
+            # Leave out the pairs of rows that belong to different members
+            boundaries = self.offsets[1:-1]
+            boundaries = boundaries[(boundaries > 0) & (boundaries < len(x))]
+            areas[boundaries - 1] = 0.0
+            cumulative = np.concatenate(([0.0], np.cumsum(areas)))
+            starts, ends = self.offsets[:-1][non_empty], self.offsets[1:][non_empty]
+            result[non_empty] = cumulative[ends - 1] - cumulative[starts]
+            return result
+
+        values = self.values[:, column]
+        starts = self.offsets[:-1][non_empty]
+        if method == 'min':
+            result[non_empty] = np.minimum.reduceat(values, starts)
+        elif method == 'max':
+            result[non_empty] = np.maximum.reduceat(values, starts)
+        else:
+            result[non_empty] = np.add.reduceat(values, starts)
+            if method == 'mean':
+                result[non_empty] /= lengths[non_empty]
+        return result
+
+    def resample(self, x=None, number_of_points=1000):
+        """Interpolate all the members onto a common x grid
+
+        All members are interpolated with a single call to :func:`numpy.interp`, by
+        shifting the x values of each member into its own interval. The x values of each
+        member must be ascending.
+
+        Args:
+            x (numpy.array): The common x grid. Default is None, which means
+                number_of_points evenly spaced points spanning the x values of all members
+            number_of_points (int): The number of points in the default grid
+
+        Returns:
+            tuple: The x grid and a 2-D array with one row of interpolated y values per
+                member. Points outside the x range of a member are NaN
+        """
+        member_x, member_y = self.values[:, 0], self.values[:, 1]
+        if x is None:
+            if len(member_x) == 0:
+                raise CinfdataError('Cannot make a default grid for a group with no rows')
+            x = np.linspace(member_x.min(), member_x.max(), number_of_points)
+        x = np.asarray(x, dtype=float)
+        resampled = np.full((len(self.ids), len(x)), np.nan)
+        lengths = self.lengths
+        non_empty = lengths > 0
+        if not non_empty.any():
+            return x, resampled
+
+        # Map the x values of member number i into [2i, 2i + 1]
+        x_low = min(member_x.min(), x.min())
+        x_span = (max(member_x.max(), x.max()) - x_low) or 1.0
+        shifted_x = (member_x - x_low) / x_span + 2 * self.member_numbers
+        shifted_grid = (x - x_low) / x_span + 2 * np.arange(len(self.ids))[:, np.newaxis]
+        resampled[:] = np.interp(shifted_grid.ravel(), shifted_x, member_y)\
+            .reshape(resampled.shape)
+
+        # Blank out the points outside the x range of each member
+        first = np.full(len(self.ids), np.inf)
+        last = np.full(len(self.ids), -np.inf)
+        first[non_empty] = member_x[self.offsets[:-1][non_empty]]
+        last[non_empty] = member_x[self.offsets[1:][non_empty] - 1]
+        outside = (x < first[:, np.newaxis]) | (x > last[:, np.newaxis])
+        resampled[outside] = np.nan
+        return x, resampled
+
+
+def use_labels_in_groups(data_group, metadata_group, label_column):
+    """Create new data and metadata groups that use labels as columns"""
+    # Check for repeated labels
+    labels = [metadata[label_column] for metadata in metadata_group.values()]
+    if len(labels) != len(set(labels)):
+        msg = "Cannot change keys to labels because the labels are not unique"
+        raise CinfdataError(msg)
+
+    data_group_label = {metadata_group[id_][label_column]: data
+                        for id_, data in data_group.items()}
+    metadata_group_label = {metadata_group[id_][label_column]: metadata
+                            for id_, metadata in metadata_group.items()}
+    return data_group_label, metadata_group_label
+
+
+def _slice_x_range(data, x_min, x_max, x_ascending=True):
+    """Return the rows of data with x from x_min to x_max
+
+    If x is ascending, the rows are found by binary search. Only the rows around the
+    bisection points are read, so this is cheap for memory mapped data. Otherwise all x
+    are compared to the limits.
+    """
+    x = data[:, 0]
+    if not x_ascending:
+        selection = np.ones(len(data), dtype=bool)
+        if x_min is not None:
+            selection &= x >= x_min
+        if x_max is not None:
+            selection &= x <= x_max
+        return data[selection]
+    start = 0 if x_min is None else np.searchsorted(x, x_min, side='left')
+    end = len(data) if x_max is None else np.searchsorted(x, x_max, side='right')
+    return data[start:end]
+
+
+def pyramid_depth(number_of_rows, min_rows):
+    """Return the number of levels in the pyramid of a dataset, see :func:`build_pyramid`"""
+    depth = 0
+    while number_of_rows > min_rows:
+        number_of_rows = (number_of_rows + 1) // 2
+        depth += 1
+    return depth
+
+
+def build_pyramid(data, min_rows):
+    """Build a min/max/mean pyramid of an x, y dataset
+
+    Level k of the pyramid reduces each bucket of 2**k consecutive rows of data (the last
+    one may be shorter) to a row of: the first x, the minimum y, the maximum y and the
+    mean y. Each level is calculated from the one below it, so building all levels
+    takes about two passes over the data.
+
+    Args:
+        data (numpy.array): The data, with x and y as columns
+        min_rows (int): Stop after the first level with no more than this number of rows
+
+    Returns:
+        list: The levels as (N, 4) arrays, starting with level 1
+    """
+    x = data[:, 0]
+    y_min = y_max = y_sum = data[:, 1]
+    counts = np.ones(len(data))
+    levels = []
+    while len(x) > min_rows:
+        starts = np.arange(0, len(x), 2)
+        x = x[starts]
+        y_min = np.fmin.reduceat(y_min, starts)
+        y_max = np.fmax.reduceat(y_max, starts)
+        y_sum = np.add.reduceat(y_sum, starts)
+        counts = np.add.reduceat(counts, starts)
+        levels.append(np.column_stack((x, y_min, y_max, y_sum / counts)))
+    return levels
+
+
+def _merge_bucket_pairs(level):
+    """Merge pairs of rows of a pyramid level into the rows of the level above
+
+    Args:
+        level (numpy.array): Rows of x, minimum y, maximum y and mean y of complete
+            buckets, an even number of them
+
+    Returns:
+        numpy.array: The rows of the buckets of twice the size
+    """
+    first, second = level[0::2], level[1::2]
+    return np.column_stack((first[:, 0], np.fmin(first[:, 1], second[:, 1]),
+                            np.fmax(first[:, 2], second[:, 2]),
+                            (first[:, 3] + second[:, 3]) / 2))
+
+
+def _reduce_bucket(rows):
+    """Reduce the x, y rows of a bucket to a pyramid row, see :func:`build_pyramid`"""
+    y = rows[:, 1]
+    return np.array([[rows[0, 0], np.fmin.reduce(y), np.fmax.reduce(y), y.mean()]])
+
+
+DOWNSAMPLING_METHODS = ('minmax', 'lttb', 'mean')
+
+
+def downsample(data, max_points, method='minmax'):
+    """Downsample an x, y dataset to at most max_points points
+
+    The rows are split into buckets of (almost) equal numbers of consecutive rows and
+    each bucket is reduced according to method:
+
+    * 'minmax': Keeps the rows with the lowest and the highest y value of each of
+      max_points / 2 buckets, in the original order. This preserves peaks and is the
+      best choice for plots
+    * 'lttb': Largest-Triangle-Three-Buckets, keeps the first and the last row and
+      from each of the max_points - 2 buckets in between, the row that forms the
+      largest triangle with the previously kept row and the average of the next bucket
+    * 'mean': The mean of x and y of each of max_points buckets
+
+    Args:
+        data (numpy.array): The data, with x and y as columns
+        max_points (int): The maximum number of points to return
+        method (str): One of 'minmax' (default), 'lttb' or 'mean'
+
+    Returns:
+        numpy.array: The downsampled data, or data itself if it has no more than
+            max_points rows
+    """
+    if method not in DOWNSAMPLING_METHODS:
+        msg = 'The method \'{}\' is invalid. Only {} are allowed.'
+        raise CinfdataError(msg.format(method, DOWNSAMPLING_METHODS))
+    minimum_points = 3 if method == 'lttb' else 2 if method == 'minmax' else 1
+    if max_points < minimum_points:
+        msg = 'max_points must be at least {} for the method \'{}\''
+        raise CinfdataError(msg.format(minimum_points, method))
+    number_of_rows = len(data)
+    if number_of_rows <= max_points:
+        return data
+
+    if method == 'mean':
+        starts = np.linspace(0, number_of_rows, max_points + 1).astype(np.intp)
+        sums = np.add.reduceat(data, starts[:-1], axis=0)
+        return sums / np.diff(starts)[:, np.newaxis]
+
+    if method == 'minmax':
+        starts = np.linspace(0, number_of_rows, max_points // 2 + 1).astype(np.intp)
+        bucket_of_row = np.repeat(np.arange(len(starts) - 1), np.diff(starts))
+        y = data[:, 1]
+        rows = []
+        for reduce_function in (np.fmin, np.fmax):
+            extrema = reduce_function.reduceat(y, starts[:-1])
+            candidates = np.flatnonzero(y == extrema[bucket_of_row])
+            # Keep the first candidate of each bucket
+            first = np.flatnonzero(np.diff(bucket_of_row[candidates], prepend=-1))
+            rows.append(candidates[first])
+        return data[np.unique(np.concatenate(rows))]
+
+    # Largest-Triangle-Three-Buckets. The first and last row are always kept.
+    starts = np.linspace(1, number_of_rows - 1, max_points - 1).astype(np.intp)
+    means = np.add.reduceat(data[:-1], starts[:-1], axis=0) / np.diff(starts)[:, np.newaxis]
+    means = np.concatenate((means[1:], data[-1:]))
+    rows = np.empty(max_points, dtype=np.intp)
+    rows[0], rows[-1] = 0, number_of_rows - 1
+    for bucket_number in range(max_points - 2):
+        start, end = starts[bucket_number], starts[bucket_number + 1]
+        previous_x, previous_y = data[rows[bucket_number]]
+        mean_x, mean_y = means[bucket_number]
+        bucket = data[start:end]
+        # Twice the area of the triangles, the constant factor does not matter
+        areas = np.abs((previous_x - mean_x) * (bucket[:, 1] - previous_y) -
+                       (previous_x - bucket[:, 0]) * (mean_y - previous_y))
+        rows[bucket_number + 1] = start + np.argmax(areas)
+    return data[rows]
+
+
+class CinfdataCacheError(CinfdataError):
+    """Exception for Cinfdata Cache related errors"""
+
+
+def _replace_file(source, destination):
+    """Rename source to destination, replacing destination if it exists"""
+    if hasattr(os, 'replace'):
+        os.replace(source, destination)
+    else:
+        # Python 2, where rename only replaces an existing file on POSIX
+        if os.name == 'nt' and path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+
+
+def _new_file_mode():
+    """Return the mode open gives new files, i.e. 0o666 without the bits in the umask
+
+    The umask can only be read by setting it, so this is done once at import.
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+NEW_FILE_MODE = _new_file_mode()
+
+
+@contextmanager
+def atomic_write(filepath, mode='wb'):
+    """Context manager that yields a file object, whose content replaces filepath
+
+    The content is written to a temporary file in the same directory, which is renamed
+    to filepath when the block is left without an exception (and removed otherwise). A
+    reader, also in another process, therefore sees either the old or the new file,
+    never a partially written one. The new file gets the permissions of the file it
+    replaces, or those open would give a new file, so that a cache dir stays shared.
+
+    Args:
+        filepath (str): The path of the file to write
+        mode (str): The mode to open the temporary file in, 'wb' or 'w'
+    """
+    directory, filename = path.split(filepath)
+    file_descriptor, temporary_path = tempfile.mkstemp(
+        dir=directory, prefix='.{}.'.format(filename), suffix='.tmp'
+    )
+    try:
+        with os.fdopen(file_descriptor, mode) as file_:
+            # mkstemp creates the file with access for the owner only
+            try:
+                file_mode = stat.S_IMODE(os.stat(filepath).st_mode)
+            except OSError:
+                file_mode = NEW_FILE_MODE
+            os.chmod(temporary_path, file_mode)
+            yield file_
+        _replace_file(temporary_path, filepath)
+    except BaseException:
+        if path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+class FileLock(object):
+    """Advisory lock on a lock file, which serializes writers across processes
+
+    The lock is taken with :func:`fcntl.flock` on POSIX and :func:`msvcrt.locking` on
+    Windows. Within a process it is reentrant and also serializes threads. Only code
+    that takes the same lock is affected, it does not prevent other access to the files.
+    """
+
+    def __init__(self, filepath):
+        """Initialize local variables
+
+        Args:
+            filepath (str): The path of the lock file, which is created if necessary
+        """
+        self.filepath = filepath
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file_descriptor = None
+
+    def acquire(self):
+        """Acquire the lock, blocking until it is available"""
+        self._lock.acquire()
+        if self._depth == 0:
+            # The lock file is opened on every acquire, so that processes forked while
+            # the file is open, do not share the lock with the parent
+            try:
+                self._file_descriptor = os.open(self.filepath, os.O_RDWR | os.O_CREAT, 0o666)
+                self._lock_file()
+            except (IOError, OSError) as exception:
+                if self._file_descriptor is not None:
+                    os.close(self._file_descriptor)
+                    self._file_descriptor = None
+                self._lock.release()
+                message = 'Unable to lock the cache lock file: {}\n{}'
+                raise CinfdataCacheError(message.format(self.filepath, exception))
+        self._depth += 1
+
+    def _lock_file(self):
+        """Lock the open lock file"""
+        if fcntl is not None:
+            fcntl.flock(self._file_descriptor, fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            os.lseek(self._file_descriptor, 0, os.SEEK_SET)
+            while True:
+                # LK_LOCK gives up with an error after trying for 10 seconds
+                try:
+                    msvcrt.locking(self._file_descriptor, msvcrt.LK_LOCK, 1)
+                    break
+                except (IOError, OSError):
+                    pass
+
+    def release(self):
+        """Release the lock"""
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(self._file_descriptor, fcntl.LOCK_UN)
+                elif msvcrt is not None:
+                    os.lseek(self._file_descriptor, 0, os.SEEK_SET)
+                    msvcrt.locking(self._file_descriptor, msvcrt.LK_UNLCK, 1)
+            finally:
+                os.close(self._file_descriptor)
+                self._file_descriptor = None
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def _file_signature(filepath):
+    """Return a signature of a file, that changes when it is replaced or written to
+
+    Returns:
+        tuple: (inode, size, modification time) or None if the file does not exist
+    """
+    try:
+        file_stat = os.stat(filepath)
+    except OSError:
+        return None
+    return file_stat.st_ino, file_stat.st_size, file_stat.st_mtime
+
+
+class PickleInfoitemStore(object):
+    """Infoitem store that keeps all infoitems in a dict, which is saved as a single pickle
+
+    The entire dict is loaded when the store is opened and written out in full on every
+    save, which makes it simple, but slow for large caches.
+
+    Several processes can share the store. The pickle is written atomically, under a
+    lock on ``infoitem.lock``, and if another process has written it since it was read,
+    it is read again and the unwritten infoitems of this process are merged into it
+    before writing. A missing infoitem is also looked for in a pickle that has been
+    written by another process.
+    """
+
+    filename = 'infoitem.pickle'
+    lock_filename = 'infoitem.lock'
+
+    def __init__(self, setup_dir, cache_version):
+        """Load the infoitem dict from the setup dir if present
+
+        Args:
+            setup_dir (str): The cache directory for the setup
+            cache_version (int): The cache version to write into a new store
+        """
+        self.infoitem_file = path.join(setup_dir, self.filename)
+        self.file_lock = FileLock(path.join(setup_dir, self.lock_filename))
+        # Infoitems that are updated, but not yet written, as group name -> {key: value}
+        self._updates = {}
+        self._file_signature = None
+        self.infoitem = {
+            'general': {'cache_version': cache_version},
+            'metadata': {},
+            'groups': {},
+            'signatures': {},
+        }
+        if path.exists(self.infoitem_file):
+            self._read_infoitems_from_file()
+
+    def _read_infoitems_from_file(self):
+        """Read the infoitem dict from file and apply the unwritten updates to it"""
+        error = None
+        try:
+            start = time()
+            signature = _file_signature(self.infoitem_file)
+            with open(self.infoitem_file, 'rb') as file_:
+                infoitem = pickle.load(file_)
+            LOG.debug('Loaded infoitem dict in %s s', time() - start)
+        except IOError:
+            error = 'The file: {}\nwhich is needed for the cache, exists, but is '\
+                    'not readable'
+        except (pickle.UnpicklingError, EOFError):
+            error = 'Loading and interpreting the infoitem file: {}\nfailed. '\
+                    'Please report this as a bug.'
+        if error is not None:
+            raise CinfdataCacheError(error.format(self.infoitem_file))
+        for group_name, updates in self._updates.items():
+            infoitem.setdefault(group_name, {}).update(updates)
+        self.infoitem = infoitem
+        self._file_signature = signature
+
+    def _reread_if_changed(self):
+        """Read the infoitem dict again, if the file has been written by another process
+
+        Returns:
+            bool: Whether the dict was read again
+        """
+        signature = _file_signature(self.infoitem_file)
+        if signature is None or signature == self._file_signature:
+            return False
+        self._read_infoitems_from_file()
+        return True
+
+    def has(self, group_name, key):
+        """Return whether the store contains an infoitem"""
+        if group_name in self.infoitem and key in self.infoitem[group_name]:
+            return True
+        if self._reread_if_changed():
+            return group_name in self.infoitem and key in self.infoitem[group_name]
+        return False
+
+    def load(self, group_name, key):
+        """Load an infoitem
+
+        Raises:
+            KeyError: If the infoitem is not in the store
+        """
+        if not self.has(group_name, key):
+            raise KeyError(key)
+        return self.infoitem[group_name][key]
+
+    def update(self, group_name, infoitems):
+        """Add a mapping of keys to infoitems to a group, without writing to file"""
+        self.infoitem.setdefault(group_name, {}).update(infoitems)
+        self._updates.setdefault(group_name, {}).update(infoitems)
+
+    def flush(self):
+        """Merge the updates into the infoitem file, if there are any"""
+        if self._updates:
+            with self.file_lock:
+                self._reread_if_changed()
+                self._save_infoitems_to_file()
+            self._updates = {}
+
+    def save(self, group_name, infoitems):
+        """Save a mapping of keys to infoitems in a group and write the dict to file"""
+        self.update(group_name, infoitems)
+        self.flush()
+
+    def _save_infoitems_to_file(self):
+        """Save the infoitem dict to file"""
+        error = None
+        try:
+            with atomic_write(self.infoitem_file) as file_:
+                pickle.dump(self.infoitem, file_)
+            self._file_signature = _file_signature(self.infoitem_file)
+        except (IOError, OSError):
+            error = 'The file: {}\nwhich is needed by the cache is not writable. '\
+                    'Check the file permissions.'.format(self.infoitem_file)
+        except pickle.PickleError:
+            error = 'Python was unable to save the infoitem dict. Report this as a bug.'
+        if error is not None:
+            raise CinfdataCacheError(error)
+
+
+def _normalize_key(key):
+    """Normalize an infoitem key, so that equal keys always pickle to the same bytes"""
+    if isinstance(key, tuple):
+        return tuple(_normalize_key(item) for item in key)
+    if isinstance(key, numbers.Integral) and not isinstance(key, bool):
+        return int(key)
+    return key
+
+
+class SqliteInfoitemStore(object):
+    """Infoitem store that keeps each infoitem as a row in a sqlite3 table
+
+    Infoitems are looked up on demand through the primary key, so opening the store does
+    not depend on its size and saving an infoitem only writes that row. sqlite takes
+    care of locking, so several processes can share the store.
+    """
+
+    filename = 'infoitem.sqlite'
+    # Seconds to wait for a write lock on the database held by another process
+    timeout = 60.0
+
+    def __init__(self, setup_dir, cache_version):
+        """Open (and possibly create) the infoitem database in the setup dir
+
+        If the database is new and the setup dir contains an infoitem pickle from a
+        :class:`PickleInfoitemStore`, the content of that is migrated into the database
+        and the pickle is renamed to ``infoitem.pickle.migrated``.
+
+        Args:
+            setup_dir (str): The cache directory for the setup
+            cache_version (int): The cache version to write into a new store
+        """
+        if sqlite3 is None:
+            raise CinfdataCacheError('The sqlite infoitem backend requires the sqlite3 '
+                                     'module, which is not available')
+        self.infoitem_file = path.join(setup_dir, self.filename)
+        # Rows that are updated, but not yet written, keyed by (group_name, encoded key)
+        self._pending = {}
+        try:
+            self.connection = sqlite3.connect(self.infoitem_file, timeout=self.timeout,
+                                              check_same_thread=False)
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS infoitems (group_name TEXT NOT NULL, '
+                'key BLOB NOT NULL, value BLOB NOT NULL, PRIMARY KEY (group_name, key))'
+            )
+        except sqlite3.Error as exception:
+            message = 'The infoitem database: {}\ncould not be opened: {}'
+            raise CinfdataCacheError(message.format(self.infoitem_file, exception))
+
+        # Lock, so only one of several processes opening a new store fills it
+        with FileLock(path.join(setup_dir, PickleInfoitemStore.lock_filename)):
+            try:
+                is_new = self.connection.execute(
+                    'SELECT COUNT(*) FROM infoitems').fetchone()[0] == 0
+            except sqlite3.Error as exception:
+                message = 'The infoitem database: {}\ncould not be read: {}'
+                raise CinfdataCacheError(message.format(self.infoitem_file, exception))
+            if is_new:
+                pickle_file = path.join(setup_dir, PickleInfoitemStore.filename)
+                if path.exists(pickle_file):
+                    self._migrate_from_pickle(pickle_file, setup_dir, cache_version)
+                else:
+                    self.save('general', {'cache_version': cache_version})
+
+    def _migrate_from_pickle(self, pickle_file, setup_dir, cache_version):
+        """Copy all infoitems from a pickle infoitem file into the database"""
+        start = time()
+        infoitem = PickleInfoitemStore(setup_dir, cache_version).infoitem
+        rows = [(group_name, self._encode_key(key), self._encode_value(value))
+                for group_name, group in infoitem.items()
+                for key, value in group.items()]
+        self._write_rows(rows)
+        os.rename(pickle_file, pickle_file + '.migrated')
+        LOG.info('Migrated %s infoitems from %s in %0.4e s', len(rows), pickle_file,
+                 time() - start)
+
+    @staticmethod
+    def _encode_key(key):
+        """Encode an infoitem key for the key column"""
+        return sqlite3.Binary(pickle.dumps(_normalize_key(key), 2))
+
+    @staticmethod
+    def _encode_value(value):
+        """Encode an infoitem for the value column"""
+        return sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def _write_rows(self, rows):
+        """Write (group_name, key, value) rows in a single transaction"""
+        try:
+            with self.connection:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO infoitems VALUES (?, ?, ?)', rows
+                )
+        except sqlite3.Error as exception:
+            message = 'Writing to the infoitem database: {}\nfailed: {}'
+            raise CinfdataCacheError(message.format(self.infoitem_file, exception))
+
+    def _select_value(self, group_name, key):
+        """Return the encoded value of an infoitem or None"""
+        encoded_key = self._encode_key(key)
+        if (group_name, encoded_key) in self._pending:
+            return self._pending[(group_name, encoded_key)][2]
+        row = self.connection.execute(
+            'SELECT value FROM infoitems WHERE group_name=? AND key=?',
+            (group_name, encoded_key)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def has(self, group_name, key):
+        """Return whether the store contains an infoitem"""
+        return self._select_value(group_name, key) is not None
+
+    def load(self, group_name, key):
+        """Load an infoitem
+
+        Raises:
+            KeyError: If the infoitem is not in the store
+        """
+        value = self._select_value(group_name, key)
+        if value is None:
+            raise KeyError(key)
+        return pickle.loads(bytes(value))
+
+    def update(self, group_name, infoitems):
+        """Add a mapping of keys to infoitems to a group, without writing to the database"""
+        for key, value in infoitems.items():
+            encoded_key = self._encode_key(key)
+            self._pending[(group_name, encoded_key)] = \
+                (group_name, encoded_key, self._encode_value(value))
+
+    def flush(self):
+        """Write all pending infoitems to the database in a single transaction"""
+        if self._pending:
+            self._write_rows(list(self._pending.values()))
+            self._pending = {}
+
+    def save(self, group_name, infoitems):
+        """Save a mapping of keys to infoitems in a group in a single transaction"""
+        self.update(group_name, infoitems)
+        self.flush()
+
+
+# Compressors for the data cache, as (compress, decompress) function pairs
+COMPRESSORS = {
+    'zlib': (lambda buffer_: zlib.compress(buffer_, 6), zlib.decompress),
+    'zlib1': (lambda buffer_: zlib.compress(buffer_, 1), zlib.decompress),
+}
+if bz2 is not None:
+    COMPRESSORS['bz2'] = (bz2.compress, bz2.decompress)
+if lzma is not None:
+    COMPRESSORS['lzma'] = (lzma.compress, lzma.decompress)
+# Filters that can be applied before compression
+COMPRESSION_FILTERS = ('delta', 'shuffle')
+COMPRESSED_MAGIC = b'CINFZ\x01'
+
+
+def parse_compression(compression):
+    """Parse and validate a compression specification
+
+    A compression specification is the name of a compressor, optionally preceded by
+    filters separated by '+', e.g. 'zlib', 'shuffle+zlib' or 'delta+shuffle+lzma'. The
+    filters are applied in the order given, to each column of the data separately:
+
+    * 'delta' replaces each value with the difference of its bit pattern from the
+      previous one, which is lossless and turns smooth series into small numbers
+    * 'shuffle' groups the bytes by significance, so that e.g. all the exponent bytes of
+      a column of floats are next to each other
+
+    Args:
+        compression (str): The compression specification
+
+    Returns:
+        tuple: (filters, compressor name)
+
+    Raises:
+        CinfdataCacheError: If the specification is invalid
+    """
+    parts = compression.split('+')
+    filters, compressor = parts[:-1], parts[-1]
+    if compressor not in COMPRESSORS:
+        message = 'The compressor \'{}\' is invalid or not available. Only {} are allowed.'
+        raise CinfdataCacheError(message.format(compressor, sorted(COMPRESSORS.keys())))
+    for filter_ in filters:
+        if filter_ not in COMPRESSION_FILTERS:
+            message = 'The compression filter \'{}\' is invalid. Only {} are allowed.'
+            raise CinfdataCacheError(message.format(filter_, COMPRESSION_FILTERS))
+    # Delta works on whole values, so it must come before the byte shuffle
+    if sorted(filters, key=COMPRESSION_FILTERS.index) != filters or \
+            len(set(filters)) != len(filters):
+        message = 'The compression filters must be used at most once each, in the order {}'
+        raise CinfdataCacheError(message.format(COMPRESSION_FILTERS))
+    return filters, compressor
+
+
+def encode_array(data, compression):
+    """Encode an array as compressed bytes
+
+    The bytes consist of a magic string, a header with shape, dtype and the compression
+    specification and then the compressed data. See :func:`parse_compression` for the
+    format of the compression specification.
+
+    Args:
+        data (numpy.array): The (non-object) array to encode
+        compression (str): The compression specification
+
+    Returns:
+        bytes: The encoded array
+    """
+    filters, compressor = parse_compression(compression)
+    # Transpose 2D arrays, so that the filters works on one column at a time
+    columns = np.ascontiguousarray(data.T if data.ndim == 2 else data)
+    if 'delta' in filters and data.dtype.itemsize in (1, 2, 4, 8):
+        integers = columns.view('<u{}'.format(data.dtype.itemsize))
+        deltas = integers.copy()
+        deltas[..., 1:] -= integers[..., :-1]
+        columns = deltas
+    filtered = columns.view(np.uint8).reshape(columns.shape + (data.dtype.itemsize,))
+    if 'shuffle' in filters:
+        filtered = np.moveaxis(filtered, -1, -2)
+    header = repr({
+        'descr': np.lib.format.dtype_to_descr(data.dtype),
+        'shape': data.shape,
+        'compression': compression,
+    }).encode('ascii')
+    payload = COMPRESSORS[compressor][0](np.ascontiguousarray(filtered).tobytes())
+    return COMPRESSED_MAGIC + struct.pack('<I', len(header)) + header + payload
+
+
+def decode_array(buffer_):
+    """Decode an array encoded with :func:`encode_array`
+
+    Args:
+        buffer_ (bytes): The encoded array
+
+    Returns:
+        numpy.array: The decoded array
+    """
+    if not buffer_.startswith(COMPRESSED_MAGIC):
+        raise CinfdataCacheError('Unable to decode array, the data is not compressed data')
+    header_start = len(COMPRESSED_MAGIC) + 4
+    header_length = struct.unpack('<I', buffer_[len(COMPRESSED_MAGIC): header_start])[0]
+    header = literal_eval(buffer_[header_start: header_start + header_length]
+                          .decode('ascii'))
+    filters, compressor = parse_compression(header['compression'])
+    dtype = np.dtype(header['descr'])
+    shape = tuple(header['shape'])
+    columns_shape = shape[::-1] if len(shape) == 2 else shape
+
+    raw = COMPRESSORS[compressor][1](buffer_[header_start + header_length:])
+    filtered = np.frombuffer(raw, dtype=np.uint8)
+    # Undo the filters in reverse order
+    if 'shuffle' in filters:
+        shuffled_shape = columns_shape[:-1] + (dtype.itemsize, columns_shape[-1])
+        filtered = np.moveaxis(filtered.reshape(shuffled_shape), -1, -2)
+    filtered = np.ascontiguousarray(filtered).reshape(-1)
+    if 'delta' in filters and dtype.itemsize in (1, 2, 4, 8):
+        deltas = filtered.view('<u{}'.format(dtype.itemsize)).reshape(columns_shape)
+        filtered = np.cumsum(deltas, axis=-1, dtype=deltas.dtype).view(np.uint8)
+    columns = np.frombuffer(filtered.tobytes(), dtype=dtype).reshape(columns_shape)
+    return np.ascontiguousarray(columns.T) if len(shape) == 2 else columns.copy()
+
+
+class NpyDataStore(object):
+    """Data store that saves each dataset as a .npy file in the data dir
+
+    If compression is used, the datasets are instead saved as .cinfz files, which
+    contains an array encoded with :func:`encode_array`. Both kinds of files are loaded
+    transparently.
+
+    The files are written atomically, so several processes can save into the same data
+    dir and a reader never sees a partially written dataset. Appending in place is
+    serialized with a lock on ``append.lock``.
+    """
+
+    compressed_extension = '.cinfz'
+    lock_filename = 'append.lock'
+
+    def __init__(self, data_dir, mmap_mode=None, compression=None):
+        """Initialize local variables
+
+        Args:
+            data_dir (str): The directory to save the .npy files in
+            mmap_mode (str): The mmap_mode to use with :func:`numpy.load`. Has no effect
+                on compressed datasets
+            compression (str): The compression specification for saving datasets (see
+                :func:`parse_compression`) or None for uncompressed .npy files
+        """
+        self.data_dir = data_dir
+        self.mmap_mode = mmap_mode
+        if compression is not None:
+            parse_compression(compression)
+        self.compression = compression
+        self.file_lock = FileLock(path.join(data_dir, self.lock_filename))
+
+    def _filepath(self, key, compressed=False):
+        """Return the file path for key"""
+        extension = self.compressed_extension if compressed else '.npy'
+        return path.join(self.data_dir, '{}{}'.format(key, extension))
+
+    def keys(self):
+        """Return the keys of all datasets in the store, as strings"""
+        keys = []
+        for filename in os.listdir(self.data_dir):
+            for extension in ('.npy', self.compressed_extension):
+                if filename.endswith(extension):
+                    keys.append(filename[:-len(extension)])
+        return keys
+
+    def has(self, key):
+        """Return whether the store contains a dataset for key"""
+        return path.exists(self._filepath(key)) or \
+            path.exists(self._filepath(key, compressed=True))
+
+    def save(self, key, data):
+        """Save a dataset and return the file path"""
+        compressed = self.compression is not None
+        filepath = self._filepath(key, compressed=compressed)
+        with atomic_write(filepath) as file_:
+            if compressed:
+                file_.write(encode_array(data, self.compression))
+            else:
+                np.save(file_, data)
+
+        # Remove a possible copy in the other format
+        other_filepath = self._filepath(key, compressed=not compressed)
+        if path.exists(other_filepath):
+            try:
+                os.remove(other_filepath)
+            except OSError:
+                # Removed by another process in the meantime
+                pass
+        return filepath
+
+    def append(self, key, rows, number_of_rows=None):
+        """Append rows to an uncompressed dataset in place
+
+        The rows are written at the end of the .npy file and the shape in the header is
+        updated, which is possible as long as the new header fits in the padding of the
+        old one.
+
+        Args:
+            key (object): The key of the dataset
+            rows (numpy.array): The rows to append
+            number_of_rows (int): If not None, only append if the dataset has this number
+                of rows, i.e. has not been changed by another process
+
+        Returns:
+            bool: Whether the rows were appended
+        """
+        filepath = self._filepath(key)
+        if not path.exists(filepath):
+            return False
+        with self.file_lock:
+            return self._append(filepath, rows, number_of_rows)
+
+    @staticmethod
+    def _append(filepath, rows, number_of_rows):
+        """Append rows to the .npy file at filepath, see :meth:`append`"""
+        with open(filepath, 'r+b') as file_:
+            version = np.lib.format.read_magic(file_)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file_)
+                prefix_length = 10
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file_)
+                prefix_length = 12
+            data_start = file_.tell()
+            if fortran_order or dtype.fields is not None or dtype != rows.dtype or \
+                    len(shape) != 2 or shape[1:] != rows.shape[1:]:
+                return False
+            if number_of_rows is not None and shape[0] != number_of_rows:
+                return False
+
+            header = "{{'descr': '{}', 'fortran_order': False, 'shape': ({}, {}), }}"\
+                .format(dtype.str, shape[0] + len(rows), shape[1])
+            header_length = data_start - prefix_length
+            if len(header) + 1 > header_length:
+                return False
+
+            # Write the rows before the header, so an interrupted append leaves the old
+            # dataset intact
+            file_.seek(data_start + shape[0] * shape[1] * dtype.itemsize)
+            file_.write(np.ascontiguousarray(rows).tobytes())
+            file_.seek(prefix_length)
+            file_.write(header.ljust(header_length - 1).encode('latin1') + b'\n')
+        return True
+
+    def load(self, key):
+        """Load a dataset or return None if it is not in the store"""
+        # Form filepath and check if the file exists
+        filepath = self._filepath(key)
+        compressed = not path.exists(filepath)
+        if compressed:
+            filepath = self._filepath(key, compressed=True)
+            if not path.exists(filepath):
+                return None
 
-        return data
+        # Try and load the file and raise error is it fails
+        try:
+            if compressed:
+                with open(filepath, 'rb') as file_:
+                    return decode_array(file_.read())
+            return np.load(filepath, mmap_mode=self.mmap_mode)
+        except IOError:
+            message = 'The cache file:\n{}\nexists, but could not be loaded. '\
+                      'Check file permissions'
+            raise CinfdataCacheError(message.format(filepath))
 
-    def get_metadata(self, measurement_id):
-        """Get metadata for measurement_id"""
-        # Check if the metadata is in the cache
-        metadata = None
-        if self.cache:
-            if self.cache.has_infoitem('metadata', measurement_id):
-                metadata = self.cache.load_infoitem('metadata', measurement_id)
+    def load_many(self, keys):
+        """Load several datasets and return a dict with the ones that are in the store"""
+        datas = {}
+        for key in keys:
+            data = self.load(key)
+            if data is not None:
+                datas[key] = data
+        return datas
 
 
-        # Try and get the metadata from the database
-        if metadata is None and self.cursor is not None:
-            # Get the data
-            start = time()
-            self.cursor.execute(self.metadata_query, (measurement_id,))
-            metadata_raw = self.cursor.fetchall()
-            LOG.debug('Fetched metadata for id %s from database in %0.4e s',
-                      measurement_id, time() - start)
+class ChunkedDataStore(object):
+    """Data store that packs many datasets into large chunk files
 
-            # Raise error if there was not exactly 1 line
-            if len(metadata_raw) != 1:
-                raise CinfdataError('There was not exactly 1 row of metadata returned '
-                                    'for id {}'.format(measurement_id))
+    The raw bytes of each dataset are appended to the current chunk file and the
+    location is recorded in an append-only index file, with one line of::
 
-            # Convert metadata to dict
-            metadata = dict(zip(self.column_names, metadata_raw[0]))
+        key, chunk number, offset, shape, dtype[, compression, number of bytes]
 
-            # Save in cache if present
-            if self.cache:
-                self.cache.save_infoitem('metadata', measurement_id, metadata)
+    per dataset. The last two fields are present for datasets that are compressed with
+    :func:`encode_array`, and for uncompressed datasets that have room reserved after
+    them (then with an empty compression). This avoids having one small file per
+    measurement and allows a group of datasets to be read with a few sequential reads or
+    memory mapped. Saving a key again appends a new copy and the last index entry wins,
+    so the old bytes are left unused.
 
-        # Raise error if we could not find any metadata
-        if metadata is None:
-            raise CinfdataError('No metadata found for id {}'.format(measurement_id))
+    Rows are appended to an uncompressed dataset in place, if it is at the end of the
+    chunk file or has room reserved after it. Otherwise the dataset is moved, without
+    compression, to the end of the current chunk with as much room again reserved, so
+    that a growing dataset is only copied a logarithmic number of times.
 
-        # Convert to namedtuple if requested
-        if self._metadata_as_named_tuple:
-            metadata = self._metadata_named_tuple(**metadata)
+    Several processes can save into the same store. Writes to the chunk files and the
+    index are serialized with a lock on ``index.lock`` and the entries that other
+    processes have added to the index are read when a key is not found.
+    """
 
-        return metadata
+    index_filename = 'index'
+    lock_filename = 'index.lock'
+    chunk_filename = 'chunk_{:05d}.bin'
+    # Offsets of datasets are aligned to this number of bytes
+    alignment = 64
 
-    def get_data_group(self, group_id, grouping_column=None, label_column=None,
-                       scaling_factors=None):
-        """Get a data group
+    def __init__(self, chunk_dir, mmap_mode=None, chunk_size=256 * 1024 ** 2,
+                 compression=None):
+        """Initialize local variables and read the index
 
         Args:
-            group_id (object): The group id in the grouping column (can have
-                different types depending on the type of the grouping column)
-            grouping_column (str): The name of the column used for grouping
-                column (if different from __init__ value)
-            label_column (str): The name of the column that is used for the
-                label (if different from __init__ value)
-            scaling_factors (dict or sequence): If a sequence is given, it is assumed to
-                be a pair of x and y scaling factiors. Where each of the components can
-                be left out by giving a value of None. E.g: `(1E6, 1E-3)`, `(1E6, None)`
-                or `(None, 1e-3)`. If a dict if given, it is assumed to be mapping of
-                label values to scaling pairs as described above.
+            chunk_dir (str): The directory to keep the chunk files and index in
+            mmap_mode (str): If not None, load uncompressed datasets as memmaps with this
+                mode
+            chunk_size (int): Start a new chunk file when the current one would grow
+                beyond this number of bytes
+            compression (str): The compression specification for saving datasets (see
+                :func:`parse_compression`) or None to save the raw bytes
+        """
+        self.chunk_dir = chunk_dir
+        self.mmap_mode = mmap_mode
+        if compression is not None:
+            parse_compression(compression)
+        self.compression = compression
+        self.chunk_size = chunk_size
+        self.index_file = path.join(chunk_dir, self.index_filename)
+        self.file_lock = FileLock(path.join(chunk_dir, self.lock_filename))
+        self.is_new = not path.exists(self.index_file)
+        self._unwritten_index_lines = []
+        # The index entries of the unwritten lines, which take precedence over the file
+        self._unwritten_entries = {}
+        self.index = {}
+        self.current_chunk = 0
+        # The number of bytes of the index file that has been read
+        self._index_position = 0
+        if not self.is_new:
+            self._read_index()
 
-        Returns:
-            dict: Mapping of ids to data
+    def _read_index(self):
+        """Read the entries that have been added to the index file since the last read
 
+        An incomplete last line, that is still being written by another process, is
+        left for the next read.
         """
-        grouping_column = grouping_column if grouping_column is not None\
-                          else self.grouping_column
-        if grouping_column is None:
-            msg = ('A grouping_column must be given either in __init__ or in '
-                   'this method, in order to be able to get a group of data')
-            raise CinfdataError(msg)
-
-        group_key = (grouping_column, group_id)
+        start = time()
         try:
-            hash(group_key)
-        except TypeError:
-            msg = CinfdataError('group_id must be a immuteable type, not {}'.format(type(group_id)))
-
-        # See the group lookup is in the cache
-        ids = None
-        if self.cache and self.cache.has_infoitem('groups', group_key):
-            ids = self.cache.load_infoitem('groups', group_key)
-
-        # If not known already, try and get the group from the database
-        if ids is None and self.cursor is not None:
-            if grouping_column not in self.column_names:
-                raise CinfdataError(
-                    'Grouping column "{}" is not among the metadata column names {}'\
-                    .format(grouping_column, self.column_names)
+            with open(self.index_file, 'rb') as file_:
+                file_.seek(self._index_position)
+                content = file_.read()
+            complete_length = content.rfind(b'\n') + 1
+            for line in content[:complete_length].decode('utf-8').splitlines():
+                fields = line.split('\t')
+                key, chunk, offset, shape, dtype = fields[:5]
+                compression, nbytes = fields[5:] if len(fields) > 5 else (None, 0)
+                self.index[key] = (
+                    int(chunk), int(offset),
+                    tuple(int(dim) for dim in shape.split(',') if dim),
+                    np.dtype(literal_eval(dtype)), compression or None, int(nbytes),
                 )
-            self.cursor.execute(self.group_query.format(grouping_column), (group_id,))
-            ids = [row[0] for row in self.cursor.fetchall()]
-            if self.cache:
-                self.cache.save_infoitem('groups', group_key, ids)
+                self.current_chunk = max(self.current_chunk, int(chunk))
+            self._index_position += complete_length
+            self.index.update(self._unwritten_entries)
+        except (IOError, ValueError):
+            message = 'The chunked data store index:\n{}\nexists, but could not be read'
+            raise CinfdataCacheError(message.format(self.index_file))
+        LOG.debug('Read chunked data store index with %s entries in %0.4e s',
+                  len(self.index), time() - start)
 
-        # We need ids to proceed, so complain if they are not there
-        if ids is None:
-            raise CinfdataError('Unable to get ids for group, either from cache, '
-                                'database or both')
+    def refresh_index(self):
+        """Read the index entries that other processes have added since the last read
 
-        group_of_data = {}
-        for id_ in ids:
-            group_of_data[id_] = self.get_data(id_)
+        Returns:
+            bool: Whether there were new entries
+        """
+        try:
+            size = path.getsize(self.index_file)
+        except OSError:
+            return False
+        if size <= self._index_position:
+            return False
+        self._read_index()
+        return True
 
-        if scaling_factors is not None:
-            if isinstance(scaling_factors, dict):
-                # Make sure we have label_column
-                label_column = label_column if label_column is not None else self.label_column
-                if label_column is None:
-                    msg = ('A grouping_column must be given either in __init__ or in '
-                           'this method, in order to be able to scale based on label value')
-                    raise CinfdataError(msg)
+    def _chunk_path(self, chunk_number):
+        """Return the path of a chunk file"""
+        return path.join(self.chunk_dir, self.chunk_filename.format(chunk_number))
 
-                # Scale
-                for id_, data in group_of_data.items():
-                    metadata = self.get_metadata(id_)
-                    label = metadata[label_column]
-                    if label in scaling_factors:
-                        self._scale(data, scaling_factors[label])
+    def keys(self):
+        """Return the keys of all datasets in the store, as strings"""
+        self.refresh_index()
+        return list(self.index.keys())
 
-            else:
-                for data in group_of_data.values():
-                    self._scale(data, scaling_factors)
+    def has(self, key):
+        """Return whether the store contains a dataset for key"""
+        key = '{}'.format(key)
+        return key in self.index or (self.refresh_index() and key in self.index)
 
-        return group_of_data
+    def append(self, key, rows, number_of_rows=None):
+        """Append rows to a dataset, in place if possible
 
-    def get_metadata_group(self, group_id, grouping_column=None):
-        """Get a metadata group
+        The rows are written after an uncompressed dataset, if it is at the end of its
+        chunk file or has room reserved after it. Otherwise the dataset and the rows are
+        saved uncompressed at the end of the current chunk, with as much room again
+        reserved for later appends.
 
         Args:
-            group_id (object): The group id in the grouping column (can have
-                different types depending on the type of the grouping column)
-            grouping_column (str): The name of the column used for grouping
-                column (if different from __init__ value)
+            key (object): The key of the dataset
+            rows (numpy.array): The rows to append
+            number_of_rows (int): If not None, only append if the dataset has this number
+                of rows, i.e. has not been changed by another process
 
         Returns:
-            dict: Mapping of ids to metadata
-
+            bool: Whether the rows were appended. If False, the caller must save the
+                whole dataset again
         """
-        grouping_column = grouping_column if grouping_column is not None\
-                          else self.grouping_column
-        if grouping_column is None:
-            msg = ('A grouping_column must be given either in __init__ or in '
-                   'this method, in order to be able to get a group of metadata')
-            raise CinfdataError(msg)
+        key = '{}'.format(key)
+        rows = np.ascontiguousarray(rows)
+        with self.file_lock:
+            self.refresh_index()
+            entry = self.index.get(key)
+            if entry is None:
+                return False
+            chunk_number, offset, shape, dtype, compression, reserved = entry
+            if dtype != rows.dtype or len(shape) != 2 or shape[1:] != rows.shape[1:]:
+                return False
+            if number_of_rows is not None and shape[0] != number_of_rows:
+                return False
 
-        group_key = (grouping_column, group_id)
-        try:
-            hash(group_key)
-        except TypeError:
-            msg = CinfdataError('group_id must be a immuteable type, not {}'.format(type(group_id)))
+            new_shape = (shape[0] + len(rows), shape[1])
+            nbytes = shape[0] * shape[1] * dtype.itemsize
+            chunk_path = self._chunk_path(chunk_number)
+            in_place = False
+            if compression is None:
+                reserved = max(reserved, nbytes)
+                at_end = path.getsize(chunk_path) == offset + reserved and \
+                    offset + nbytes + rows.nbytes <= self.chunk_size
+                in_place = nbytes + rows.nbytes <= reserved or at_end
+            if in_place:
+                # Write the rows before the index entry, so that an interrupted append
+                # leaves the old dataset intact
+                with open(chunk_path, 'r+b') as file_:
+                    file_.seek(offset + nbytes)
+                    file_.write(rows.tobytes())
+                self._add_index_entry(key, chunk_number, offset, new_shape, dtype, None,
+                                      max(reserved, nbytes + rows.nbytes))
+            else:
+                with open(chunk_path, 'rb') as file_:
+                    data = self._read(file_, entry)
+                self._save_buffer(key, np.concatenate((data, rows)).tobytes(), new_shape,
+                                  dtype, None, reserve=True)
+            self.flush_index()
+        return True
 
-        # See if the group lookup is in the cache
-        ids = None
-        if self.cache and self.cache.has_infoitem('groups', group_key):
-            ids = self.cache.load_infoitem('groups', group_key)
+    def save(self, key, data, flush_index=True):
+        """Append a dataset to the current chunk and return the chunk file path
 
-        # If not known already, try and get the group from the database
-        if ids is None and self.cursor is not None:
-            if grouping_column not in self.column_names:
-                raise CinfdataError(
-                    'Grouping column "{}" is not among the metadata column names {}'\
-                    .format(grouping_column, self.column_names)
-                )
-            self.cursor.execute(self.group_query.format(grouping_column), (group_id,))
-            ids = [row[0] for row in self.cursor.fetchall()]
-            if self.cache:
-                self.cache.save_infoitem('groups', group_key, ids)
+        Args:
+            key (object): The key to save the data under
+            data (numpy.array): The data to save
+            flush_index (bool): Whether to write the index entry right away. If False,
+                :meth:`flush_index` must be called afterwards.
+        """
+        data = np.ascontiguousarray(data)
+        if self.compression is None:
+            buffer_ = data.tobytes()
+        else:
+            buffer_ = encode_array(data, self.compression)
+        chunk_path = self._save_buffer('{}'.format(key), buffer_, data.shape, data.dtype,
+                                       self.compression)
+        if flush_index:
+            self.flush_index()
+        return chunk_path
 
-        # We need ids to proceed, so complain if they are not there
-        if ids is None:
-            raise CinfdataError('Unable to get ids for group, either from cache, '
-                                'database or both')
+    def _save_buffer(self, key, buffer_, shape, dtype, compression, reserve=False):
+        """Append the bytes of a dataset to the current chunk and add its index entry
 
-        group_of_metadata = {}
-        for id_ in ids:
-            group_of_metadata[id_] = self.get_metadata(id_)
+        Args:
+            reserve (bool): Whether to reserve as many bytes again after the dataset, for
+                rows appended later
 
-        return group_of_metadata
+        Returns:
+            str: The path of the chunk file
+        """
+        reserved = 2 * len(buffer_) if reserve else len(buffer_)
+        with self.file_lock:
+            # Other processes may have moved on to a new chunk file
+            self.refresh_index()
+            while path.exists(self._chunk_path(self.current_chunk + 1)):
+                self.current_chunk += 1
+            chunk_path = self._chunk_path(self.current_chunk)
+            size = path.getsize(chunk_path) if path.exists(chunk_path) else 0
+            offset = size + (-size % self.alignment)
+            if size > 0 and offset + reserved > self.chunk_size:
+                self.current_chunk += 1
+                chunk_path = self._chunk_path(self.current_chunk)
+                size = offset = 0
 
+            with open(chunk_path, 'ab') as file_:
+                file_.write(b'\0' * (offset - size))
+                file_.write(buffer_)
+                if reserved > len(buffer_):
+                    file_.truncate(offset + reserved)
+        self._add_index_entry(key, self.current_chunk, offset, shape, dtype, compression,
+                              reserved if compression is None else len(buffer_))
+        return chunk_path
 
-    def _scale(self, data, scaling_factors):
-        """Scale columns in a data set with scaling factors
+    def _add_index_entry(self, key, chunk_number, offset, shape, dtype, compression,
+                         nbytes):
+        """Add an entry to the index, to be written by :meth:`flush_index`
 
         Args:
-            data (numpy.array): The data to scale
-            scaling_factors (sequence): Sequence of scaling factors e.g: (1E6, 1E-3). If
-                None is passed in an as a value, that column is not scaled e.g: (1E6, None)
-
-        Return:
-            numpy.array: Same array as data, but scaled. NOTE it is the same array, not a copy
+            nbytes (int): The number of bytes of a compressed dataset, or the number of
+                bytes reserved for an uncompressed dataset
         """
-        for column_number, scaling_factor in enumerate(scaling_factors):
-            if scaling_factor is not None:
-                data[:, column_number] *= scaling_factor
-        return data
+        self.index[key] = self._unwritten_entries[key] = (
+            chunk_number, offset, tuple(shape), dtype, compression, nbytes,
+        )
+        fields = [
+            key, str(chunk_number), str(offset), ','.join(str(dim) for dim in shape),
+            repr(np.lib.format.dtype_to_descr(dtype)),
+        ]
+        if compression is not None:
+            fields += [compression, str(nbytes)]
+        elif nbytes > int(np.prod(shape)) * dtype.itemsize:
+            fields += ['', str(nbytes)]
+        self._unwritten_index_lines.append('\t'.join(fields) + '\n')
 
+    def flush_index(self):
+        """Append all unwritten index entries to the index file"""
+        if self._unwritten_index_lines:
+            with self.file_lock:
+                with open(self.index_file, 'a') as file_:
+                    file_.write(''.join(self._unwritten_index_lines))
+            self._unwritten_index_lines = []
+            self._unwritten_entries = {}
 
-    @property
-    def column_names(self):
-        """Return the columns names from the measurements table"""
-        # Note, this could be done cleverer with a lazy property implementation, but it
-        # is more difficult to read
-        if self._column_names is not None:
-            return self._column_names
-
-        # Check if the column names is in the cache
-        if self.cache and self.cache.has_infoitem('general', 'column_names'):
-            self._column_names = self.cache.load_infoitem('general', 'column_names')
-            return self._column_names
-
-        # Try and get the column names from the database
-        if self.cursor is not None:
-            self.cursor.execute('DESCRIBE measurements_{}'.format(self.setup_name))
-            column_names = [item[0] for item in self.cursor.fetchall()]
-            # Add an fictitious column, which will contain time converted to unixtime
-            column_names.append('unixtime')
-
-            self._column_names = column_names
-            if self.cache:
-                self.cache.save_infoitem('general', 'column_names', column_names)
-            return column_names
+    def _read(self, file_, entry):
+        """Read a dataset from an open chunk file, or memory map it"""
+        chunk_number, offset, shape, dtype, compression, nbytes = entry
+        if compression is not None:
+            file_.seek(offset)
+            return decode_array(file_.read(nbytes))
+        if self.mmap_mode is not None:
+            return np.memmap(self._chunk_path(chunk_number), dtype=dtype,
+                             mode=self.mmap_mode, offset=offset, shape=shape)
+        file_.seek(offset)
+        count = int(np.prod(shape))
+        return np.fromfile(file_, dtype=dtype, count=count).reshape(shape)
 
-        raise CinfdataError('Column names not found')
+    def load(self, key):
+        """Load a dataset or return None if it is not in the store"""
+        return self.load_many([key]).get(key)
 
+    def load_many(self, keys):
+        """Load several datasets and return a dict with the ones that are in the store
 
-def use_labels_in_groups(data_group, metadata_group, label_column):
-    """Create new data and metadata groups that use labels as columns"""
-    # Check for repeated labels
-    labels = [metadata[label_column] for metadata in metadata_group.values()]
-    if len(labels) != len(set(labels)):
-        msg = "Cannot change keys to labels because the labels are not unique"
-        raise CinfdataError(msg)
+        The datasets are read in the order they are located in the chunk files, so that
+        a group saved together is read sequentially
+        """
+        if any('{}'.format(key) not in self.index for key in keys):
+            self.refresh_index()
+        locations = []
+        for key in keys:
+            entry = self.index.get('{}'.format(key))
+            if entry is not None:
+                locations.append((entry, key))
+        locations.sort(key=lambda location: location[0][:2])
 
-    data_group_label = {metadata_group[id_][label_column]: data
-                        for id_, data in data_group.items()}
-    metadata_group_label = {metadata_group[id_][label_column]: metadata
-                            for id_, metadata in metadata_group.items()}
-    return data_group_label, metadata_group_label
+        datas = {}
+        open_chunk_number, file_ = None, None
+        try:
+            for entry, key in locations:
+                chunk_number, compression = entry[0], entry[4]
+                needs_file = self.mmap_mode is None or compression is not None
+                if chunk_number != open_chunk_number and needs_file:
+                    if file_ is not None:
+                        file_.close()
+                    file_ = open(self._chunk_path(chunk_number), 'rb')
+                    open_chunk_number = chunk_number
+                datas[key] = self._read(file_, entry)
+        except IOError:
+            message = 'The cache chunk file:\n{}\nexists, but could not be loaded. '\
+                      'Check file permissions'
+            raise CinfdataCacheError(message.format(self._chunk_path(chunk_number)))
+        finally:
+            if file_ is not None:
+                file_.close()
+        return datas
 
 
-class CinfdataCacheError(CinfdataError):
-    """Exception for Cinfdata Cache related errors"""
+class Cache(object):
+    """Simple file based cache for cinf database loopkups
 
+    Statistics about the cache, like hits and misses, the number of bytes read and
+    written and the time spent on saving and loading, are kept in the stats attribute,
+    a :class:`Stats` instance.
 
-class Cache(object):
-    """Simple file based cache for cinf database loopkups"""
+    Several processes can use the same cache dir at the same time. All files are
+    written atomically or under a :class:`FileLock` and infoitems saved by different
+    processes are merged, see the data and infoitem stores for details.
+    """
 
     cache_version = 2
+    infoitem_groups = ('general', 'metadata', 'groups', 'signatures')
+    mmap_modes = (None, 'r')
+    infoitem_backends = {'pickle': PickleInfoitemStore, 'sqlite': SqliteInfoitemStore}
 
-    def __init__(self, cache_dir, setup_name):
-        """Initialize local variables"""
+    def __init__(self, cache_dir, setup_name, infoitem_backend='pickle',
+                 write_behind=False, flush_every=None, flush_interval=None,
+                 mmap_mode=None, data_layout='npy', compression=None):
+        """Initialize local variables
+
+        Args:
+            cache_dir (str): The directory to use for the cache. If None, a directory
+                named 'cache' next to this file is used
+            setup_name (str): The setup name, used as sub directory in the cache dir
+            infoitem_backend (str): The storage used for infoitems (metadata, groups
+                etc.). Either 'pickle' (default), which keeps all infoitems in a single
+                pickled dict that is rewritten on every save (see
+                :class:`PickleInfoitemStore`) or 'sqlite', which stores each infoitem as a
+                row in a sqlite3 database (see :class:`SqliteInfoitemStore`). An existing
+                pickle cache is migrated automatically the first time 'sqlite' is used.
+            write_behind (bool): If True, saved infoitems are kept in memory and only
+                written to disk by :meth:`flush`, which is called automatically when
+                flush_every or flush_interval is exceeded, when the cache is garbage
+                collected and at interpreter exit
+            flush_every (int): In write behind mode, flush after this many unflushed
+                infoitems. Default is None, meaning no limit
+            flush_interval (float): In write behind mode, flush on the first save that
+                happens more than this number of seconds after the last flush. Default
+                is None, meaning no limit
+            mmap_mode (str): The mmap_mode used when loading data with :func:`numpy.load`.
+                Default is None, meaning that the data is read into memory. Use 'r' to
+                get read only memory maps. Writeable memory maps are not allowed, since
+                changing the returned data would change the cache.
+            data_layout (str): How datasets are stored. Either 'npy' (default) for one
+                .npy file per measurement in the data dir or 'chunked' to pack them into
+                large chunk files in the chunks dir (see :class:`ChunkedDataStore`).
+                Existing .npy files are imported the first time 'chunked' is used.
+            compression (str): If not None, datasets are saved compressed according to
+                this compression specification, e.g. 'zlib' or 'delta+shuffle+zlib' (see
+                :func:`parse_compression`). Datasets are loaded transparently regardless
+                of how they were saved. Compressed datasets cannot be memory mapped.
+        """
         if cache_dir is None:
             this_dir = path.dirname(path.abspath(__file__))
             self.cache_dir = path.join(this_dir, 'cache')
         else:
             self.cache_dir = cache_dir
         LOG.info('Using cache dir: %s', self.cache_dir)
+        if mmap_mode not in self.mmap_modes:
+            message = 'The mmap mode \'{}\' is invalid. Only {} are allowed.'
+            raise CinfdataCacheError(message.format(mmap_mode, self.mmap_modes))
+        self.mmap_mode = mmap_mode
+        # Lock that serializes changes to the stores, so the cache can be shared between
+        # threads
+        self._lock = threading.RLock()
 
         # Form folder paths, subfolder for each setup and under that a subfolders for data
         self.setup_dir = path.join(self.cache_dir, setup_name)
         self.data_dir = path.join(self.setup_dir, 'data')
+        self.chunk_dir = path.join(self.setup_dir, 'chunks')
+        self.metadata_table_file = path.join(self.setup_dir, 'metadata_table.npy')
         dirs = [self.cache_dir, self.setup_dir, self.data_dir]
+        if data_layout == 'chunked':
+            dirs.append(self.chunk_dir)
         # Check permission on dirs and create them if possible
         self._check_and_create_dirs(dirs)
 
-        # Form infoitem file path and load if present
-        self.infoitem_file = path.join(self.setup_dir, 'infoitem.pickle')
-        if path.exists(self.infoitem_file):
-            error = None
-            try:
-                start = time()
-                with open(self.infoitem_file, 'rb') as file_:
-                    self.infoitem = pickle.load(file_)
-                LOG.debug('Loaded infoitem dict in %s s', time() - start)
-            except IOError:
-                error = 'The file: {}\nwhich is needed for the cache, exists, but is '\
-                        'not readable'
-            except pickle.UnpicklingError:
-                error = 'Loading and interpreting the infoitem file: {}\nfailed. '\
-                        'Please report this as a bug.'
-            if error is not None:
-                raise CinfdataCacheError(error.format(self.infoitem_file))
-
-            loaded_cache_version = self.infoitem.get('general', {}).get('cache_version', 1)
-            if loaded_cache_version < self.cache_version:
-                message = ('Your cache is of the older version {}, wheres cinfdata now '
-                           'uses {}. Please delete your cache dir and start building it '
-                           'from scratch.')
-                raise CinfdataError(message.format(loaded_cache_version, self.version))
+        # Open the data store
+        if data_layout == 'npy':
+            self.data_store = NpyDataStore(self.data_dir, mmap_mode=mmap_mode,
+                                           compression=compression)
+        elif data_layout == 'chunked':
+            self.data_store = ChunkedDataStore(self.chunk_dir, mmap_mode=mmap_mode,
+                                               compression=compression)
+            if self.data_store.is_new and os.listdir(self.data_dir):
+                self.import_npy_data()
+        else:
+            message = 'The data layout \'{}\' is invalid. Only {} are allowed.'
+            raise CinfdataCacheError(message.format(data_layout, ['npy', 'chunked']))
+
+        # Open the infoitem store
+        try:
+            store_class = self.infoitem_backends[infoitem_backend]
+        except KeyError:
+            message = 'The infoitem backend \'{}\' is invalid. Only {} are allowed.'
+            raise CinfdataCacheError(message.format(infoitem_backend,
+                                                    list(self.infoitem_backends.keys())))
+        self.infoitems = store_class(self.setup_dir, self.cache_version)
+
+        if self.infoitems.has('general', 'cache_version'):
+            loaded_cache_version = self.infoitems.load('general', 'cache_version')
         else:
-            self.infoitem = {
-                'general': {'cache_version': self.cache_version},
-                'metadata': {},
-                'groups': {},
-            }
+            loaded_cache_version = 1
+        if loaded_cache_version < self.cache_version:
+            message = ('Your cache is of the older version {}, wheres cinfdata now '
+                       'uses {}. Please delete your cache dir and start building it '
+                       'from scratch.')
+            raise CinfdataError(message.format(loaded_cache_version, self.cache_version))
+
+        # Setup write behind
+        self.write_behind = write_behind
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._unflushed = 0
+        self._last_flush = time()
+        self._transaction_depth = 0
+        self.stats = Stats()
+        if write_behind:
+            if hasattr(weakref, 'finalize'):
+                # Flush when the cache is garbage collected or at interpreter exit,
+                # whichever comes first
+                weakref.finalize(self, self.infoitems.flush)
+            else:
+                # Python 2, only flush at exit
+                atexit.register(_flush_cache_at_exit, weakref.ref(self))
 
     @staticmethod
     def _check_and_create_dirs(dirs):
@@ -558,10 +3960,12 @@ class Cache(object):
                 generic Python objects)
         """
         start = time()
-        filepath = path.join(self.data_dir, '{}.npy'.format(measurement_id))
         if data.dtype.hasobject:
             raise CinfdataCacheError('Saving object arrays is not supported')
-        np.save(filepath, data)
+        with self._lock:
+            filepath = self.data_store.save(measurement_id, data)
+        self.stats.time('cache.save_data', time() - start)
+        self.stats.count('cache.bytes_written', data.nbytes)
         LOG.debug('Saved data for id %s to cache in %0.4e s', measurement_id, time() - start)
         return filepath
 
@@ -570,23 +3974,115 @@ class Cache(object):
 
         Args:
             measurement_id (int): The database id of the dataset to load
+
+        Returns:
+            numpy.array: The data or None if it is not in the cache
         """
         start = time()
-        # Form filepath and check if the file exists
-        filepath = path.join(self.data_dir, '{}.npy'.format(measurement_id))
-        if not path.exists(filepath):
-            return None
+        data = self.data_store.load(measurement_id)
+        self.stats.time('cache.load_data', time() - start)
+        self.stats.count('cache.data_misses' if data is None else 'cache.data_hits')
+        if data is not None:
+            self.stats.count('cache.bytes_read', data.nbytes)
+            LOG.debug('Loaded data for id %s from cache in %0.4e s', measurement_id,
+                      time() - start)
+        return data
 
-        # Try and load the file and raise error is it fails
+    def append_data(self, measurement_id, new_rows, data):
+        """Append rows to a cached dataset
+
+        The rows are appended to the file in place where the data store supports it,
+        otherwise the whole dataset is saved again.
+
+        Args:
+            measurement_id (int): The database id of the dataset
+            new_rows (numpy.array): The rows to append
+            data (numpy.array): The whole dataset, including new_rows
+        """
+        start = time()
+        with self._lock:
+            appended = self.data_store.append(measurement_id, new_rows,
+                                              number_of_rows=len(data) - len(new_rows))
+            if not appended:
+                self.data_store.save(measurement_id, data)
+        self.stats.time('cache.append_data', time() - start)
+        self.stats.count('cache.bytes_written', new_rows.nbytes if appended else data.nbytes)
+        LOG.debug('%s %s rows for id %s to cache in %0.4e s',
+                  'Appended' if appended else 'Saved all', len(new_rows) if appended
+                  else len(data), measurement_id, time() - start)
+
+    def has_data(self, measurement_id):
+        """Return whether the cache contains a dataset for measurement_id"""
+        return self.data_store.has(measurement_id)
+
+    def data_ids(self):
+        """Return the ids of the cached measurements (leaving out derived datasets)"""
+        return [int(key) for key in self.data_store.keys() if key.isdigit()]
+
+    def load_data_many(self, measurement_ids):
+        """Load several datasets from the cache
+
+        Args:
+            measurement_ids (sequence): The database ids of the datasets to load
+
+        Returns:
+            dict: Mapping of ids to data for the ids that are in the cache
+        """
+        start = time()
+        datas = self.data_store.load_many(measurement_ids)
+        self.stats.time('cache.load_data_many', time() - start)
+        self.stats.count('cache.data_hits', len(datas))
+        self.stats.count('cache.data_misses', len(measurement_ids) - len(datas))
+        self.stats.count('cache.bytes_read', sum(data.nbytes for data in datas.values()))
+        LOG.debug('Loaded data for %s of %s ids from cache in %0.4e s', len(datas),
+                  len(measurement_ids), time() - start)
+        return datas
+
+    def save_metadata_table(self, table):
+        """Save the metadata table (see :meth:`Cinfdata.get_metadata_table`)"""
+        start = time()
+        with self._lock:
+            with atomic_write(self.metadata_table_file) as file_:
+                np.save(file_, table)
+        LOG.debug('Saved metadata table to cache in %0.4e s', time() - start)
+
+    def load_metadata_table(self):
+        """Load the metadata table or return None if it is not in the cache"""
+        if not path.exists(self.metadata_table_file):
+            return None
         try:
-            data = np.load(filepath)
+            return np.load(self.metadata_table_file)
         except IOError:
             message = 'The cache file:\n{}\nexists, but could not be loaded. '\
                       'Check file permissions'
-            raise CinfdataCacheError(message.format(filepath))
-        LOG.debug('Loaded data for id %s from cache in %0.4e s', measurement_id,
-                  time() - start)
-        return data
+            raise CinfdataCacheError(message.format(self.metadata_table_file))
+
+    def import_npy_data(self):
+        """Import all .npy files from the data dir into a chunked data store
+
+        Returns:
+            int: The number of imported datasets
+        """
+        if not isinstance(self.data_store, ChunkedDataStore):
+            raise CinfdataCacheError('Importing .npy files requires the chunked data layout')
+        start = time()
+        npy_store = NpyDataStore(self.data_dir)
+        number_imported = 0
+        with self._lock:
+            for key in npy_store.keys():
+                if not self.data_store.has(key):
+                    self.data_store.save(key, npy_store.load(key), flush_index=False)
+                    number_imported += 1
+            self.data_store.flush_index()
+        LOG.info('Imported %s .npy datasets into the chunked data store in %0.4e s',
+                 number_imported, time() - start)
+        return number_imported
+
+    def _check_group_name(self, group_name):
+        """Raise CinfdataCacheError if group_name is not a valid infoitem group"""
+        if group_name not in self.infoitem_groups:
+            message = 'The group name \'{}\' is invalid. Only {} are allowed.'
+            raise CinfdataCacheError(message.format(group_name, self.infoitem_groups))
 
     def save_infoitem(self, group_name, key, infoitem):
         """Save various information in a cached dictionary
@@ -594,7 +4090,8 @@ class Cache(object):
         Args:
             group_name (unicode): The group of infoitems to save in. Currently supported
                 groups are: 'general'; for general program settings, 'metadata'; to save
-                metadata in and 'group'; to save group information in.
+                metadata in, 'group'; to save group information in and 'signatures'; to
+                save the signatures used for validation of cached data in.
             key (dict key): The key to save this information item under
             infoitem (object): The information object to save under ``key``
 
@@ -603,29 +4100,81 @@ class Cache(object):
 
         """
         start = time()
-        try:
-            group = self.infoitem[group_name]
-        except KeyError:
-            message = 'The group name \'{}\' is invalid. Only {} are allowed.'
-            raise CinfdataCacheError(message.format(group_name, self.infoitem.keys()))
-        group[key] = infoitem
-        self._save_infoitems_to_file()
+        self._check_group_name(group_name)
+        with self._lock:
+            self.infoitems.update(group_name, {key: infoitem})
+            self._infoitems_saved(1)
+        self.stats.time('cache.save_infoitem', time() - start)
         LOG.debug('Saved infoitem for group \'%s\', key \'%s\' to cache in %0.4e s',
                   group_name, key, time() - start)
 
-    def _save_infoitems_to_file(self):
-        """Save the infoitem dict to file"""
-        error = None
+    def save_infoitems(self, group_name, infoitems):
+        """Save several information items in a cached dictionary with a single write
+
+        Args:
+            group_name (unicode): The group of infoitems to save in. See
+                :meth:`save_infoitem` for the supported groups.
+            infoitems (dict): Mapping of keys to information objects to save
+
+        Raises:
+            CinfdataCacheError: If there are problems with saving the metadata to disk
+
+        """
+        start = time()
+        self._check_group_name(group_name)
+        with self._lock:
+            self.infoitems.update(group_name, infoitems)
+            self._infoitems_saved(len(infoitems))
+        self.stats.time('cache.save_infoitems', time() - start)
+        LOG.debug('Saved %s infoitems for group \'%s\' to cache in %0.4e s',
+                  len(infoitems), group_name, time() - start)
+
+    @contextmanager
+    def transaction(self):
+        """Context manager that defers flushing of infoitems to the end of the block
+
+        All infoitems saved inside the block (from any thread) are written to disk with
+        a single flush when the block is left.
+        """
+        with self._lock:
+            self._transaction_depth += 1
         try:
-            with open(self.infoitem_file, 'wb') as file_:
-                pickle.dump(self.infoitem, file_)
-        except IOError:
-            error = 'The file: {}\nwhich is needed by the cache is not writable. '\
-                    'Check the file permissions.'.format(self.infoitem_file)
-        except pickle.PickleError:
-            error = 'Python was unable to save the infoitem dict. Report this as a bug.'
-        if error is not None:
-            raise CinfdataCacheError(error)
+            yield self
+        finally:
+            with self._lock:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0:
+                    self.flush()
+
+    def _infoitems_saved(self, number_saved):
+        """Flush the infoitems, unless write behind is enabled and no limit is exceeded"""
+        self._unflushed += number_saved
+        if self._transaction_depth > 0:
+            return
+        if not self.write_behind:
+            self.flush()
+        elif self.flush_every is not None and self._unflushed >= self.flush_every:
+            self.flush()
+        elif self.flush_interval is not None and \
+                time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write all unflushed infoitems to disk
+
+        Raises:
+            CinfdataCacheError: If there are problems with saving the infoitems to disk
+        """
+        start = time()
+        with self._lock:
+            self.infoitems.flush()
+            if self._unflushed > 0:
+                self.stats.time('cache.flush', time() - start)
+                self.stats.count('cache.infoitems_flushed', self._unflushed)
+                LOG.debug('Flushed %s infoitems to cache in %0.4e s', self._unflushed,
+                          time() - start)
+            self._unflushed = 0
+            self._last_flush = time()
 
     def load_infoitem(self, group_name, key):
         """Load information from a cached dictionary
@@ -635,19 +4184,27 @@ class Cache(object):
             key (dict key): The key of the infoitem to load
         """
         start = time()
-        try:
-            group = self.infoitem[group_name]
-        except KeyError:
-            message = 'The group name \'{}\' is invalid. Only {} are allowed.'
-            raise CinfdataCacheError(message.format(group_name, self.infoitem.keys()))
-        metadata = group[key]
+        self._check_group_name(group_name)
+        with self._lock:
+            metadata = self.infoitems.load(group_name, key)
+        self.stats.time('cache.load_infoitem', time() - start)
         LOG.debug('Loaded infoitem for group \'%s\', key \'%s\' from cache in %0.4e s',
                   group_name, key, time() - start)
         return metadata
 
     def has_infoitem(self, group_name, key):
-        """"""
-        return group_name in self.infoitem and key in self.infoitem[group_name]
+        """Return whether the cache contains an infoitem"""
+        with self._lock:
+            has = self.infoitems.has(group_name, key)
+        self.stats.count('cache.infoitem_hits' if has else 'cache.infoitem_misses')
+        return has
+
+
+def _flush_cache_at_exit(cache_reference):
+    """Flush a write behind cache at interpreter exit, if it is still alive"""
+    cache = cache_reference()
+    if cache is not None:
+        cache.flush()
 
 
 def run_module():
@@ -0,0 +1,61 @@
+"""pytest configuration for the offline tests
+
+The tests run against the sqlite3 stand in for the database in the benchmarks folder,
+so they need neither a database connection nor MySQLdb.
+"""
+
+import os
+import sys
+
+import pytest
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(THIS_DIR, '..', 'cinf_database'))
+sys.path.insert(0, os.path.join(THIS_DIR, '..', 'benchmarks'))
+
+import cinfdata  # noqa: E402
+from sqlite_backend import make_database, connection_factory  # noqa: E402
+
+# test_simple.py needs the real database
+collect_ignore = ['test_simple.py']
+
+SETUP_NAME = 'bench'
+
+
+@pytest.fixture(autouse=True)
+def isolated_module_state(monkeypatch):
+    """Do not remember hosts and do not share schemas between tests"""
+    monkeypatch.setattr(cinfdata.ConnectionPool, 'host_memory_file', None)
+    monkeypatch.setattr(cinfdata.CONNECTION_POOL, '_preferred', None)
+    cinfdata.SCHEMAS.clear()
+    yield
+    cinfdata.CONNECTION_POOL.close_all()
+    cinfdata.SCHEMAS.clear()
+
+
+@pytest.fixture
+def database_file(tmp_path):
+    """A database with 6 measurements of 100 points, in groups of 3"""
+    database_file = str(tmp_path / 'database.sqlite')
+    make_database(database_file, SETUP_NAME, number_of_measurements=6,
+                  number_of_points=100, group_size=3)
+    return database_file
+
+
+@pytest.fixture
+def make_cinfdata(database_file):
+    """Factory for Cinfdata instances connected to database_file"""
+    instances = []
+
+    def make(**kwargs):
+        kwargs.setdefault('log_level', 'DISABLE')
+        kwargs.setdefault('grouping_column', 'time')
+        instance = cinfdata.Cinfdata(SETUP_NAME,
+                                     connection_factory=connection_factory(database_file),
+                                     **kwargs)
+        instances.append(instance)
+        return instance
+
+    yield make
+    for instance in instances:
+        instance.close()
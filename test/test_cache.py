@@ -0,0 +1,255 @@
+"""Tests of the cache and its infoitem and data stores"""
+
+import os
+import pickle
+import stat
+
+import numpy as np
+import pytest
+
+import cinfdata
+from cinfdata import (Cache, PickleInfoitemStore, SqliteInfoitemStore, NpyDataStore,
+                      ChunkedDataStore, MemoryCache, atomic_write, CinfdataCacheError)
+
+
+INFOITEM_STORES = [PickleInfoitemStore, SqliteInfoitemStore]
+
+
+def file_mode(filepath):
+    """Return the permission bits of a file"""
+    return stat.S_IMODE(os.stat(filepath).st_mode)
+
+
+@pytest.mark.parametrize('store_class', INFOITEM_STORES)
+def test_infoitem_store_round_trip(tmp_path, store_class):
+    """Saved infoitems are loaded again, also by a new store"""
+    store = store_class(str(tmp_path), 2)
+    assert store.load('general', 'cache_version') == 2
+    assert not store.has('metadata', 5)
+    store.save('metadata', {5: {'id': 5, 'comment': 'CO2'}, (1, 'a'): [1, 2]})
+    assert store.has('metadata', 5)
+    with pytest.raises(KeyError):
+        store.load('metadata', 6)
+
+    reopened = store_class(str(tmp_path), 2)
+    assert reopened.load('metadata', 5) == {'id': 5, 'comment': 'CO2'}
+    assert reopened.load('metadata', (1, 'a')) == [1, 2]
+
+
+@pytest.mark.parametrize('store_class', INFOITEM_STORES)
+def test_infoitem_store_update_is_written_on_flush(tmp_path, store_class):
+    """update keeps infoitems in memory until flush"""
+    store = store_class(str(tmp_path), 2)
+    store.update('metadata', {1: 'one'})
+    assert store.load('metadata', 1) == 'one'
+    assert not store_class(str(tmp_path), 2).has('metadata', 1)
+    store.flush()
+    assert store_class(str(tmp_path), 2).load('metadata', 1) == 'one'
+
+
+def test_pickle_store_is_migrated_to_sqlite(tmp_path):
+    """An existing infoitem pickle is migrated into a new sqlite store"""
+    PickleInfoitemStore(str(tmp_path), 2).save('metadata', {7: 'seven'})
+    store = SqliteInfoitemStore(str(tmp_path), 2)
+    assert store.load('metadata', 7) == 'seven'
+    assert os.path.exists(str(tmp_path / 'infoitem.pickle.migrated'))
+    assert not os.path.exists(str(tmp_path / 'infoitem.pickle'))
+
+
+@pytest.mark.parametrize('store_class', INFOITEM_STORES)
+def test_infoitem_stores_of_two_processes_are_merged(tmp_path, store_class):
+    """Two stores on the same dir see and keep each others infoitems"""
+    first = store_class(str(tmp_path), 2)
+    second = store_class(str(tmp_path), 2)
+    first.save('metadata', {1: 'first'})
+    second.save('metadata', {2: 'second'})
+    # A miss looks for infoitems written by the other store
+    assert first.load('metadata', 2) == 'second'
+    merged = store_class(str(tmp_path), 2)
+    assert merged.load('metadata', 1) == 'first'
+    assert merged.load('metadata', 2) == 'second'
+
+
+def test_atomic_write_keeps_old_file_on_error(tmp_path):
+    """A failed write leaves the old file and no temporary file"""
+    filepath = str(tmp_path / 'file.pickle')
+    with atomic_write(filepath) as file_:
+        pickle.dump({'a': 1}, file_)
+    with pytest.raises(ValueError):
+        with atomic_write(filepath) as file_:
+            file_.write(b'partial')
+            raise ValueError('Interrupted')
+    with open(filepath, 'rb') as file_:
+        assert pickle.load(file_) == {'a': 1}
+    assert os.listdir(str(tmp_path)) == ['file.pickle']
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='POSIX permissions')
+def test_atomic_write_file_mode(tmp_path):
+    """New files get the mode open would give them and replaced files keep theirs"""
+    filepath = str(tmp_path / 'file')
+    with atomic_write(filepath) as file_:
+        file_.write(b'new')
+    assert file_mode(filepath) == cinfdata.NEW_FILE_MODE
+    os.chmod(filepath, 0o640)
+    with atomic_write(filepath) as file_:
+        file_.write(b'replaced')
+    assert file_mode(filepath) == 0o640
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='POSIX permissions')
+def test_cache_files_are_not_private(tmp_path):
+    """The files of a cache dir can be shared with the users the umask allows"""
+    cache = Cache(str(tmp_path), 'setup')
+    cache.save_data(1, np.ones((3, 2)))
+    cache.save_infoitem('metadata', 1, 'one')
+    for filepath in (tmp_path / 'setup' / 'data' / '1.npy',
+                     tmp_path / 'setup' / 'infoitem.pickle'):
+        assert file_mode(str(filepath)) == cinfdata.NEW_FILE_MODE
+
+
+def make_data_store(kind, directory, **kwargs):
+    """Return a data store of kind 'npy' or 'chunked' in directory"""
+    if kind == 'npy':
+        return NpyDataStore(directory, **kwargs)
+    return ChunkedDataStore(directory, **kwargs)
+
+
+@pytest.mark.parametrize('kind', ['npy', 'chunked'])
+@pytest.mark.parametrize('compression', [None, 'delta+shuffle+zlib'])
+def test_data_store_round_trip(tmp_path, kind, compression):
+    """Datasets are saved, loaded and replaced, also by a new store"""
+    store = make_data_store(kind, str(tmp_path), compression=compression)
+    data = np.column_stack((np.arange(50.0), np.random.RandomState(0).randn(50)))
+    store.save(1, data)
+    store.save('1_minmax10', data[:10])
+    assert store.has(1) and not store.has(2)
+    assert store.load(2) is None
+    np.testing.assert_array_equal(store.load(1), data)
+
+    store.save(1, data[:5])
+    reopened = make_data_store(kind, str(tmp_path))
+    np.testing.assert_array_equal(reopened.load(1), data[:5])
+    assert sorted(reopened.keys()) == ['1', '1_minmax10']
+    assert set(reopened.load_many([1, 2, '1_minmax10'])) == {1, '1_minmax10'}
+
+
+def test_chunked_store_starts_new_chunks(tmp_path):
+    """Datasets go to a new chunk file when the current one is full"""
+    store = ChunkedDataStore(str(tmp_path), chunk_size=2000)
+    for key in range(5):
+        store.save(key, np.full((50, 2), float(key)))
+    assert os.path.exists(store._chunk_path(2))
+    reopened = ChunkedDataStore(str(tmp_path))
+    for key in range(5):
+        np.testing.assert_array_equal(reopened.load(key), np.full((50, 2), float(key)))
+
+
+def test_chunked_store_sees_datasets_of_other_stores(tmp_path):
+    """A miss in the index reads the entries another store has added"""
+    first = ChunkedDataStore(str(tmp_path))
+    second = ChunkedDataStore(str(tmp_path))
+    first.save(1, np.ones((3, 2)))
+    second.save(2, np.zeros((4, 2)))
+    assert first.has(2)
+    np.testing.assert_array_equal(first.load(2), np.zeros((4, 2)))
+    np.testing.assert_array_equal(second.load(1), np.ones((3, 2)))
+
+
+def test_npy_append(tmp_path):
+    """Rows are appended in place, unless the dataset has changed"""
+    store = NpyDataStore(str(tmp_path))
+    store.save(1, np.zeros((4, 2)))
+    assert store.append(1, np.ones((2, 2)), number_of_rows=4)
+    # The dataset now has 6 rows, so an append expecting 4 is refused
+    assert not store.append(1, np.ones((2, 2)), number_of_rows=4)
+    assert not store.append(2, np.ones((2, 2)))
+    data = store.load(1)
+    assert data.shape == (6, 2)
+    np.testing.assert_array_equal(data[4:], np.ones((2, 2)))
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_chunked_append(tmp_path, compression):
+    """Rows are appended in place or the dataset is moved with room to grow"""
+    store = ChunkedDataStore(str(tmp_path), compression=compression)
+    datas = {1: np.zeros((100, 2)), 2: np.ones((100, 2))}
+    for key, data in datas.items():
+        store.save(key, data)
+    assert not store.append(3, np.ones((2, 2)))
+    assert not store.append(1, np.ones((2, 2)), number_of_rows=99)
+    assert not store.append(1, np.ones((2, 3)))
+
+    # Append to two datasets in turn, so neither stays at the end of the chunk file
+    for append_number in range(100):
+        for key in datas:
+            rows = np.full((10, 2), float(append_number))
+            assert store.append(key, rows, number_of_rows=len(datas[key]))
+            datas[key] = np.concatenate((datas[key], rows))
+
+    reopened = ChunkedDataStore(str(tmp_path))
+    for key, data in datas.items():
+        np.testing.assert_array_equal(store.load(key), data)
+        np.testing.assert_array_equal(reopened.load(key), data)
+    # The datasets are only moved a few times, so the chunk file grows linearly
+    chunk_size = os.path.getsize(str(tmp_path / 'chunk_00000.bin'))
+    assert chunk_size < 8 * sum(data.nbytes for data in datas.values())
+
+
+@pytest.mark.parametrize('backend', ['pickle', 'sqlite'])
+def test_cache_write_behind(tmp_path, backend):
+    """In write behind mode, infoitems are written on flush or after flush_every"""
+    cache = Cache(str(tmp_path), 'setup', infoitem_backend=backend, write_behind=True,
+                  flush_every=3)
+    cache.save_infoitem('metadata', 1, 'one')
+    assert not Cache(str(tmp_path), 'setup', infoitem_backend=backend)\
+        .has_infoitem('metadata', 1)
+    cache.save_infoitems('metadata', {2: 'two', 3: 'three'})
+    assert Cache(str(tmp_path), 'setup', infoitem_backend=backend)\
+        .has_infoitem('metadata', 3)
+    cache.save_infoitem('metadata', 4, 'four')
+    cache.flush()
+    assert Cache(str(tmp_path), 'setup', infoitem_backend=backend)\
+        .has_infoitem('metadata', 4)
+
+
+def test_cache_transaction(tmp_path):
+    """Infoitems saved in a transaction are written when it ends"""
+    cache = Cache(str(tmp_path), 'setup')
+    with cache.transaction():
+        cache.save_infoitem('metadata', 1, 'one')
+        assert not Cache(str(tmp_path), 'setup').has_infoitem('metadata', 1)
+    assert Cache(str(tmp_path), 'setup').has_infoitem('metadata', 1)
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'infoitem_backend': 'json'}, {'data_layout': 'hdf5'},
+])
+def test_cache_invalid_arguments(tmp_path, kwargs):
+    """Invalid options raise CinfdataCacheError"""
+    with pytest.raises(CinfdataCacheError):
+        Cache(str(tmp_path), 'setup', **kwargs)
+
+
+@pytest.mark.parametrize('data_layout', ['npy', 'chunked'])
+def test_cache_rejects_object_arrays(tmp_path, data_layout):
+    """Object arrays cannot be cached"""
+    cache = Cache(str(tmp_path), 'setup', data_layout=data_layout)
+    with pytest.raises(CinfdataCacheError):
+        cache.save_data(1, np.array([[None, 1]], dtype=object))
+
+
+def test_memory_cache_evicts_least_recently_used():
+    """Entries are evicted least recently used first, by number and by bytes"""
+    cache = MemoryCache(max_entries=2, max_bytes=100)
+    cache.put('a', 1, 10)
+    cache.put('b', 2, 10)
+    assert cache.get('a') == 1
+    cache.put('c', 3, 10)
+    assert 'b' not in cache and 'a' in cache and 'c' in cache
+    cache.put('d', 4, 85)
+    assert 'a' not in cache and cache.nbytes == 95
+    # Values larger than max_bytes are not cached
+    cache.put('e', 5, 101)
+    assert cache.get('e') is None
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -0,0 +1,653 @@
+"""Tests of Cinfdata against the sqlite3 stand in for the database"""
+
+import asyncio
+import gc
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import pytest
+
+import cinfdata
+from cinfdata import (AsyncCinfdata, Cinfdata, Cache, GroupData, CinfdataError,
+                      CinfdataCacheError)
+from conftest import SETUP_NAME
+from sqlite_backend import make_database, connection_factory
+
+
+def execute(database_file, query, rows=()):
+    """Execute a query on the stand in database, for each of rows if given"""
+    connection = sqlite3.connect(database_file)
+    if rows:
+        connection.executemany(query, rows)
+    else:
+        connection.execute(query)
+    connection.commit()
+    connection.close()
+
+
+def set_rows(database_file, measurement_id, x, y=None):
+    """Replace the rows of a measurement"""
+    y = np.arange(len(x), dtype=float) if y is None else y
+    execute(database_file, 'DELETE FROM xy_values_bench WHERE measurement={}'
+            .format(measurement_id))
+    add_rows(database_file, measurement_id, x, y)
+
+
+def add_rows(database_file, measurement_id, x, y):
+    """Add rows to a measurement"""
+    execute(database_file,
+            'INSERT INTO xy_values_bench (measurement, x, y) VALUES ({}, ?, ?)'
+            .format(measurement_id),
+            [(float(x_value), float(y_value)) for x_value, y_value in zip(x, y)])
+
+
+def count_queries(database, function, *args, **kwargs):
+    """Call function and return the number of database queries it made"""
+    before = database.stats()['counters'].get('database.queries', 0)
+    function(*args, **kwargs)
+    return database.stats()['counters'].get('database.queries', 0) - before
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    """The cache dir"""
+    return str(tmp_path / 'cache')
+
+
+def test_get_data_and_metadata(make_cinfdata, cache_dir):
+    """Data and metadata are the same from the database and from the cache"""
+    database = make_cinfdata()
+    data = database.get_data(1)
+    metadata = database.get_metadata(1)
+    assert data.shape == (100, 2)
+    assert metadata['id'] == 1 and metadata['mass_label'] == 'M1'
+
+    cached = make_cinfdata(use_caching=True, cache_dir=cache_dir)
+    np.testing.assert_array_equal(cached.get_data(1), data)
+    assert cached.get_metadata(1) == metadata
+    cache_only = make_cinfdata(use_caching=True, cache_dir=cache_dir, cache_only=True)
+    np.testing.assert_array_equal(cache_only.get_data(1), data)
+    with pytest.raises(CinfdataError):
+        cache_only.get_data(2)
+
+
+@pytest.mark.parametrize('max_ids_per_query', [1000, 2])
+def test_get_data_group(make_cinfdata, max_ids_per_query):
+    """The data of a group is fetched with one query per max_ids_per_query members"""
+    database = make_cinfdata()
+    database.max_ids_per_query = max_ids_per_query
+    group_id = database.get_metadata(1)['time']
+    # One query for the ids of the group and one per batch of data
+    expected_queries = 1 + -(-3 // max_ids_per_query)
+    assert count_queries(database, database.get_data_group, group_id) == expected_queries
+    group = database.get_data_group(group_id)
+    assert sorted(group) == [1, 2, 3]
+    for measurement_id, data in group.items():
+        np.testing.assert_array_equal(data, database.get_data(measurement_id))
+
+
+@pytest.mark.parametrize('use_caching', [False, True])
+def test_group_with_empty_member(make_cinfdata, database_file, cache_dir, use_caching):
+    """A member without rows, e.g. an aborted measurement, gets an empty array"""
+    execute(database_file, 'DELETE FROM xy_values_bench WHERE measurement=2')
+    database = make_cinfdata(use_caching=use_caching, cache_dir=cache_dir)
+    group = database.get_data_group(database.get_metadata(1)['time'])
+    assert sorted(group) == [1, 2, 3]
+    assert group[2].shape == (0, 2)
+    assert group[1].shape == (100, 2)
+    assert database.get_data(2).shape == (0, 2)
+
+
+@pytest.mark.parametrize('max_ids_per_query', [1000, 2])
+def test_get_metadata_group(make_cinfdata, cache_dir, max_ids_per_query):
+    """The metadata of a group is fetched in batches and only for cache misses"""
+    database = make_cinfdata(use_caching=True, cache_dir=cache_dir)
+    database.max_ids_per_query = max_ids_per_query
+    expected = {id_: make_cinfdata().get_metadata(id_) for id_ in (4, 5, 6)}
+    group_id = expected[4]['time']
+    # One query for the ids of the group and one per batch of metadata
+    expected_queries = 1 + -(-3 // max_ids_per_query)
+    assert count_queries(database, database.get_metadata_group, group_id) == \
+        expected_queries
+    assert database.get_metadata_group(group_id) == expected
+
+    # Only the metadata that is not in the cache is fetched, and the ids of a group are
+    # cached too
+    other_group_id = database.get_metadata(1)['time']
+    assert count_queries(database, database.get_metadata_group, other_group_id) == 2
+    assert count_queries(database, database.get_metadata_group, group_id) == 0
+
+
+@pytest.mark.parametrize('stream_chunk_size', [7, 100, 65536])
+def test_streaming(make_cinfdata, database_file, stream_chunk_size):
+    """Streamed data is the same as data fetched all at once, for any chunk size"""
+    execute(database_file, 'DELETE FROM xy_values_bench WHERE measurement=2')
+    database = make_cinfdata()
+    streaming = make_cinfdata(streaming=True)
+    streaming.stream_chunk_size = stream_chunk_size
+    for measurement_id in (1, 2):
+        data = streaming.get_data(measurement_id)
+        np.testing.assert_array_equal(data, database.get_data(measurement_id))
+        assert data.shape[1] == 2
+    group_id = database.get_metadata(1)['time']
+    group = streaming.get_data_group(group_id)
+    for measurement_id, data in database.get_data_group(group_id).items():
+        np.testing.assert_array_equal(group[measurement_id], data)
+
+
+@pytest.mark.parametrize('use_caching', [False, True])
+def test_group_array_with_empty_member(make_cinfdata, database_file, cache_dir,
+                                       use_caching):
+    """A member without rows has length 0 in the group array"""
+    execute(database_file, 'DELETE FROM xy_values_bench WHERE measurement=2')
+    database = make_cinfdata(use_caching=use_caching, cache_dir=cache_dir)
+    group_array = database.get_data_group_array(database.get_metadata(1)['time'])
+    assert isinstance(group_array, GroupData)
+    assert list(group_array) == [1, 2, 3]
+    np.testing.assert_array_equal(group_array.lengths, [100, 0, 100])
+
+
+@pytest.mark.parametrize('metadata_as_named_tuple', [False, True])
+def test_group_labels_and_scaling_by_label(make_cinfdata, metadata_as_named_tuple):
+    """Labels are looked up by column name, also when metadata are namedtuples"""
+    database = make_cinfdata(label_column='mass_label',
+                             metadata_as_named_tuple=metadata_as_named_tuple)
+    group_id = make_cinfdata().get_metadata(1)['time']
+    original = database.get_data_group(group_id)
+    scaling_factors = {'M2': (None, 10.0)}
+
+    group_array = database.get_data_group_array(group_id, scaling_factors=scaling_factors)
+    assert group_array.labels == ['M1', 'M2', 'M3']
+    group = database.get_data_group(group_id, scaling_factors=scaling_factors)
+    for scaled in (group_array[2], group[2]):
+        np.testing.assert_array_equal(scaled[:, 1], original[2][:, 1] * 10.0)
+    np.testing.assert_array_equal(group[1], original[1])
+
+    metadata_group = database.get_metadata_group(group_id)
+    assert sorted(metadata_group) == [1, 2, 3]
+    if metadata_as_named_tuple:
+        assert metadata_group[2].mass_label == 'M2'
+    else:
+        assert metadata_group[2]['mass_label'] == 'M2'
+
+
+def test_validate_cache(make_cinfdata, database_file, cache_dir):
+    """Validated cached data costs one query, and stale data is fetched again"""
+    database = make_cinfdata(use_caching=True, cache_dir=cache_dir, validate_cache=True)
+    group_id = database.get_metadata(1)['time']
+    database.get_data_group(group_id)
+    assert count_queries(database, database.get_data, 1) == 1
+
+    # A stale read costs the signatures and the data, also for groups
+    add_rows(database_file, 1, [100.0, 101.0], [0.0, 0.0])
+    add_rows(database_file, 2, [100.0], [0.0])
+    assert count_queries(database, database.get_data, 1) == 2
+    assert len(database.get_data(1)) == 102
+    assert count_queries(database, database.get_data_group, group_id) == 2
+    assert len(database.get_data_group(group_id)[2]) == 101
+
+    # Changed rows are found by the highest id, also if the count is unchanged
+    execute(database_file, 'DELETE FROM xy_values_bench WHERE measurement=3 AND x=0')
+    add_rows(database_file, 3, [100.0], [0.0])
+    assert database.get_data(3)[-1, 0] == 100.0
+
+    # The data is validated also when the cache is opened again
+    execute(database_file, 'DELETE FROM xy_values_bench WHERE measurement=1 AND x>=100')
+    reopened = make_cinfdata(use_caching=True, cache_dir=cache_dir, validate_cache=True)
+    assert len(reopened.get_data(1)) == 100
+
+
+def test_cache_ttl(make_cinfdata, database_file, cache_dir, monkeypatch):
+    """With cache_ttl, cached data is only validated once per cache_ttl seconds"""
+    now = [1000.0]
+    monkeypatch.setattr(cinfdata, 'time', lambda: now[0])
+    database = make_cinfdata(use_caching=True, cache_dir=cache_dir, validate_cache=True,
+                             cache_ttl=60)
+    database.get_data(1)
+    add_rows(database_file, 1, [100.0], [0.0])
+    assert count_queries(database, database.get_data, 1) == 0
+    assert len(database.get_data(1)) == 100
+    now[0] += 60
+    assert len(database.get_data(1)) == 101
+    assert count_queries(database, database.get_data, 1) == 0
+
+
+@pytest.mark.parametrize('use_caching', [False, True])
+def test_x_range(make_cinfdata, database_file, cache_dir, use_caching):
+    """x ranges have all the rows in the range, also where x goes up and down"""
+    set_rows(database_file, 1, [10, 20, 30, 40, 50, 40, 30, 20, 10])
+    database = make_cinfdata(use_caching=use_caching, cache_dir=cache_dir)
+    database.get_data(1)
+    expected = [20, 30, 40, 40, 30, 20]
+    assert list(database.get_data(1, x_min=20, x_max=40)[:, 0]) == expected
+    group = database.get_data_group(database.get_metadata(1)['time'], x_min=20, x_max=40)
+    assert list(group[1][:, 0]) == expected
+    # Ascending data and open ranges
+    np.testing.assert_array_equal(database.get_data(2, x_min=10, x_max=19.5)[:, 0],
+                                  np.arange(10.0, 20.0))
+    np.testing.assert_array_equal(database.get_data(2, x_max=4)[:, 0], np.arange(5.0))
+    np.testing.assert_array_equal(database.get_data(2, x_min=95)[:, 0],
+                                  np.arange(95.0, 100.0))
+    assert database.get_data(2, x_min=200).shape == (0, 2)
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'use_caching': True},
+    {'memory_cache_entries': 10},
+    {'use_caching': True, 'validate_cache': True},
+])
+def test_downsampled_data_follows_appended_rows(make_cinfdata, database_file, cache_dir,
+                                                kwargs):
+    """One cache entry per downsampled version, which is updated when rows are added"""
+    database = make_cinfdata(cache_dir=cache_dir, **kwargs)
+    database.get_data(1, incremental=True)
+    assert len(database.get_data(1, max_points=20)) <= 20
+    for start in (100, 200):
+        add_rows(database_file, 1, np.arange(start, start + 100), np.zeros(100))
+        if not kwargs.get('validate_cache'):
+            database.get_data(1, incremental=True)
+        downsampled = database.get_data(1, max_points=20)
+        assert len(downsampled) <= 20
+        assert downsampled[:, 0].max() >= start
+        assert not np.isnan(downsampled).any()
+
+    if database.cache:
+        assert sorted(database.cache.data_store.keys()) == ['1', '1_minmax20']
+        # The cached entry is the downsampled data, as returned
+        np.testing.assert_array_equal(database.cache.load_data('1_minmax20'), downsampled)
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'use_caching': True},
+    {'memory_cache_entries': 20},
+])
+def test_view_levels_are_cached(make_cinfdata, cache_dir, monkeypatch, kwargs):
+    """The pyramid is built once and then read from the caches for every view"""
+    builds = []
+    build_pyramid = cinfdata.build_pyramid
+    monkeypatch.setattr(cinfdata, 'build_pyramid',
+                        lambda *args: builds.append(args) or build_pyramid(*args))
+    database = make_cinfdata(cache_dir=cache_dir, **kwargs)
+    database.pyramid_min_rows = 16
+    full = database.get_data(1)
+    for x_min, x_max in ((None, None), (10, 60), (50, None)):
+        view = database.get_data_for_view(1, x_min=x_min, x_max=x_max, pixel_width=10)
+        assert 10 <= len(view) < 100
+    assert len(builds) == 1
+    assert view[:, 2].max() >= full[50:, 1].max()
+
+    if database.cache:
+        reopened = make_cinfdata(cache_dir=cache_dir, **kwargs)
+        reopened.pyramid_min_rows = 16
+        np.testing.assert_array_equal(reopened.get_data_for_view(1, pixel_width=10),
+                                      database.get_data_for_view(1, pixel_width=10))
+        assert len(builds) == 1
+
+
+def test_view_requires_a_cache(make_cinfdata):
+    """Without caches every view would build the pyramid from the full dataset"""
+    with pytest.raises(CinfdataError):
+        make_cinfdata().get_data_for_view(1)
+
+
+def test_view_of_ramp(make_cinfdata, database_file, cache_dir):
+    """A view of data where x goes up and down contains both directions"""
+    x = np.concatenate((np.arange(500.0), np.arange(500.0)[::-1]))
+    set_rows(database_file, 1, x)
+    database = make_cinfdata(use_caching=True, cache_dir=cache_dir)
+    database.pyramid_min_rows = 16
+    view = database.get_data_for_view(1, x_min=100, x_max=199, pixel_width=20)
+    assert view[:, 0].min() >= 99 and view[:, 0].max() <= 199
+    # y is the row number, so rows of both the up and down ramp are included
+    assert view[:, 1].min() < 500 < view[:, 2].max()
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'use_caching': True},
+    {'use_caching': True, 'cache_data_layout': 'chunked'},
+    {'use_caching': True, 'mmap_mode': 'r'},
+    {'memory_cache_entries': 20},
+])
+def test_view_follows_appended_rows(make_cinfdata, database_file, cache_dir, monkeypatch,
+                                    kwargs):
+    """The cached pyramid is updated with appended rows, without rebuilding it"""
+    database = make_cinfdata(cache_dir=cache_dir, cache_pyramid=True, **kwargs)
+    database.pyramid_min_rows = 16
+    reference = make_cinfdata(memory_cache_entries=20)
+    reference.pyramid_min_rows = 16
+    builds = []
+    build_pyramid = cinfdata.build_pyramid
+    monkeypatch.setattr(cinfdata, 'build_pyramid',
+                        lambda *args: builds.append(len(args[0])) or build_pyramid(*args))
+    database.get_data(1, incremental=True)
+    assert database.get_data_for_view(1, pixel_width=10)[:, 0].max() < 100
+
+    random = np.random.RandomState(0)
+    number_of_rows = 100
+    for number_of_new_rows in (1, 2, 5, 23, 100, 3, 200):
+        x = np.arange(number_of_rows, number_of_rows + number_of_new_rows)
+        add_rows(database_file, 1, x, random.randn(number_of_new_rows))
+        number_of_rows += number_of_new_rows
+        assert len(database.get_data(1, incremental=True)) == number_of_rows
+        for x_min, x_max, pixel_width in ((None, None, 10), (150, None, 4),
+                                          (None, 80, 5), (number_of_rows - 3, None, 1)):
+            view = database.get_data_for_view(1, x_min=x_min, x_max=x_max,
+                                              pixel_width=pixel_width)
+            # The same view from a new pyramid of all the data
+            number_of_builds = len(builds)
+            np.testing.assert_allclose(view, reference.get_data_for_view(
+                1, x_min=x_min, x_max=x_max, pixel_width=pixel_width
+            ))
+            del builds[number_of_builds:]
+            reference.memory_cache.clear()
+    # The pyramid is only rebuilt when it grows a level, here from 3 to 5 levels
+    assert builds == [100, 131, 434]
+
+
+def test_incremental_chunked_disk_use(make_cinfdata, database_file, cache_dir):
+    """Polling a measurement with the chunked layout uses disk space linear in its size"""
+    database = make_cinfdata(use_caching=True, cache_dir=cache_dir,
+                             cache_data_layout='chunked')
+    for poll in range(100):
+        for measurement_id in (1, 2):
+            database.get_data(measurement_id, incremental=True)
+            x = np.arange(100 + 10 * poll, 110 + 10 * poll)
+            add_rows(database_file, measurement_id, x, np.zeros(10))
+    data = database.get_data(1, incremental=True)
+    assert len(data) == 1100
+    chunk_file = os.path.join(cache_dir, SETUP_NAME, 'chunks', 'chunk_00000.bin')
+    assert os.path.getsize(chunk_file) < 8 * 2 * data.nbytes
+
+
+def test_memory_cache(make_cinfdata):
+    """Repeated reads are served from the memory cache, which cannot be altered"""
+    database = make_cinfdata(memory_cache_entries=10)
+    data = database.get_data(1)
+    metadata = database.get_metadata(1)
+    assert count_queries(database, database.get_data, 1) == 0
+    assert count_queries(database, database.get_metadata, 1) == 0
+    assert database.get_data(1) is data
+    assert not data.flags.writeable
+    database.get_metadata(1)['comment'] = 'changed'
+    assert database.get_metadata(1) == metadata
+    scaled = database.get_data(1, scaling_factors=(2.0, None))
+    np.testing.assert_array_equal(scaled[:, 0], data[:, 0] * 2.0)
+
+
+def test_queries_from_threads(make_cinfdata):
+    """Threads share an instance and the pooled connections"""
+    database = make_cinfdata()
+    expected = {id_: database.get_data(id_) for id_ in range(1, 7)}
+    errors = []
+
+    def get_data(measurement_id):
+        try:
+            for _ in range(10):
+                np.testing.assert_array_equal(database.get_data(measurement_id),
+                                              expected[measurement_id])
+        except Exception as exception:  # pylint: disable=broad-except
+            errors.append(exception)
+
+    threads = [threading.Thread(target=get_data, args=(id_,)) for id_ in range(1, 7)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    idle = cinfdata.CONNECTION_POOL._idle[database._connection_parameters]
+    assert 1 <= len(idle) <= cinfdata.CONNECTION_POOL.max_idle
+
+
+def test_dead_idle_connections_are_replaced(make_cinfdata, monkeypatch):
+    """Idle connections that do not respond to ping are discarded"""
+    database = make_cinfdata()
+    database.get_data(1)
+    idle = cinfdata.CONNECTION_POOL._idle[database._connection_parameters]
+    assert len(idle) == 1
+    # Simulate that the server has closed the idle connection
+    idle[0][0].close()
+    monkeypatch.setattr(cinfdata.CONNECTION_POOL, 'ping_after', 0)
+    assert database.get_data(2).shape == (100, 2)
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_get_data_many_and_prefetch(make_cinfdata, database_file, cache_dir, workers):
+    """get_data_many and prefetch fetch in batches and continue past empty datasets"""
+    execute(database_file, 'DELETE FROM xy_values_bench WHERE measurement=2')
+    database = make_cinfdata(use_caching=True, cache_dir=cache_dir)
+    datas = dict(database.get_data_many([1, 2, 3, 4], workers=workers, batch_size=2))
+    assert sorted(datas) == [1, 2, 3, 4]
+    assert datas[2].shape == (0, 2)
+    for measurement_id in (1, 3, 4):
+        np.testing.assert_array_equal(datas[measurement_id],
+                                      make_cinfdata().get_data(measurement_id))
+    # Empty datasets are not cached, so they are not counted
+    assert database.prefetch([2, 5, 6], workers=workers, batch_size=1) == 2
+    assert count_queries(database, dict, database.get_data_many([1, 3, 4, 5, 6])) == 0
+    with pytest.raises(CinfdataError):
+        make_cinfdata(cache_dir=cache_dir).prefetch([1])
+
+
+def test_async_cinfdata(make_cinfdata, database_file):
+    """Awaited calls run in parallel and give the results of Cinfdata"""
+    database = make_cinfdata()
+    group_id = database.get_metadata(1)['time']
+    async_database = AsyncCinfdata(SETUP_NAME, max_concurrency=12, log_level='DISABLE',
+                                   grouping_column='time',
+                                   connection_factory=connection_factory(database_file))
+
+    async def get_all():
+        """Get data and metadata of all measurements and a group at once"""
+        return await asyncio.gather(
+            async_database.get_data_group(group_id),
+            async_database.get_metadata_group(group_id),
+            *[async_database.get_data(id_) for id_ in range(1, 7)]
+        )
+
+    try:
+        group, metadata_group, *datas = asyncio.run(get_all())
+    finally:
+        async_database.close()
+    assert metadata_group == database.get_metadata_group(group_id)
+    for measurement_id, data in zip(range(1, 7), datas):
+        np.testing.assert_array_equal(data, database.get_data(measurement_id))
+        if measurement_id in group:
+            np.testing.assert_array_equal(group[measurement_id], data)
+    # Only the limit of idle connections of this setup is raised
+    assert cinfdata.CONNECTION_POOL.max_idle == 8
+    parameters = async_database.cinfdata._connection_parameters
+    assert cinfdata.CONNECTION_POOL._max_idle_for[parameters] == 12
+
+
+def test_hosts_are_probed_in_parallel(database_file):
+    """The host that connects first is used and remembered, without waiting for the
+    others, and the connection is only made when it is needed
+    """
+    release_main_host = threading.Event()
+    hosts = []
+
+    def factory(host, **kwargs):
+        hosts.append(host)
+        if host == Cinfdata.main_host:
+            # An unreachable host, which only fails when its timeout runs out
+            release_main_host.wait(10)
+            raise RuntimeError('Unable to connect')
+        return connection_factory(database_file)(host=host, **kwargs)
+
+    database = Cinfdata(SETUP_NAME, log_level='DISABLE', connection_factory=factory)
+    try:
+        assert hosts == []
+        assert database.get_data(1).shape == (100, 2)
+        assert not release_main_host.is_set()
+        preferred = cinfdata.CONNECTION_POOL.preferred_candidate(
+            database._connection_parameters
+        )
+        assert preferred[0] == Cinfdata.secondary_host
+    finally:
+        release_main_host.set()
+        database.close()
+
+
+def test_failing_connection_factory_raises(database_file):
+    """An error from the connection factory is raised, instead of hanging"""
+    def factory(**kwargs):
+        raise RuntimeError('Unable to connect')
+
+    result = {}
+
+    def get_data():
+        try:
+            Cinfdata(SETUP_NAME, log_level='DISABLE', connection_factory=factory)\
+                .get_data(1)
+        except RuntimeError as exception:
+            result['exception'] = exception
+
+    thread = threading.Thread(target=get_data)
+    thread.daemon = True
+    thread.start()
+    thread.join(10)
+    assert 'exception' in result
+
+
+def test_load_schemas(make_cinfdata, database_file):
+    """Schemas loaded up front are shared, so no instance queries its schema"""
+    make_database(database_file, 'other', number_of_measurements=2, number_of_points=10)
+    database = make_cinfdata()
+    assert count_queries(database, database.load_schemas,
+                         [SETUP_NAME, 'other', 'missing']) == 1
+    assert sorted(cinfdata.SCHEMAS) == [(database.database_name, SETUP_NAME),
+                                        (database.database_name, 'other')]
+
+    other = Cinfdata('other', log_level='DISABLE',
+                     connection_factory=connection_factory(database_file))
+    try:
+        assert count_queries(other, lambda: other.column_names) == 0
+        assert 'mass_label' in other.column_names
+        assert other.column_types['id'] == 'integer'
+        assert other.get_metadata(2)['id'] == 2
+    finally:
+        other.close()
+    third = make_cinfdata()
+    assert count_queries(third, lambda: third.column_names) == 0
+
+
+def test_get_metadata_table(make_cinfdata, database_file, cache_dir):
+    """The metadata table is typed, cached and only new rows are fetched again"""
+    database = make_cinfdata(use_caching=True, cache_dir=cache_dir)
+    table = database.get_metadata_table()
+    assert list(table['id']) == [1, 2, 3, 4, 5, 6]
+    assert table['type'].dtype == np.int64
+    assert table['sem_voltage'].dtype == np.float64
+    assert list(table['id'][table['mass_label'] == 'M2']) == [2, 5]
+    metadata = database.get_metadata(5)
+    for name in ('sem_voltage', 'unixtime', 'comment'):
+        assert table[name][4] == metadata[name]
+    filtered = database.get_metadata_table('mass_label = %s', ('M3',))
+    assert list(filtered['id']) == [3, 6]
+
+    # A new measurement with NULL values turns the integer column into float
+    execute(database_file, "INSERT INTO measurements_bench VALUES "
+            "(7, '2017-01-01 02:00:00', 'New', 'M4', NULL, NULL)")
+    assert count_queries(database, database.get_metadata_table) == 1
+    table = database.get_metadata_table()
+    assert list(table['id']) == [1, 2, 3, 4, 5, 6, 7]
+    assert table['type'].dtype == np.float64
+    assert np.isnan(table['type'][6]) and table['type'][0] == 4
+    assert np.isnan(table['sem_voltage'][6])
+
+    cache_only = make_cinfdata(use_caching=True, cache_dir=cache_dir, cache_only=True)
+    cached_table = cache_only.get_metadata_table()
+    assert cached_table.dtype == table.dtype
+    for name in table.dtype.names:
+        np.testing.assert_array_equal(cached_table[name], table[name])
+
+
+def test_sync(make_cinfdata, database_file, cache_dir):
+    """sync mirrors new measurements in batches and continues from its high water mark"""
+    database = make_cinfdata(use_caching=True, cache_dir=cache_dir)
+    database.load_schemas()
+    # One query for the new ids, and one for metadata and one for data per batch
+    assert count_queries(database, database.sync, batch_size=4) == 5
+    assert database.cache.load_infoitem('general', 'sync_high_water_mark') == 6
+    cache_only = make_cinfdata(use_caching=True, cache_dir=cache_dir, cache_only=True)
+    for measurement_id in range(1, 7):
+        np.testing.assert_array_equal(cache_only.get_data(measurement_id),
+                                      make_cinfdata().get_data(measurement_id))
+        assert cache_only.get_metadata(measurement_id)['id'] == measurement_id
+
+    # A measurement without rows moves the high water mark, and later syncs only
+    # fetch measurements above it
+    execute(database_file, "INSERT INTO measurements_bench VALUES "
+            "(7, '2017-01-01 02:00:00', 'Aborted', 'M1', 1800.0, 4)")
+    assert database.sync() == [7]
+    assert count_queries(database, database.sync) == 1
+    execute(database_file, "INSERT INTO measurements_bench VALUES "
+            "(8, '2017-01-01 03:00:00', 'New', 'M1', 1800.0, 4)")
+    add_rows(database_file, 8, [0.0, 1.0], [2.0, 3.0])
+    reopened = make_cinfdata(use_caching=True, cache_dir=cache_dir)
+    assert reopened.sync() == [8]
+    assert reopened.cache.load_infoitem('general', 'sync_high_water_mark') == 8
+    np.testing.assert_array_equal(reopened.cache.load_data(8), [[0.0, 2.0], [1.0, 3.0]])
+    # An explicit since_id syncs again
+    assert reopened.sync(since_id=5) == [6, 7, 8]
+
+
+def test_write_behind_is_flushed_when_collected(database_file, cache_dir):
+    """Unflushed infoitems are written when a write behind instance is collected"""
+    def get_metadata():
+        database = Cinfdata(SETUP_NAME, use_caching=True, cache_dir=cache_dir,
+                            cache_write_behind=True, log_level='DISABLE',
+                            connection_factory=connection_factory(database_file))
+        database.get_metadata(3)
+
+    get_metadata()
+    gc.collect()
+    assert Cache(cache_dir, SETUP_NAME).has_infoitem('metadata', 3)
+
+
+@pytest.mark.parametrize('cache_data_layout', ['npy', 'chunked'])
+def test_scaling_memory_mapped_data(make_cinfdata, cache_dir, cache_data_layout):
+    """Memory mapped data is read only and scaling it does not change the cache"""
+    database = make_cinfdata(use_caching=True, cache_dir=cache_dir, mmap_mode='r',
+                             cache_data_layout=cache_data_layout)
+    original = np.array(database.get_data(1))
+    mapped = database.get_data(1)
+    np.testing.assert_array_equal(mapped, original)
+    assert not mapped.flags.writeable
+    scaled = database.get_data(1, scaling_factors=(10.0, None))
+    np.testing.assert_array_equal(scaled[:, 0], original[:, 0] * 10)
+    np.testing.assert_array_equal(database.get_data(1), original)
+    with pytest.raises(CinfdataCacheError):
+        make_cinfdata(use_caching=True, cache_dir=cache_dir, mmap_mode='r+')
+
+
+def test_stats(make_cinfdata, cache_dir):
+    """Calls, database queries and the caches are counted and timed"""
+    database = make_cinfdata(use_caching=True, cache_dir=cache_dir,
+                             memory_cache_entries=10)
+    database.load_schemas()
+    database.reset_stats()
+    updates = []
+    database.add_stats_hook(lambda *update: updates.append(update))
+    database.get_data(1)
+    database.get_data(1)
+    make_cinfdata(use_caching=True, cache_dir=cache_dir).get_data(1)
+    stats = database.stats()
+    timing = stats['timings']['get_data']
+    assert timing['count'] == 2
+    assert timing['min'] <= timing['max'] <= timing['total']
+    assert sum(count for _, count in timing['histogram']) == 2
+    counters = stats['counters']
+    assert counters['database.rows'] == 100
+    assert counters['database.bytes'] == 100 * 2 * 8
+    assert counters['cache.bytes_written'] == 100 * 2 * 8
+    assert (counters['memory_cache.hits'], counters['memory_cache.misses']) == (1, 1)
+    assert ('count', 'database.queries', 1) in updates
+    assert ('time', 'get_data') in [update[:2] for update in updates]
+
+    database.reset_stats()
+    stats = database.stats()
+    assert stats['timings'] == {}
+    assert stats['counters'] == {'memory_cache.hits': 0, 'memory_cache.misses': 0}
@@ -0,0 +1,57 @@
+"""Tests of the compression of cached arrays"""
+
+import numpy as np
+import pytest
+
+from cinfdata import (encode_array, decode_array, parse_compression, COMPRESSORS,
+                      CinfdataCacheError)
+
+
+COMPRESSIONS = [filters + compressor for compressor in sorted(COMPRESSORS)
+                for filters in ('', 'delta+', 'shuffle+', 'delta+shuffle+')]
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+@pytest.mark.parametrize('data', [
+    np.column_stack((np.linspace(0, 100, 1000), np.sin(np.linspace(0, 20, 1000)))),
+    np.arange(10, dtype=np.int32),
+    np.arange(12, dtype=np.int16).reshape(3, 4),
+    np.array([[np.nan, np.inf], [-np.inf, -0.0]]),
+    np.empty((0, 2)),
+], ids=['xy', 'int32', 'int16_2d', 'special_floats', 'empty'])
+def test_round_trip(compression, data):
+    """Decoding an encoded array gives the same array"""
+    decoded = decode_array(encode_array(data, compression))
+    assert decoded.dtype == data.dtype
+    assert decoded.shape == data.shape
+    np.testing.assert_array_equal(decoded, data)
+    assert decoded.flags.c_contiguous
+
+
+def test_filters_improve_compression_of_smooth_data():
+    """delta and shuffle make a smooth series compress better"""
+    data = np.column_stack((np.arange(10000.0), np.cumsum(np.ones(10000))))
+    plain = len(encode_array(data, 'zlib'))
+    filtered = len(encode_array(data, 'delta+shuffle+zlib'))
+    assert filtered < plain
+
+
+@pytest.mark.parametrize('compression', [
+    'gzip', 'shuffle+delta+zlib', 'delta+delta+zlib', 'foo+zlib', '',
+])
+def test_invalid_compression(compression):
+    """Invalid compression specifications are rejected"""
+    with pytest.raises(CinfdataCacheError):
+        parse_compression(compression)
+
+
+def test_parse_compression():
+    """The filters and the compressor are split"""
+    assert parse_compression('zlib') == ([], 'zlib')
+    assert parse_compression('delta+shuffle+zlib1') == (['delta', 'shuffle'], 'zlib1')
+
+
+def test_decode_uncompressed_data():
+    """Decoding bytes that are not an encoded array raises CinfdataCacheError"""
+    with pytest.raises(CinfdataCacheError):
+        decode_array(b'\x93NUMPY not compressed')
@@ -0,0 +1,89 @@
+"""Tests of downsampling and of the min/max/mean pyramid"""
+
+import numpy as np
+import pytest
+
+from cinfdata import (downsample, build_pyramid, pyramid_depth, DOWNSAMPLING_METHODS,
+                      CinfdataError)
+
+
+def make_data(number_of_rows=10000, seed=0):
+    """Return a noisy x, y dataset with a single sharp peak"""
+    random = np.random.RandomState(seed)
+    y = random.randn(number_of_rows)
+    y[number_of_rows // 3] = 100.0
+    return np.column_stack((np.arange(number_of_rows, dtype=float), y))
+
+
+@pytest.mark.parametrize('method', DOWNSAMPLING_METHODS)
+def test_number_of_points(method):
+    """Downsampling gives at most max_points rows, with x in the original order"""
+    data = make_data()
+    downsampled = downsample(data, 500, method)
+    assert len(downsampled) <= 500
+    assert downsampled.shape[1] == 2
+    assert np.all(np.diff(downsampled[:, 0]) > 0)
+
+
+@pytest.mark.parametrize('method', DOWNSAMPLING_METHODS)
+def test_short_data_is_returned_as_is(method):
+    """Data with no more than max_points rows is not downsampled"""
+    data = make_data(100)
+    assert downsample(data, 100, method) is data
+
+
+def test_minmax_keeps_extremes():
+    """minmax keeps the rows with the global minimum and maximum"""
+    data = make_data()
+    downsampled = downsample(data, 200, 'minmax')
+    assert downsampled[:, 1].max() == data[:, 1].max()
+    assert downsampled[:, 1].min() == data[:, 1].min()
+    # The rows are original rows
+    assert set(downsampled[:, 0]) <= set(data[:, 0])
+
+
+def test_lttb_keeps_first_last_and_peak():
+    """lttb keeps the first and last row and the visually significant peak"""
+    data = make_data()
+    downsampled = downsample(data, 300, 'lttb')
+    assert len(downsampled) == 300
+    np.testing.assert_array_equal(downsampled[0], data[0])
+    np.testing.assert_array_equal(downsampled[-1], data[-1])
+    assert 100.0 in downsampled[:, 1]
+
+
+def test_mean():
+    """mean averages buckets of consecutive rows"""
+    data = np.column_stack((np.arange(8.0), np.arange(8.0) * 2))
+    np.testing.assert_allclose(downsample(data, 4, 'mean'),
+                               [[0.5, 1.0], [2.5, 5.0], [4.5, 9.0], [6.5, 13.0]])
+
+
+def test_invalid_arguments():
+    """An unknown method or too few points raises CinfdataError"""
+    data = make_data(100)
+    with pytest.raises(CinfdataError):
+        downsample(data, 10, 'median')
+    with pytest.raises(CinfdataError):
+        downsample(data, 2, 'lttb')
+
+
+def test_pyramid_levels():
+    """Each level halves the rows and holds first x, min y, max y and mean y"""
+    data = make_data(1000)
+    levels = build_pyramid(data, min_rows=100)
+    assert len(levels) == pyramid_depth(1000, 100) == 4
+    assert [len(level) for level in levels] == [500, 250, 125, 63]
+    for level_number, level in enumerate(levels, start=1):
+        bucket_size = 2 ** level_number
+        for row_number in (0, 7, len(level) - 1):
+            bucket = data[row_number * bucket_size: (row_number + 1) * bucket_size]
+            np.testing.assert_allclose(level[row_number], [
+                bucket[0, 0], bucket[:, 1].min(), bucket[:, 1].max(), bucket[:, 1].mean()
+            ])
+
+
+def test_pyramid_of_short_data():
+    """Data with no more than min_rows rows has no levels"""
+    assert build_pyramid(make_data(100), min_rows=100) == []
+    assert pyramid_depth(100, 100) == 0
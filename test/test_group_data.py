@@ -0,0 +1,97 @@
+"""Tests of GroupData"""
+
+import numpy as np
+import pytest
+
+from cinfdata import GroupData, CinfdataError
+
+
+@pytest.fixture
+def group():
+    """A group with two members of different lengths and one empty member"""
+    group_of_data = {
+        1: np.array([[0.0, 1.0], [1.0, 3.0], [2.0, 5.0]]),
+        2: np.empty((0, 2)),
+        3: np.array([[0.0, 2.0], [2.0, 2.0]]),
+    }
+    return GroupData.from_dict(group_of_data, labels={1: 'M2', 2: 'M4', 3: 'M28'})
+
+
+def test_members(group):
+    """The members are views of the rows of each dataset"""
+    assert len(group) == 3
+    assert list(group) == [1, 2, 3]
+    assert 2 in group and 4 not in group
+    np.testing.assert_array_equal(group.lengths, [3, 0, 2])
+    np.testing.assert_array_equal(group.member_numbers, [0, 0, 0, 2, 2])
+    np.testing.assert_array_equal(group[3], [[0.0, 2.0], [2.0, 2.0]])
+    assert group[2].shape == (0, 2)
+    assert np.shares_memory(group[1], group.values)
+
+
+def test_to_dict(group):
+    """to_dict gives the members keyed by id or by label"""
+    assert sorted(group.to_dict()) == [1, 2, 3]
+    by_label = group.to_dict(use_labels=True)
+    np.testing.assert_array_equal(by_label['M28'], group[3])
+
+
+def test_to_dict_requires_unique_labels():
+    """Labels can only be used as keys if they are unique"""
+    group = GroupData.from_dict({1: np.ones((1, 2)), 2: np.ones((1, 2))},
+                                labels={1: 'M2', 2: 'M2'})
+    with pytest.raises(CinfdataError):
+        group.to_dict(use_labels=True)
+
+
+def test_scale(group):
+    """Scaling by a pair of factors or by label"""
+    group.scale((None, 10.0))
+    np.testing.assert_array_equal(group[1][:, 1], [10.0, 30.0, 50.0])
+    group.scale({'M28': (2.0, None)})
+    np.testing.assert_array_equal(group[3][:, 0], [0.0, 4.0])
+    np.testing.assert_array_equal(group[1][:, 0], [0.0, 1.0, 2.0])
+
+
+def test_scale_read_only_values():
+    """Read only values (e.g. from the memory cache) are copied before scaling"""
+    values = np.ones((2, 2))
+    values.flags.writeable = False
+    group = GroupData([1], values, [0, 2])
+    group.scale((2.0, None))
+    assert values[0, 0] == 1.0
+    assert group[1][0, 0] == 2.0
+
+
+@pytest.mark.parametrize('method, expected', [
+    ('sum', [9.0, np.nan, 4.0]),
+    ('mean', [3.0, np.nan, 2.0]),
+    ('min', [1.0, np.nan, 2.0]),
+    ('max', [5.0, np.nan, 2.0]),
+    ('integral', [6.0, np.nan, 4.0]),
+])
+def test_reduce(group, method, expected):
+    """Each member is reduced to one number and empty members give NaN"""
+    np.testing.assert_allclose(group.reduce(method), expected)
+
+
+def test_reduce_invalid_method(group):
+    """An unknown reduce method raises CinfdataError"""
+    with pytest.raises(CinfdataError):
+        group.reduce('median')
+
+
+def test_resample(group):
+    """Members are interpolated onto a common grid, NaN outside their x range"""
+    x, resampled = group.resample(x=[0.0, 0.5, 1.5, 2.0, 3.0])
+    np.testing.assert_array_equal(x, [0.0, 0.5, 1.5, 2.0, 3.0])
+    np.testing.assert_allclose(resampled[0], [1.0, 2.0, 4.0, 5.0, np.nan])
+    assert np.isnan(resampled[1]).all()
+    np.testing.assert_allclose(resampled[2], [2.0, 2.0, 2.0, 2.0, np.nan])
+
+
+def test_resample_default_grid(group):
+    """The default grid spans the x values of all the members"""
+    x, resampled = group.resample(number_of_points=5)
+    np.testing.assert_allclose(x, [0.0, 0.5, 1.0, 1.5, 2.0])
+    assert resampled.shape == (3, 5)